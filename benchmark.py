@@ -0,0 +1,530 @@
+import argparse
+import asyncio
+import json
+import logging
+import math
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import unquote
+
+import openai
+
+from encode import English2RussianEncoder, English2RussianNoteTemplate
+from generate import Chinese2RussianGenerator
+from src import create_logger, ApkgWriter, AsyncCrawler, Crawler, ChatGPT, Generator, \
+    Journal, ResponseCache, Scheduler
+from src.parsers import PARSERS
+from src.stand_in import StandInCompletionServer, StandInServer, load_pages
+
+
+def bench_crawler(args, logger) -> dict:
+    r"""Measures the throughput of the threaded `Crawler` against the pooled
+        `AsyncCrawler` on canned pages served by a local stand-in server.
+    """
+    pages = load_pages(args.metadataset_path, limit=args.num_words)
+    indexes = list(pages)
+    report = {'words': len(indexes), 'latency': args.latency}
+
+    with StandInServer(pages, latency=args.latency) as server:
+        crawler = Crawler(logger=logger, base_url=server.base_url)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.num_threads) as pool:
+            results = list(pool.map(crawler, indexes))
+        elapsed = time.perf_counter() - start
+        report['thread'] = {'num_threads': args.num_threads,
+                            'seconds': round(elapsed, 3),
+                            'words_per_sec': round(len(indexes) / elapsed, 1),
+                            'failures': results.count(None)}
+
+        async def run_async() -> list:
+            async with AsyncCrawler(logger=logger, base_url=server.base_url,
+                                    max_connections=args.max_connections) as c:
+                semaphore = asyncio.Semaphore(args.concurrency)
+
+                async def task(index: str) -> tuple:
+                    async with semaphore:
+                        return await c(index)
+
+                return await asyncio.gather(*[task(i) for i in indexes])
+
+        start = time.perf_counter()
+        results = asyncio.run(run_async())
+        elapsed = time.perf_counter() - start
+        report['async'] = {'concurrency': args.concurrency,
+                           'max_connections': args.max_connections,
+                           'seconds': round(elapsed, 3),
+                           'words_per_sec': round(len(indexes) / elapsed, 1),
+                           'failures': results.count(None)}
+
+    return report
+
+
+def load_corpus(corpus_path: str, metadataset_path: str, limit: int) -> dict:
+    r"""Loads stored pages keyed by index, either from a response cache, from
+        a directory of `.html` files, or rendered from a metadata dataset.
+    """
+    if corpus_path is None:
+        return load_pages(metadataset_path, limit=limit)
+
+    pages = dict()
+    if os.path.isfile(os.path.join(corpus_path, 'index.sqlite3')):
+        cache = ResponseCache(corpus_path)
+        for url, body in cache.items():
+            pages[unquote(url.rsplit('/', 1)[-1])] = body
+            if len(pages) >= limit:
+                break
+        cache.close()
+    else:
+        for entry in sorted(os.scandir(corpus_path), key=lambda e: e.name)[:limit]:
+            if entry.name.endswith('.html'):
+                with open(entry.path, 'rb') as file:
+                    pages[entry.name[:-5]] = file.read()
+
+    return pages
+
+
+def bench_parser(args, logger) -> dict:
+    r"""Checks that every parser backend gives byte-identical output to the
+        reference `bs4` extractor on a stored corpus, and measures pages/sec.
+    """
+    pages = load_corpus(args.corpus, args.metadataset_path, args.num_words)
+    pages = {index: body.decode('utf-8') for index, body in pages.items()}
+    report = {'pages': len(pages)}
+
+    def extract(parser, index: str, html: str):
+        try:
+            return parser(index, html)
+        except Exception as e:
+            return type(e).__name__
+
+    for name, parser in PARSERS.items():
+        start = time.perf_counter()
+        outputs = {index: extract(parser, index, html)
+                   for index, html in pages.items()}
+        elapsed = time.perf_counter() - start
+        report[name] = {'seconds': round(elapsed, 3),
+                        'pages_per_sec': round(len(pages) / elapsed, 1)}
+
+        if name == 'bs4':
+            reference = outputs
+        else:
+            mismatches = [index for index in pages
+                          if outputs[index] != reference[index]]
+            report[name]['mismatches'] = len(mismatches)
+            for index in mismatches[:10]:
+                logger.error(f'Backend `{name}` differs from `bs4` on `{index}`.')
+
+    return report
+
+
+def bench_encode(args, logger) -> dict:
+    r"""Measures how metadata loading and field rendering scale with the
+        number of worker processes of `Encoder`, checking that every run gives
+        the output of the serial one.
+    """
+    indexes = sorted(entry.name[:-4] for entry in os.scandir(args.metadataset_path)
+                     if entry.name.endswith('.txt'))
+    report = {'words': len(indexes), 'cores': os.cpu_count(), 'runs': list()}
+
+    reference, serial = None, None
+    for workers in args.workers:
+        encoder = English2RussianEncoder(template=English2RussianNoteTemplate(),
+                                         divider='++++++++++', logger=logger,
+                                         workers=workers)
+        start = time.perf_counter()
+        metadata = encoder._get_metadata_list(indexes, args.metadataset_path)
+        elapsed = time.perf_counter() - start
+
+        reference = metadata if reference is None else reference
+        serial = elapsed if serial is None else serial
+        run = {'workers': workers, 'seconds': round(elapsed, 3),
+               'words_per_sec': round(len(indexes) / elapsed, 1),
+               'speedup': round(serial / elapsed, 2),
+               'identical': metadata == reference}
+        logger.info(f'{json.dumps(run)}')
+        report['runs'].append(run)
+
+    return report
+
+
+def bench_render(args, logger) -> dict:
+    r"""Checks the rendered fields of every word against a golden output, and
+        measures the lines/sec of every `FieldRenderer` of the English note.
+    """
+    encoder = English2RussianEncoder(template=English2RussianNoteTemplate(),
+                                     divider='++++++++++', logger=logger)
+    indexes = sorted(entry.name[:-4] for entry in os.scandir(args.metadataset_path)
+                     if entry.name.endswith('.txt'))
+    metadata = encoder._get_metadata_list(indexes, args.metadataset_path)
+    rendered = {fields[0]: fields for fields in metadata}
+    report = {'words': len(rendered)}
+
+    if os.path.isfile(args.golden):
+        with open(args.golden, 'r', encoding='utf-8') as file:
+            golden = json.load(file)
+        mismatches = [word for word in golden if rendered.get(word) != golden[word]]
+        mismatches += [word for word in rendered if word not in golden]
+        report['golden_mismatches'] = len(mismatches)
+        for word in mismatches[:10]:
+            logger.error(f'Rendered fields of `{word}` differ from `{args.golden}`.')
+    else:
+        with open(args.golden, 'w', encoding='utf-8') as file:
+            json.dump(rendered, file, ensure_ascii=False)
+        logger.info(f'Wrote the golden output to `{args.golden}`.')
+
+    # the slice every renderer is applied to by `_sort_slices`
+    slices = list()
+    for index in indexes:
+        with open(os.path.join(args.metadataset_path, f'{index}.txt'), 'r') as file:
+            slices.append(list(filter(None, file.read().strip().split('++++++++++'))))
+    for field, position in (('Tags', 2), ('Translation', 4), ('Examples', 5)):
+        renderer = encoder.renderers[field]
+        strings = [metadata_slices[position] for metadata_slices in slices]
+        lines = sum(string.strip('\n').count('\n') + 1 for string in strings)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for string in strings:
+                renderer(string)
+        elapsed = (time.perf_counter() - start) / args.repeat
+        report[field] = {'lines': lines, 'seconds': round(elapsed, 4),
+                         'lines_per_sec': round(lines / elapsed, 1)}
+
+    return report
+
+
+def bench_package(args, logger) -> dict:
+    r"""Compares packaging the media of every dataset deflated, as a zip
+        would by default, with the `ApkgWriter` storing MP3s as they are and
+        deduplicating identical files.
+    """
+    report = dict()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for mediaset_path in args.mediaset_paths:
+            media = sorted(entry.path for entry in os.scandir(mediaset_path)
+                           if entry.name.endswith('.mp3'))
+            source = sum(os.path.getsize(path) for path in media)
+
+            deflated_file = os.path.join(temp_dir, 'deflated.zip')
+            start = time.perf_counter()
+            with zipfile.ZipFile(deflated_file, 'w', zipfile.ZIP_DEFLATED) as outzip:
+                for idx, path in enumerate(media):
+                    outzip.write(path, str(idx))
+            deflated = time.perf_counter() - start
+
+            stored_file = os.path.join(temp_dir, 'stored.apkg')
+            start = time.perf_counter()
+            with ApkgWriter(stored_file, 1, 'bench', English2RussianNoteTemplate(),
+                            dedupe=True) as writer:
+                for path in media:
+                    writer.add_media(path)
+            stored = time.perf_counter() - start
+
+            run = {'files': len(media), 'source_bytes': source,
+                   'deflated_bytes': os.path.getsize(deflated_file),
+                   'deflated_seconds': round(deflated, 3),
+                   'stored_bytes': os.path.getsize(stored_file),
+                   'stored_seconds': round(stored, 3),
+                   'duplicates': len(writer.aliases),
+                   'duplicate_bytes': writer.saved_bytes}
+            run['extra_bytes'] = run['stored_bytes'] - run['deflated_bytes']
+            run['seconds_saved'] = round(deflated - stored, 3)
+            logger.info(f'`{mediaset_path}`: {json.dumps(run)}')
+            report[mediaset_path] = run
+
+    return report
+
+
+class Timed:
+    r"""A generator mixin recording the latency of every word, from its call
+        to its metadata being saved, or with the 'pipeline' executor from its
+        fetch to the write of its batch."""
+    latencies: list
+
+    def _get_metadata(self, index: str) -> None:
+        start = time.perf_counter()
+        try:
+            return super()._get_metadata(index)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+    async def _get_metadata_async(self, index: str) -> None:
+        start = time.perf_counter()
+        try:
+            return await super()._get_metadata_async(index)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+    def _run_pipeline(self, indexes: list, **kwargs) -> None:
+        self.started = dict()
+        fetch = self.functions._fetch_html
+
+        def timed_fetch(index: str) -> str:
+            self.started[index] = time.perf_counter()
+            return fetch(index)
+
+        self.functions._fetch_html = timed_fetch
+        try:
+            return super()._run_pipeline(indexes, **kwargs)
+        finally:
+            del self.functions._fetch_html
+
+    def _save_batch(self, results: list) -> None:
+        try:
+            return super()._save_batch(results)
+        finally:
+            now = time.perf_counter()
+            for index, *_ in results:
+                start = self.started.pop(index, None)
+                if start is not None:
+                    self.latencies.append(now - start)
+
+
+class TimedCrawlerGenerator(Timed, Chinese2RussianGenerator):
+    pass
+
+
+class CompletionGenerator(Generator):
+    def _get_metadata(self, index: str) -> None:
+        completion = self.functions(index)
+        self._save_metadata(index, (index, index, completion)
+                            if completion is not None else None)
+
+
+class TimedCompletionGenerator(Timed, CompletionGenerator):
+    pass
+
+
+def percentile(values: list, p: float) -> float:
+    r"""Returns the nearest-rank percentile of sorted values, or None."""
+    if not values:
+        return None
+    value = values[min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))]
+    return round(value, 4)
+
+
+def run_generate(config: dict) -> dict:
+    r"""Runs one configuration of `Generator.__call__` against the stand-in
+        servers. Meant to run in a fresh process, so that the peak RSS only
+        accounts for this configuration.
+    """
+    logger = create_logger(logger_name='bench_generate_run',
+                           logger_level=logging.CRITICAL)
+    save_path = tempfile.mkdtemp()
+    indexes_file = os.path.join(save_path, 'indexes.txt')
+    with open(indexes_file, 'w') as file:
+        file.write('\n'.join(config['indexes']) + '\n')
+
+    scheduler = Scheduler(max_concurrency=config['concurrency']
+                          if config['executor'] == 'async' else config['num_threads'],
+                          base_delay=0.05, max_delay=1)
+    if config['workload'] == 'crawler':
+        crawler_class = AsyncCrawler if config['executor'] == 'async' else Crawler
+        functions = crawler_class(logger=logger, base_url=config['base_url'],
+                                  parser=config['parser'], scheduler=scheduler)
+        generator = TimedCrawlerGenerator(save_path=save_path,
+                                          divider='\n++++++++++\n',
+                                          functions=functions, logger=logger)
+    else:
+        openai.api_base = config['base_url']
+        functions = ChatGPT(api_key='sk-benchmark', engine='text-davinci-003',
+                            prompt=r'resources/prompts/english2russian.txt',
+                            articulation='现在是第一个单词',
+                            logger=logger, scheduler=scheduler)
+        generator = TimedCompletionGenerator(save_path=save_path,
+                                             divider='\n++++++++++\n',
+                                             functions=functions, logger=logger)
+    generator.latencies = list()
+
+    start = time.perf_counter()
+    generator(indexes_file=indexes_file, num_threads=config['num_threads'],
+              executor=config['executor'], concurrency=config['concurrency'])
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(generator.latencies)
+    failures = sum(status == Journal.FAILED
+                   for status, _, _ in generator.journal.entries.values())
+    # the parse workers of the 'pipeline' executor are children, reaped once
+    # the generator returns
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    peak_rss *= 1 if sys.platform == 'darwin' else 1024
+    shutil.rmtree(save_path)
+
+    return {'workload': config['workload'], 'executor': config['executor'],
+            'num_threads': config['num_threads'] if config['executor'] != 'async' else None,
+            'concurrency': config['concurrency'] if config['executor'] == 'async' else None,
+            'words': len(config['indexes']), 'failures': failures,
+            'seconds': round(elapsed, 3),
+            'words_per_sec': round(len(config['indexes']) / elapsed, 1),
+            'latency_p50': percentile(latencies, 50),
+            'latency_p95': percentile(latencies, 95),
+            'latency_p99': percentile(latencies, 99),
+            'peak_rss_mb': round(peak_rss / 2 ** 20, 1)}
+
+
+def bench_generate(args, logger) -> dict:
+    r"""Drives `Generator.__call__` end to end against a stand-in openrussian
+        server and a stand-in completion endpoint, over a grid of workloads,
+        executors, thread counts and corpus sizes.
+    """
+    pages = load_pages(args.metadataset_path, limit=max(args.sizes))
+    indexes = list(pages)
+    report = {'corpus': len(indexes), 'runs': list()}
+
+    context = multiprocessing.get_context('spawn')
+    with StandInServer(pages, latency=args.latency,
+                       error_rate=args.error_rate) as server, \
+            StandInCompletionServer(latency=args.llm_latency,
+                                    error_rate=args.llm_error_rate) as llm_server:
+        for workload in args.workloads:
+            for size in args.sizes:
+                for executor in args.executors:
+                    if executor != 'thread' and workload != 'crawler':
+                        continue
+                    threads = args.num_threads if executor != 'async' else [None]
+                    for num_threads in threads:
+                        config = {'workload': workload, 'executor': executor,
+                                  'num_threads': num_threads or 1,
+                                  'concurrency': args.concurrency,
+                                  'parser': args.parser,
+                                  'indexes': indexes[:size],
+                                  'base_url': server.base_url if workload == 'crawler'
+                                  else llm_server.base_url}
+                        with ProcessPoolExecutor(max_workers=1,
+                                                 mp_context=context) as pool:
+                            run = pool.submit(run_generate, config).result()
+                        logger.info(f'{json.dumps(run)}')
+                        report['runs'].append(run)
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Let\'s measure the Babel Tower!')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    crawler_parser = subparsers.add_parser(
+        'crawler', help='Threaded vs async crawler on a local stand-in server.')
+    crawler_parser.add_argument('-d', '--metadataset_path', type=str,
+                                default='resources/datasets/russian/english/metadata',
+                                help='Path to the metadataset dir the canned '
+                                     'pages are rendered from')
+    crawler_parser.add_argument('-w', '--num_words', type=int, default=2000,
+                                help='Number of pages to crawl')
+    crawler_parser.add_argument('-l', '--latency', type=float, default=0.05,
+                                help='Artificial delay in seconds of every response')
+    crawler_parser.add_argument('-n', '--num_threads', type=int, default=4,
+                                help='Number of threads of the threaded crawler')
+    crawler_parser.add_argument('-c', '--concurrency', type=int, default=256,
+                                help='Number of in-flight words of the async crawler')
+    crawler_parser.add_argument('--max_connections', type=int, default=64,
+                                help='Number of pooled connections of the async crawler')
+
+    parser_parser = subparsers.add_parser(
+        'parser', help='Parser backends against the bs4 reference extractor.')
+    parser_parser.add_argument('-p', '--corpus', type=str, default=None,
+                               help='Path to a response cache or a dir of .html '
+                                    'pages, defaults to pages rendered from the '
+                                    'metadataset')
+    parser_parser.add_argument('-d', '--metadataset_path', type=str,
+                               default='resources/datasets/russian/english/metadata',
+                               help='Path to the metadataset dir the canned '
+                                    'pages are rendered from')
+    parser_parser.add_argument('-w', '--num_words', type=int, default=2000,
+                               help='Number of pages to parse')
+
+    generate_parser = subparsers.add_parser(
+        'generate', help='End-to-end generation against local stand-in servers.')
+    generate_parser.add_argument('-d', '--metadataset_path', type=str,
+                                 default='resources/datasets/russian/english/metadata',
+                                 help='Path to the metadataset dir the canned '
+                                      'pages are rendered from')
+    generate_parser.add_argument('-w', '--sizes', type=int, nargs='+',
+                                 default=[200, 1000],
+                                 help='Corpus sizes to generate')
+    generate_parser.add_argument('-n', '--num_threads', type=int, nargs='+',
+                                 default=[1, 4, 16],
+                                 help='Numbers of threads of the thread executor')
+    generate_parser.add_argument('-e', '--executors', type=str, nargs='+',
+                                 default=['thread', 'async', 'pipeline'],
+                                 choices=['thread', 'async', 'pipeline'],
+                                 help='Executors of Generator.__call__')
+    generate_parser.add_argument('-c', '--concurrency', type=int, default=256,
+                                 help='Number of in-flight words of the async executor')
+    generate_parser.add_argument('-k', '--workloads', type=str, nargs='+',
+                                 default=['crawler', 'chatgpt'],
+                                 choices=['crawler', 'chatgpt'],
+                                 help='Functions driven by the generator')
+    generate_parser.add_argument('-p', '--parser', type=str, default='bs4',
+                                 choices=list(PARSERS),
+                                 help='HTML extraction backend of the crawler')
+    generate_parser.add_argument('-l', '--latency', type=float, default=0.02,
+                                 help='Delay in seconds of every page')
+    generate_parser.add_argument('--error_rate', type=float, default=0,
+                                 help='Fraction of throttled page requests')
+    generate_parser.add_argument('--llm_latency', type=float, default=0.2,
+                                 help='Delay in seconds of every completion')
+    generate_parser.add_argument('--llm_error_rate', type=float, default=0,
+                                 help='Fraction of throttled completion requests')
+    generate_parser.add_argument('-o', '--output', type=str, default=None,
+                                 help='Path to also write the JSON report to')
+    encode_parser = subparsers.add_parser(
+        'encode', help='Metadata loading and rendering across worker processes.')
+    encode_parser.add_argument('-d', '--metadataset_path', type=str,
+                               default='resources/datasets/russian/english/metadata',
+                               help='Path to the metadataset dir')
+    encode_parser.add_argument('-w', '--workers', type=int, nargs='+',
+                               default=[1, 2, 4, 8],
+                               help='Numbers of worker processes, the first one '
+                                    'being the baseline')
+    encode_parser.add_argument('-o', '--output', type=str, default=None,
+                               help='Path to also write the JSON report to')
+    render_parser = subparsers.add_parser(
+        'render', help='Golden check and throughput of the field renderers.')
+    render_parser.add_argument('-d', '--metadataset_path', type=str,
+                               default='resources/datasets/russian/english/metadata',
+                               help='Path to the metadataset dir')
+    render_parser.add_argument('-g', '--golden', type=str,
+                               default='outputs/golden_fields.json',
+                               help='Path to the golden output, written if missing')
+    render_parser.add_argument('-r', '--repeat', type=int, default=3,
+                               help='Number of timed passes over every field')
+    package_parser = subparsers.add_parser(
+        'package', help='Deflated against stored and deduplicated media.')
+    package_parser.add_argument('-m', '--mediaset_paths', type=str, nargs='+',
+                                default=['resources/datasets/russian/english/media',
+                                         'resources/datasets/russian/chinese/media'],
+                                help='Paths to the mediaset dirs')
+    package_parser.add_argument('-o', '--output', type=str, default=None,
+                                help='Path to also write the JSON report to')
+    args = parser.parse_args()
+
+    logger = create_logger(logger_name=f'bench_{args.benchmark}')
+
+    if args.benchmark == 'crawler':
+        report = bench_crawler(args, logger)
+    elif args.benchmark == 'parser':
+        report = bench_parser(args, logger)
+    elif args.benchmark == 'generate':
+        report = bench_generate(args, logger)
+    elif args.benchmark == 'encode':
+        report = bench_encode(args, logger)
+    elif args.benchmark == 'render':
+        report = bench_render(args, logger)
+    elif args.benchmark == 'package':
+        report = bench_package(args, logger)
+    else:
+        raise NotImplementedError
+
+    print(json.dumps(report, indent=2))
+    if getattr(args, 'output', None):
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
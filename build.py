@@ -0,0 +1,188 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+
+from encode import English2RussianEncoder, English2RussianNoteTemplate
+from src import create_logger, BuildGraph, BuildManifest, Transcoder
+
+
+def _hash(*digests: str) -> str:
+    return hashlib.sha256('\n'.join(digests).encode('utf-8')).hexdigest()
+
+
+def create_graph(encoder, manifest: BuildManifest, logger, args) -> BuildGraph:
+    r"""Models the encoding of the decks as a build graph:
+
+        index -----> metadata --+--> fields --+--> band_{bound} --+--> deck_{bound}
+            |        renderer --'-------------+                   |
+            '------> media -------------------'        template --+
+                                                       settings --'
+
+        The metadata and media nodes hash every word file, reading only the
+        ones whose size or mtime changed, and the fields node renders only
+        the words whose metadata changed, unless the renderer did. A band
+        node hashes the words of a band and the bitrate fitting their audio
+        in the budget, so that its deck is transcoded and written again only
+        if one of them changed. The settings node hashes every option
+        changing the output. Only the deck nodes write files, so that a dry
+        run has no side effects.
+    """
+    graph = BuildGraph(manifest, logger, workers=args.workers)
+    bands = sorted(set(args.bands)) if args.bands else [args.max_word_freq]
+    state = dict()
+    # the transcoder records the settings of its last run
+    transcoding = threading.Lock()
+
+    def index() -> str:
+        frequencies = encoder.get_frequencies(args.index_file)
+        state['indexes'] = [index for index, frequency in frequencies.items()
+                            if frequency <= bands[-1]]
+        state['frequencies'] = frequencies
+        return BuildManifest.hash_file(args.index_file)
+
+    def metadata(index_digest: str) -> str:
+        state['plan'] = encoder.plan_metadata(state['indexes'], args.metadataset_path)
+        return manifest.digest('metadata', state['indexes'])
+
+    def media(index_digest: str) -> str:
+        media, state['digests'] = encoder.find_media(state['indexes'], args.mediaset_path)
+        state['media'] = {os.path.basename(path)[:-4]: path for path in media}
+        return manifest.digest('media', list(state['media']))
+
+    def settings() -> str:
+        transcoder = encoder.transcoder
+        return _hash(json.dumps([encoder.dedupe_media, None if transcoder is None else [
+            list(transcoder.bitrates), transcoder.budget, transcoder.sample_rate,
+            transcoder.trim_silence, transcoder.normalize]]))
+
+    def fields(metadata_digest: str, renderer_digest: str) -> str:
+        encoder.check_renderer()
+        for _ in encoder.iter_rendered(state['plan']):
+            pass
+        manifest.commit()
+        return _hash(metadata_digest, renderer_digest)
+
+    def band(bound: int):
+        def action(fields_digest: str, media_digest: str, renderer_digest: str) -> str:
+            words = [index for index in state['indexes']
+                     if state['frequencies'][index] <= bound]
+            media = [state['media'][index] for index in words if index in state['media']]
+            variant = ''
+            if encoder.transcoder is not None:
+                # only reads the durations, the audio is transcoded by the deck
+                variant = encoder.transcoder.get_variant(
+                    encoder.transcoder.pick_bitrate(media))
+            state[f'band_{bound}'] = words, media
+            return _hash(manifest.digest('metadata', words),
+                         manifest.digest('media', [index for index in words
+                                                   if index in state['media']]),
+                         renderer_digest, variant)
+        return action
+
+    def deck(bound: int, apkg_path: str, deck_id: int, deck_name: str):
+        def action(*digests: str) -> str:
+            band, band_media = state[f'band_{bound}']
+            if encoder.transcoder is not None:
+                with transcoding:
+                    band_media = encoder.transcoder(band_media, digests=state['digests'])
+            digests = {job[0]: job[3] for job in state['plan']}
+            band_fields = {index: manifest.get_fields('metadata', index, digests[index])
+                           for index in band if index in digests}
+            encoder.write_band(apkg_path, deck_id, deck_name, band, band_media,
+                               band_fields)
+            return BuildManifest.hash_file(apkg_path)
+        return action
+
+    graph.add('index', index)
+    graph.add('template', encoder.template_digest)
+    graph.add('renderer', encoder.renderer_digest)
+    graph.add('settings', settings)
+    graph.add('metadata', metadata, deps=['index'], always=True)
+    graph.add('media', media, deps=['index'], always=True)
+    graph.add('fields', fields, deps=['metadata', 'renderer'])
+    for bound in bands:
+        if args.bands:
+            deck_id, deck_name = args.deck_id * 1000000 + bound, f'{args.deck_name}_{bound}'
+        else:
+            deck_id, deck_name = args.deck_id, args.deck_name
+        apkg_path = os.path.join(args.save_path, f'{deck_id}_{deck_name}.apkg')
+        graph.add(f'band_{bound}', band(bound), deps=['fields', 'media', 'renderer'],
+                  always=True)
+        graph.add(f'deck_{bound}', deck(bound, apkg_path, deck_id, deck_name),
+                  deps=[f'band_{bound}', 'template', 'settings'],
+                  outputs=[apkg_path])
+
+    return graph
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Rebuild the stale decks of the Babel Tower.')
+    parser.add_argument('-t', '--task', type=str, required=True,
+                        choices=['chinese', 'english'],
+                        help='')
+    parser.add_argument('-i', '--index_file', type=str, required=True,
+                        help='Path to the index file')
+    parser.add_argument('-f', '--max_word_freq', type=int, default=None,
+                        help='Maximum frequency of the words in the deck')
+    parser.add_argument('-b', '--bands', type=int, nargs='+', default=None,
+                        help='Maximum word frequencies of one deck each')
+    parser.add_argument('-d', '--metadataset_path', type=str, required=True,
+                        help='Path to the metadataset dir or metadata store')
+    parser.add_argument('-m', '--mediaset_path', type=str, required=True,
+                        help='Path to the mediaset dir')
+    parser.add_argument('-s', '--save_path', type=str, default='outputs',
+                        help='Path to the save dir')
+    parser.add_argument('-w', '--workers', type=int, default=4,
+                        help='Number of nodes built at once')
+    parser.add_argument('-n', '--dry_run', action='store_true',
+                        help='Only tell which nodes are stale.')
+    parser.add_argument('--dedupe_media', action='store_true',
+                        help='Store byte-identical audio files once.')
+    parser.add_argument('--transcode', action='store_true',
+                        help='Package audio transcoded to smaller, trimmed and '
+                             'loudness-normalized MP3s, cached in the save dir.')
+    parser.add_argument('--media_budget', type=float, default=None,
+                        help='Size in MB the transcoded audio of each deck should '
+                             'fit in, picking the bitrate.')
+    parser.add_argument('--transcode_workers', type=int, default=None,
+                        help='Number of concurrent ffmpeg processes.')
+    args = parser.parse_args()
+    if (args.max_word_freq is None) == (args.bands is None):
+        parser.error('either --max_word_freq or --bands is required')
+
+    if not os.path.isdir(args.save_path):
+        os.makedirs(args.save_path)
+
+    if args.task == 'chinese':
+        raise NotImplementedError
+    elif args.task == 'english':
+        logger = create_logger(logger_file=f'{args.save_path}/build_en2ru.log',
+                               logger_name='build_en2ru')
+        transcoder = None
+        if args.transcode:
+            budget = int(args.media_budget * 1e6) if args.media_budget else None
+            transcoder = Transcoder(cache_path=os.path.join(args.save_path, 'transcoded'),
+                                    logger=logger, budget=budget,
+                                    workers=args.transcode_workers)
+        # apart from the manifest of encode.py, whose records of the decks
+        # would otherwise overwrite the ones of the graph
+        manifest = BuildManifest(os.path.join(args.save_path, 'build_graph.sqlite3'))
+        russian_encoder = English2RussianEncoder(template=English2RussianNoteTemplate(),
+                                                 divider='++++++++++',
+                                                 logger=logger,
+                                                 manifest=manifest,
+                                                 dedupe_media=args.dedupe_media,
+                                                 transcoder=transcoder)
+        args.deck_id, args.deck_name = 1002, '俄语卡组'
+    else:
+        raise NotImplementedError
+
+    status = create_graph(russian_encoder, manifest, logger, args)(dry_run=args.dry_run)
+    for name, state in status.items():
+        logger.info(f'{name:<12} {state}')
+    manifest.close()
+    if any(state in ('failed', 'blocked') for state in status.values()):
+        raise SystemExit(1)
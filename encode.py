@@ -1,8 +1,9 @@
 import argparse
 import os
-import re
 
-from src import create_logger, Encoder, NoteTemplate
+from src import create_logger, BuildManifest, Encoder, FieldRenderer, NoteTemplate, \
+    Transcoder, WordIndex
+from src.word_index import LEVELS
 
 
 ########################################
@@ -57,20 +58,50 @@ class English2RussianNoteTemplate(NoteTemplate):
 
 
 class English2RussianEncoder(Encoder):
+    renderers = {
+        'Tags': FieldRenderer(joiner='<br>', lower=True),
+        'Translation': FieldRenderer(
+            container=('<ol>', '</ol>'), item=('<li>', '</li>'),
+            rules=[('(Also|Example|Info)', ' <br> \\1')],
+            tail=(' <br> ', '<span style="color: gray">', '</span>')),
+        'Examples': FieldRenderer(
+            container=('<ul class="partial_list">', '</ul>'), item=('<li>', '</li>'),
+            rules=[(' \\| ', ' <br> ')],
+            tail=(' <br> ', '<span style="color: gray">', '</span>'),
+            tail_closed=True),
+    }
+
     @staticmethod
-    def _get_indexes(indexes_file: str, max_word_freq: int = None) -> list:
+    def _get_indexes(indexes_file: str, max_word_freq: int = None,
+                     pos: list = None, levels: list = None, tags: list = None) -> list:
+        if WordIndex.is_index(indexes_file):
+            with WordIndex(indexes_file) as index:
+                return index.select(max_freq=max_word_freq, pos=pos,
+                                    levels=levels, tags=tags)
+        if pos or levels or tags:
+            raise ValueError('Selecting words by part of speech, level or tags '
+                             'needs a word index!')
+
+        indexes = list()
         with open(indexes_file, 'r') as file:
-            indexes = [line.strip().split('\t')[0] for line in file
-                       if int(line.strip().split('\t')[1]) <= max_word_freq]
+            for line in file:
+                fields = line.strip().split('\t')
+                if not fields[0]:
+                    continue
+                if max_word_freq is None:
+                    indexes.append(fields[0])
+                elif len(fields) > 1 and fields[1].isdigit() and \
+                        int(fields[1]) <= max_word_freq:
+                    indexes.append(fields[0])
 
         return indexes
 
     def _sort_slices(self, slices: list) -> list:
         word = slices[1]
         audio = f"[sound:{slices[1][:-1]}.mp3]"
-        tags = tags_regex(slices[2])
-        translation = translation_regex(slices[4])
-        examples = examples_regex(slices[5])
+        tags = self.renderers['Tags'](slices[2])
+        translation = self.renderers['Translation'](slices[4])
+        examples = self.renderers['Examples'](slices[5])
         notes = ''
         _bare = ', '.join([slices[0].lower(),
                            slices[0].capitalize(),
@@ -86,40 +117,6 @@ class English2RussianEncoder(Encoder):
                 _version]
 
 
-def tags_regex(string: str) -> str:
-    return re.sub('\n', '<br>', string.strip('\n')).lower()
-
-
-def translation_regex(string: str) -> str:
-    translation_list = string.strip('\n').split('\n')
-
-    _ = ['<ol>']
-    for translation in translation_list:
-        translation = re.sub('^', '<li>', translation)
-        translation = re.sub('$', '</li>', translation)
-        translation = re.sub('(Also|Example|Info)', ' <br> \\1', translation)
-        translation = re.sub(' <br> (.*)$', ' <br> <span style="color: gray">\\1</span>', translation)
-        _.append(translation)
-    _.append('</ol>')
-
-    return '\n'.join(_)
-
-
-def examples_regex(string: str) -> str:
-    example_list = string.strip('\n').split('\n')
-
-    _ = ['<ul class=\"partial_list\">']
-    for example in example_list:
-        example = re.sub('^', '<li>', example)
-        example = re.sub('$', '</li>', example)
-        example = re.sub(' \| ', ' <br> ', example)
-        example = re.sub(' <br> (.*)</li>', ' <br> <span style="color: gray">\\1</span></li>', example)
-        _.append(example)
-    _.append('</ul>')
-
-    return '\n'.join(_)
-
-
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Let\'s build the Babel Tower!')
@@ -127,18 +124,48 @@ if __name__ == '__main__':
                         choices=['chinese', 'english'],
                         help='')
     parser.add_argument('-i', '--index_file', type=str, required=True,
-                        help='Path to the index file')
-    parser.add_argument('-f', '--max_word_freq', type=int, required=True,
-                        help='Path to the index file')
+                        help='Path to the index file or word index')
+    parser.add_argument('-f', '--max_word_freq', type=int, default=None,
+                        help='Maximum frequency of the words in the deck')
+    parser.add_argument('-b', '--bands', type=int, nargs='+', default=None,
+                        help='Maximum word frequencies of the decks of a sharded '
+                             'build, e.g. 1000 5000 10000 30000 99999')
+    parser.add_argument('--pos', type=str, nargs='+', default=None,
+                        help='Parts of speech of the words in the deck, with a '
+                             'word index, e.g. noun verb')
+    parser.add_argument('--levels', type=str, nargs='+', default=None,
+                        choices=LEVELS,
+                        help='Lowest and highest CEFR level of the words in the '
+                             'deck, with a word index, e.g. B1 B2')
+    parser.add_argument('--tags', type=str, nargs='+', default=None,
+                        help='Tags all the words in the deck have, with a word index')
     parser.add_argument('-d', '--metadataset_path', type=str, required=True,
-                        help='Path to the metadataset dir')
+                        help='Path to the metadataset dir or metadata store')
     parser.add_argument('-m', '--mediaset_path', type=str, required=True,
                         help='Path to the mediaset dir')
     parser.add_argument('-s', '--save_path', type=str, default='outputs',
                         help='Path to the save dir')
     parser.add_argument('-c', '--check_only', action='store_true',
                         help='')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='Number of processes reading and rendering the metadata.')
+    parser.add_argument('--full', action='store_true',
+                        help='Render every word again instead of reusing the '
+                             'build manifest of the save dir.')
+    parser.add_argument('--dedupe_media', action='store_true',
+                        help='Store byte-identical audio files once and point '
+                             'their notes at the shared file.')
+    parser.add_argument('--transcode', action='store_true',
+                        help='Package audio transcoded to smaller, trimmed and '
+                             'loudness-normalized MP3s, cached in the save dir.')
+    parser.add_argument('--media_budget', type=float, default=None,
+                        help='Size in MB the transcoded audio of the deck should '
+                             'fit in, picking the bitrate.')
+    parser.add_argument('--transcode_workers', type=int, default=None,
+                        help='Number of concurrent ffmpeg processes.')
     args = parser.parse_args()
+    if args.max_word_freq is None and args.bands is None and not args.check_only:
+        parser.error('either --max_word_freq or --bands is required')
 
     if not os.path.isdir(args.save_path):
         os.makedirs(args.save_path)
@@ -157,19 +184,46 @@ if __name__ == '__main__':
                                logger_name='encode_en2ru')
 
         russian_template = English2RussianNoteTemplate()
+        transcoder = None
+        if args.transcode:
+            budget = int(args.media_budget * 1e6) if args.media_budget else None
+            transcoder = Transcoder(cache_path=os.path.join(args.save_path, 'transcoded'),
+                                    logger=logger, budget=budget,
+                                    workers=args.transcode_workers)
+        manifest_file = os.path.join(args.save_path, 'build_manifest.sqlite3')
+        if args.full and os.path.isfile(manifest_file):
+            os.remove(manifest_file)
         russian_encoder = English2RussianEncoder(template=russian_template,
                                                  divider='++++++++++',
-                                                 logger=logger)
+                                                 logger=logger,
+                                                 manifest=BuildManifest(manifest_file),
+                                                 workers=args.workers,
+                                                 dedupe_media=args.dedupe_media,
+                                                 transcoder=transcoder)
     else:
         raise NotImplementedError
 
-    russian_encoder(
-        deck_id=1001 if args.task == 'chinese' else 1002,
-        deck_name='俄语卡组',
-        save_path=args.save_path,
-        indexes_file=args.index_file,
-        metadataset_path=args.metadataset_path,
-        mediaset_path=args.mediaset_path,
-        check_only=args.check_only,
-        max_word_freq=args.max_word_freq
-    )
+    if args.bands is not None and not args.check_only:
+        russian_encoder.build_bands(
+            deck_id=1001 if args.task == 'chinese' else 1002,
+            deck_name='俄语卡组',
+            save_path=args.save_path,
+            indexes_file=args.index_file,
+            metadataset_path=args.metadataset_path,
+            mediaset_path=args.mediaset_path,
+            bands=args.bands
+        )
+    else:
+        russian_encoder(
+            deck_id=1001 if args.task == 'chinese' else 1002,
+            deck_name='俄语卡组',
+            save_path=args.save_path,
+            indexes_file=args.index_file,
+            metadataset_path=args.metadataset_path,
+            mediaset_path=args.mediaset_path,
+            check_only=args.check_only,
+            max_word_freq=args.max_word_freq,
+            pos=args.pos,
+            levels=args.levels,
+            tags=args.tags
+        )
@@ -1,16 +1,13 @@
 import argparse
 import os
 
-from src import create_logger, Crawler, ChatGPT, Generator
+from src import create_logger, AsyncCrawler, Crawler, ChatGPT, CompletionCache, Generator, \
+    MediaDownloader, MetadataStore, ResponseCache, Scheduler
 
 
 class Chinese2RussianGenerator(Generator):
     def _get_metadata(self, index: str) -> None:
-        metadata_list = self.functions(index)
-        metadata = '\n++++++++++\n'.join(metadata_list)
-
-        with open(os.path.join(self.metadata_path, f'{metadata_list[1]}.txt'), 'w') as f:
-            f.write(metadata)
+        self._save_metadata(index, self.functions(index))
 
 
 if __name__ == '__main__':
@@ -27,22 +24,101 @@ if __name__ == '__main__':
                         help='Path to the save dir')
     parser.add_argument('-n', '--num_threads', type=int, default=4,
                         help='Number of threads to use for processing.')
-    parser.add_argument('-o', '--overwrite', action='store_true',
-                        help='Whether to overwrite previously generated files.')
+    parser.add_argument('-o', '--overwrite', type=str, nargs='?', const='all',
+                        default=False, choices=['all', 'failed', 'stale'],
+                        help='Whether to overwrite previously generated files, '
+                             'all of them or only the failed or stale ones.')
+    parser.add_argument('--stale_days', type=float, default=None,
+                        help='Days after which generated files are stale.')
+    parser.add_argument('-e', '--executor', type=str, default='thread',
+                        choices=['thread', 'async', 'pipeline'],
+                        help='Run the crawler on a thread pool, on a single '
+                             'event loop with pooled keep-alive connections, or '
+                             'as a fetch -> parse -> write pipeline.')
+    parser.add_argument('-w', '--window', type=int, default=4,
+                        help='Number of in-flight words per thread of the thread executor.')
+    parser.add_argument('-c', '--concurrency', type=int, default=256,
+                        help='Number of in-flight words of the async executor.')
+    parser.add_argument('--max_connections', type=int, default=64,
+                        help='Number of pooled connections of the async executor.')
+    parser.add_argument('--parse_workers', type=int, default=None,
+                        help='Number of parsing processes of the pipeline executor, '
+                             'defaults to the number of cores.')
+    parser.add_argument('--queue_size', type=int, default=256,
+                        help='Capacity of the queues between pipeline stages.')
+    parser.add_argument('--write_batch', type=int, default=64,
+                        help='Number of results written at once by the pipeline.')
+    parser.add_argument('-r', '--rate', type=float, default=None,
+                        help='Maximum number of page requests per second.')
+    parser.add_argument('--llm_rate', type=float, default=None,
+                        help='Maximum number of OpenAI requests per second.')
+    parser.add_argument('--completions', action='store_true',
+                        help='Ask OpenAI about every generated word in batched '
+                             'requests, saved to the completions dir.')
+    parser.add_argument('-b', '--batch_size', type=int, default=8,
+                        help='Maximum number of words per batched OpenAI request.')
+    parser.add_argument('-p', '--parser', type=str, default='bs4',
+                        choices=['bs4', 'lxml'],
+                        help='HTML extraction backend of the crawler.')
+    parser.add_argument('--no_cache', action='store_true',
+                        help='Whether to bypass the response and completion caches '
+                             'under the save dir.')
+    parser.add_argument('--cache_ttl', type=float, default=None,
+                        help='Days after which cached responses are fetched again.')
+    parser.add_argument('--cache_size', type=int, default=None,
+                        help='Maximum size in MB of the response cache.')
+    parser.add_argument('--store', action='store_true',
+                        help='Write the metadata to `metadata.sqlite3` under the '
+                             'save dir instead of one file per word.')
+    parser.add_argument('--no_media', action='store_true',
+                        help='Do not download the pronunciations into the media dir.')
+    parser.add_argument('--media_workers', type=int, default=16,
+                        help='Number of concurrent media downloads.')
+    parser.add_argument('--media_rate', type=float, default=None,
+                        help='Maximum number of media requests per second.')
     args = parser.parse_args()
 
     if not os.path.isdir(args.save_path):
         os.makedirs(args.save_path)
 
+    cache, completion_cache = None, None
+    if not args.no_cache:
+        cache = ResponseCache(
+            cache_path=os.path.join(args.save_path, 'cache'),
+            ttl=args.cache_ttl * 86400 if args.cache_ttl is not None else None,
+            max_size=args.cache_size * 2 ** 20 if args.cache_size is not None else None)
+        completion_cache = CompletionCache(
+            cache_file=os.path.join(args.save_path, 'completions.sqlite3'))
+
+    crawler_scheduler = Scheduler(
+        rate=args.rate,
+        max_concurrency=args.concurrency if args.executor == 'async' else args.num_threads)
+    chatgpt_scheduler = Scheduler(rate=args.llm_rate,
+                                  max_concurrency=args.num_threads)
+
     if args.task == 'chinese':
         logger = create_logger(logger_file=f'{args.save_path}/gene_ch2ru.log',
                                logger_name='gene_ch2ru')
-        crawler = Crawler(logger=logger)
+        if args.executor == 'async':
+            crawler = AsyncCrawler(logger=logger, cache=cache,
+                                   parser=args.parser,
+                                   scheduler=crawler_scheduler,
+                                   max_connections=args.max_connections)
+        else:
+            crawler = Crawler(logger=logger, cache=cache, parser=args.parser,
+                              scheduler=crawler_scheduler)
         chatgpt = ChatGPT(api_key=args.api_key,
                           engine='text-davinci-003',
                           prompt=r'resources/prompts/english2russian.txt',
                           articulation='现在是第一个单词',
-                          logger=logger)
+                          logger=logger,
+                          scheduler=chatgpt_scheduler,
+                          batch_size=args.batch_size,
+                          cache=completion_cache) if args.completions else None
+        media = None if args.no_media else MediaDownloader(
+            logger=logger, num_workers=args.media_workers,
+            scheduler=Scheduler(rate=args.media_rate,
+                                max_concurrency=args.media_workers))
     else:
         raise NotImplementedError
 
@@ -50,7 +126,31 @@ if __name__ == '__main__':
                                          divider='\n++++++++++\n',
                                          functions=crawler,
                                          logger=logger,
-                                         overwrite=args.overwrite)
+                                         overwrite=args.overwrite,
+                                         stale_after=args.stale_days * 86400
+                                         if args.stale_days is not None else None,
+                                         media=media,
+                                         store=MetadataStore(os.path.join(
+                                             args.save_path, 'metadata.sqlite3'))
+                                         if args.store else None,
+                                         chatgpt=chatgpt)
 
     generator(indexes_file=args.index_file,
-              num_threads=args.num_threads)
+              num_threads=args.num_threads,
+              executor=args.executor,
+              concurrency=args.concurrency,
+              window=args.window,
+              **({'parse_workers': args.parse_workers,
+                  'queue_size': args.queue_size,
+                  'write_batch': args.write_batch}
+                 if args.executor == 'pipeline' else {}))
+
+    logger.info(f'Crawler scheduler: {crawler_scheduler.stats()}.')
+    if chatgpt is not None:
+        logger.info(f'OpenAI scheduler: {chatgpt_scheduler.stats()}.')
+    if cache is not None:
+        logger.info(f'Response cache: {cache.hits} hits, {cache.misses} misses.')
+        cache.close()
+    if completion_cache is not None:
+        logger.info(f'Completion cache: {completion_cache.hits} hits, '
+                    f'{completion_cache.misses} misses.')
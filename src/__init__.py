@@ -1,6 +1,22 @@
+from .apkg_merger import ApkgMerger
+from .apkg_writer import ApkgWriter
+from .async_crawler import AsyncCrawler
+from .build_graph import BuildGraph
+from .build_manifest import BuildManifest
 from .chatgpt import ChatGPT
+from .completion_cache import CompletionCache
 from .crawler import Crawler
 from .encoder import Encoder
 from .generator import Generator
+from .journal import Journal
 from .logger import create_logger
+from .media import MediaDownloader
+from .metadata_store import MetadataStore
+from .packed_dataset import PackedDataset
+from .pipeline import Pipeline
+from .renderer import FieldRenderer
+from .response_cache import ResponseCache
+from .scheduler import Scheduler
 from .template import NoteTemplate
+from .transcoder import Transcoder
+from .word_index import WordIndex
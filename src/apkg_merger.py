@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+import zipfile
+
+import genanki
+
+__all__ = ['ApkgMerger']
+
+
+def _copy_entry(source: zipfile.ZipFile, info: zipfile.ZipInfo,
+                target: zipfile.ZipFile, arcname: str,
+                chunk_size: int = 1 << 20) -> None:
+    r"""Streams a zip entry into another package with the same compression.
+        Only a `ZIP_STORED` entry, like the MP3s of the packages of this
+        project, is copied without decompressing it. A compressed entry is
+        inflated and compressed again, and the CRC of every entry is
+        computed again."""
+    entry = zipfile.ZipInfo(arcname, info.date_time)
+    entry.compress_type = info.compress_type
+    entry.external_attr = info.external_attr
+    entry.file_size = info.file_size
+    with source.open(info) as reader, \
+            target.open(entry, 'w', force_zip64=info.file_size > zipfile.ZIP64_LIMIT) \
+            as writer:
+        shutil.copyfileobj(reader, writer, chunk_size)
+
+
+_SOUND = re.compile(r'\[sound:([^\]]+)\]')
+
+
+class ApkgMerger:
+    r"""Merges packages built by this project into one, at the level of their
+        collections and zips, instead of encoding everything again. Notes are
+        deduplicated by GUID and note models by ID, so the same word built
+        in several shards is kept once, and the IDs of the notes and cards
+        are remapped where they collide. Media files are deduplicated by
+        name and content, a different file with a taken name being renamed
+        along with the sounds of its notes, and the files used only by
+        duplicate notes are left out. Their entries are streamed with their
+        compression, so stored MP3s are copied without decompressing them.
+
+    Args:
+        logger (logging.Logger): A logger to record the merging progress.
+    """
+
+    def __init__(self, logger: logging.Logger) -> None:
+        self.logger = logger
+
+    @staticmethod
+    def _extract_collection(package: zipfile.ZipFile, path: str) -> str:
+        with package.open('collection.anki2') as source, open(path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        return path
+
+    def _merge_json(self, conn: sqlite3.Connection, column: str) -> None:
+        r"""Adds the decks or models of the attached collection missing from
+            the main one. A model whose ID is taken by a different one keeps
+            the first, with a warning, since its notes cannot tell them
+            apart."""
+        merged = json.loads(conn.execute(f'SELECT {column} FROM main.col').fetchone()[0])
+        source = json.loads(conn.execute(f'SELECT {column} FROM src.col').fetchone()[0])
+        for key, value in source.items():
+            if key not in merged:
+                merged[key] = value
+            elif column == 'models' and self._model_layout(merged[key]) != \
+                    self._model_layout(value):
+                self.logger.warning(f'Model `{key}` differs between the packages, '
+                                    f'keeping its first fields, templates and css.')
+        conn.execute(f'UPDATE main.col SET {column} = ?', (json.dumps(merged),))
+
+    @staticmethod
+    def _model_layout(model: dict) -> tuple:
+        return ([field.get('name') for field in model.get('flds', [])],
+                [(template.get('qfmt'), template.get('afmt'))
+                 for template in model.get('tmpls', [])],
+                model.get('css'))
+
+    @staticmethod
+    def _rename_sounds(fields: str, renames: dict) -> str:
+        def rename(match: re.Match) -> str:
+            name = renames.get(match.group(1).strip())
+            return f'[sound:{name}]' if name is not None else match.group()
+        return _SOUND.sub(rename, fields)
+
+    @staticmethod
+    def _remap(ids: list, used: set) -> dict:
+        r"""Maps every ID colliding with a used one to a free one."""
+        next_id = max(used | set(ids), default=0) + 1
+        mapping = dict()
+        for id_ in ids:
+            if id_ in used:
+                mapping[id_] = next_id
+                next_id += 1
+            used.add(mapping.get(id_, id_))
+        return mapping
+
+    @staticmethod
+    def _dropped_sounds(conn: sqlite3.Connection) -> set:
+        r"""Returns the sounds used only by the notes of the attached
+            collection whose GUID is already in the main one."""
+        guids = {guid for guid, in conn.execute('SELECT guid FROM main.notes')}
+        kept, dropped = set(), set()
+        for guid, fields in conn.execute('SELECT guid, flds FROM src.notes'):
+            (dropped if guid in guids else kept).update(
+                name.strip() for name in _SOUND.findall(fields))
+        return dropped - kept
+
+    def _plan_media(self, package: zipfile.ZipFile, names: dict, media: dict,
+                    dropped: set = frozenset()) -> tuple:
+        r"""Picks the media files of a package to be copied. A file used only
+            by dropped notes is left out, a file whose name is taken by the
+            same content, by CRC and size, is a duplicate, and one whose name
+            is taken by a different file is renamed after its CRC.
+
+        Returns:
+            tuple: The `(ZipInfo, name)` of the files to copy, and the new
+                names of the renamed ones.
+        """
+        copies, renames = list(), dict()
+        for idx, name in names.items():
+            if name in dropped:
+                continue
+            info = package.getinfo(idx)
+            key = (info.CRC, info.file_size)
+            if name in media and media[name][1] != key:
+                stem, suffix = os.path.splitext(name)
+                renamed = f'{stem}-{info.CRC:08x}{suffix}'
+                if media.get(renamed, (None, key))[1] != key:
+                    raise ValueError(f'Cannot rename media `{name}` of `{package.filename}`, '
+                                     f'`{renamed}` is taken!')
+                self.logger.warning(f'Media `{name}` of `{package.filename}` differs from '
+                                    f'the one merged before, renaming it `{renamed}`.')
+                renames[name] = name = renamed
+            if name in media:
+                continue
+            media[name] = (len(media), key)
+            copies.append((info, name))
+        return copies, renames
+
+    def _merge_notes(self, conn: sqlite3.Connection, deck_id: int = None,
+                     renames: dict = None) -> tuple:
+        r"""Copies the notes of the attached collection whose GUID is new,
+            and their cards, pointing their sounds at the renamed media.
+
+        Returns:
+            tuple: The numbers of copied and of duplicate notes.
+        """
+        guids = {guid for guid, in conn.execute('SELECT guid FROM main.notes')}
+        notes = [row for row in conn.execute('SELECT * FROM src.notes')
+                 if row[1] not in guids]
+        duplicates = conn.execute('SELECT COUNT(*) FROM src.notes').fetchone()[0] - \
+            len(notes)
+
+        note_ids = self._remap([row[0] for row in notes],
+                               {id_ for id_, in conn.execute('SELECT id FROM main.notes')})
+        kept = {row[0] for row in notes}
+        cards = [row for row in conn.execute('SELECT * FROM src.cards') if row[1] in kept]
+        card_ids = self._remap([row[0] for row in cards],
+                               {id_ for id_, in conn.execute('SELECT id FROM main.cards')})
+
+        if renames:
+            notes = [(*row[:6], self._rename_sounds(row[6], renames), *row[7:])
+                     for row in notes]
+        conn.executemany('INSERT INTO main.notes VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+                         [(note_ids.get(row[0], row[0]), *row[1:]) for row in notes])
+        conn.executemany('INSERT INTO main.cards VALUES '
+                         '(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                         [(card_ids.get(row[0], row[0]), note_ids.get(row[1], row[1]),
+                           deck_id if deck_id is not None else row[2], *row[3:])
+                          for row in cards])
+        return len(notes), duplicates
+
+    def __call__(self, apkg_paths: list, output_path: str,
+                 deck_id: int = None, deck_name: str = None) -> dict:
+        r"""Merges packages.
+
+        Args:
+            apkg_paths (list): The paths to the packages, the notes and media
+                of the first ones winning over the duplicates of the next.
+            output_path (str): The path to the merged package.
+            deck_id (int, optional): The ID of a deck to move every card to,
+                instead of keeping the decks of the packages. Defaults to
+                None.
+            deck_name (str, optional): The name of that deck. Defaults to
+                None.
+
+        Returns:
+            dict: The numbers of notes, duplicate notes, media files,
+                duplicate media files and renamed media files, and the time
+                taken.
+        """
+        start = time.perf_counter()
+        stats = {'notes': 0, 'duplicate_notes': 0, 'media': 0, 'duplicate_media': 0,
+                 'renamed_media': 0}
+        directory = os.path.dirname(os.path.abspath(output_path))
+        fd, zip_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.apkg')
+        os.close(fd)
+
+        try:
+            with tempfile.TemporaryDirectory(dir=directory) as temp_dir, \
+                    zipfile.ZipFile(zip_path, 'w') as outzip:
+                # the index and the CRC and size of every media file by name
+                media, conn = dict(), None
+                for i, apkg_path in enumerate(apkg_paths):
+                    with zipfile.ZipFile(apkg_path) as package:
+                        names = json.loads(package.read('media'))
+                        collection = self._extract_collection(
+                            package, os.path.join(temp_dir, f'{i}.anki2'))
+                        if conn is None:
+                            # the first collection is the base of the merge
+                            copies, renames = self._plan_media(package, names, media)
+                            conn = sqlite3.connect(collection)
+                            notes = conn.execute('SELECT COUNT(*) FROM notes').fetchone()[0]
+                            duplicates = 0
+                            if deck_id is not None:
+                                conn.execute('UPDATE cards SET did = ?', (deck_id,))
+                            if renames:
+                                conn.executemany(
+                                    'UPDATE notes SET flds = ? WHERE id = ?',
+                                    [(self._rename_sounds(flds, renames), id_) for id_, flds
+                                     in conn.execute('SELECT id, flds FROM notes').fetchall()])
+                        else:
+                            conn.execute('ATTACH DATABASE ? AS src', (collection,))
+                            copies, renames = self._plan_media(
+                                package, names, media, self._dropped_sounds(conn))
+                            if deck_id is None:
+                                self._merge_json(conn, 'decks')
+                            self._merge_json(conn, 'models')
+                            notes, duplicates = self._merge_notes(conn, deck_id, renames)
+                            conn.commit()
+                            conn.execute('DETACH DATABASE src')
+                            os.remove(collection)
+
+                        for info, name in copies:
+                            _copy_entry(package, info, outzip, str(media[name][0]))
+
+                    stats['notes'] += notes
+                    stats['duplicate_notes'] += duplicates
+                    stats['media'] += len(copies)
+                    stats['duplicate_media'] += len(names) - len(copies)
+                    stats['renamed_media'] += len(renames)
+                    self.logger.info(f'Merged `{apkg_path}`: {notes} notes, '
+                                     f'{duplicates} duplicates, {len(copies)} media files, '
+                                     f'{len(renames)} renamed.')
+
+                if deck_id is not None:
+                    decks = json.loads(conn.execute('SELECT decks FROM col').fetchone()[0])
+                    decks = {key: value for key, value in decks.items() if key == '1'}
+                    decks[str(deck_id)] = genanki.Deck(deck_id, deck_name).to_json()
+                    conn.execute('UPDATE col SET decks = ?', (json.dumps(decks),))
+                conn.commit()
+                conn.execute('VACUUM')
+                conn.close()
+
+                outzip.write(os.path.join(temp_dir, '0.anki2'), 'collection.anki2')
+                outzip.writestr('media', json.dumps({idx: name for name, (idx, _)
+                                                     in media.items()}))
+            os.chmod(zip_path, 0o644)
+            os.replace(zip_path, output_path)
+        except BaseException:
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
+            raise
+
+        stats['seconds'] = round(time.perf_counter() - start, 3)
+        self.logger.info(f'Merged {len(apkg_paths)} packages into `{output_path}`: '
+                         f'{stats["notes"]} notes and {stats["media"]} media files, '
+                         f'in {stats["seconds"]}s.')
+        return stats
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from .logger import create_logger
+
+    parser = argparse.ArgumentParser(
+        description='Merge packages into one without encoding them again.')
+    parser.add_argument('apkg_paths', type=str, nargs='+',
+                        help='Paths to the packages to merge, the first ones '
+                             'winning over the duplicates')
+    parser.add_argument('-o', '--output_path', type=str, required=True,
+                        help='Path to the merged package')
+    parser.add_argument('--deck_id', type=int, default=None,
+                        help='ID of a single deck to move every card to')
+    parser.add_argument('--deck_name', type=str, default=None,
+                        help='Name of that deck')
+    args = parser.parse_args()
+    if (args.deck_id is None) != (args.deck_name is None):
+        parser.error('--deck_id and --deck_name go together')
+
+    ApkgMerger(create_logger(logger_name='apkg_merger'))(
+        args.apkg_paths, args.output_path,
+        deck_id=args.deck_id, deck_name=args.deck_name)
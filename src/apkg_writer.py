@@ -0,0 +1,220 @@
+import hashlib
+import itertools
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import zipfile
+
+import genanki
+from genanki.apkg_col import APKG_COL
+from genanki.apkg_schema import APKG_SCHEMA
+
+__all__ = ['ApkgWriter']
+
+# media formats that are already compressed, and stored as they are
+_STORED_SUFFIXES = ('.mp3', '.ogg', '.m4a', '.jpg', '.jpeg', '.png', '.gif', '.webp')
+_SOUND = re.compile(r'\[sound:([^\]]+)\]')
+
+
+class ApkgWriter:
+    r"""Writes an .apkg package as notes and media come, instead of building
+        a whole `genanki.Deck` and `genanki.Package` in memory. Notes and their
+        cards are inserted into a temporary collection in batched
+        transactions, and media files are streamed into the zip one by one,
+        so memory stays flat whatever the size of the deck. The package is
+        moved into place once complete, and removed if writing fails.
+
+        It takes `genanki.Note`s through `add_note` like a `genanki.Deck`,
+        and produces the same collection as `genanki.Package.write_to_file`.
+
+        Already compressed media, e.g. MP3s, are always stored uncompressed.
+        With `dedupe`, a media file whose content was already added is not
+        stored again, and the `[sound:...]` references of the notes added
+        afterwards are pointed at the first copy, keeping their GUIDs.
+
+    Args:
+        apkg_path (str): The path to the package to be written.
+        deck_id (int): The ID of the deck.
+        deck_name (str): The name of the deck.
+        template (genanki.Model): The note model of the deck.
+        batch_size (int, optional): The number of notes per transaction.
+            Defaults: 1000.
+        timestamp (float, optional): The modification time of the notes and
+            cards. Defaults: now.
+        compression (int, optional): The compression of the collection and
+            of the media that are not already compressed. Defaults:
+            `zipfile.ZIP_STORED`, like genanki.
+        dedupe (bool, optional): Whether to store identical media files once.
+            Defaults: False.
+    """
+
+    def __init__(self, apkg_path: str, deck_id: int, deck_name: str,
+                 template: genanki.Model, batch_size: int = 1000,
+                 timestamp: float = None,
+                 compression: int = zipfile.ZIP_STORED,
+                 dedupe: bool = False) -> None:
+
+        self.apkg_path = apkg_path
+        self.deck_id = deck_id
+        self.name = deck_name
+        self.template = template
+        self.batch_size = batch_size
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.compression = compression
+        self.dedupe = dedupe
+
+        self.id_gen = itertools.count(int(self.timestamp * 1000))
+        self.models = set()
+        self.notes, self.cards = list(), list()
+        self.media = dict()
+        # the first media file of every content hash, and the duplicates
+        # pointing at it
+        self.digests, self.aliases = dict(), dict()
+        self.num_notes, self.saved_bytes = 0, 0
+        self.db_path, self.zip_path = None, None
+        self.conn, self.zip = None, None
+
+    def open(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.apkg_path))
+        fd, self.db_path = tempfile.mkstemp(dir=directory, prefix='.tmp-',
+                                            suffix='.anki2')
+        os.close(fd)
+        fd, self.zip_path = tempfile.mkstemp(dir=directory, prefix='.tmp-',
+                                             suffix='.apkg')
+        os.close(fd)
+
+        self.conn = sqlite3.connect(self.db_path)
+        cursor = self.conn.cursor()
+        cursor.executescript(APKG_SCHEMA)
+        cursor.executescript(APKG_COL)
+        # an empty deck registers itself and its model in the collection
+        deck = genanki.Deck(deck_id=self.deck_id, name=self.name)
+        deck.add_model(self.template)
+        deck.write_to_db(cursor, self.timestamp, self.id_gen)
+        self.models.add(self.template.model_id)
+        self.conn.commit()
+
+        self.zip = zipfile.ZipFile(self.zip_path, 'w', self.compression)
+
+    def _add_model(self, model: genanki.Model) -> None:
+        cursor = self.conn.cursor()
+        models = json.loads(cursor.execute('SELECT models FROM col').fetchone()[0])
+        models[str(model.model_id)] = model.to_json(self.timestamp, self.deck_id)
+        cursor.execute('UPDATE col SET models = ?', (json.dumps(models),))
+        self.models.add(model.model_id)
+
+    def add_note(self, note: genanki.Note) -> None:
+        r"""Adds a note and its cards, like `genanki.Note.write_to_db`."""
+        note._check_number_model_fields_matches_num_fields()
+        note._check_invalid_html_tags_in_fields()
+        if note.model.model_id not in self.models:
+            self._add_model(note.model)
+        if self.aliases:
+            guid = note.guid
+            note.fields = [_SOUND.sub(self._resolve_sound, field)
+                           for field in note.fields]
+            note.guid = guid
+
+        timestamp = int(self.timestamp)
+        note_id = next(self.id_gen)
+        self.notes.append((note_id, note.guid, note.model.model_id, timestamp,
+                           -1, note._format_tags(), note._format_fields(),
+                           note.sort_field, 0, 0, ''))
+        for card in note.cards:
+            self.cards.append((next(self.id_gen), note_id, self.deck_id,
+                               card.ord, timestamp, -1, 0,
+                               -1 if card.suspend else 0, note.due,
+                               0, 0, 0, 0, 0, 0, 0, 0, ''))
+
+        self.num_notes += 1
+        if len(self.notes) >= self.batch_size:
+            self.flush()
+
+    def _resolve_sound(self, match: re.Match) -> str:
+        name = self.aliases.get(match.group(1).strip())
+        return f'[sound:{name}]' if name is not None else match.group()
+
+    def add_media(self, media_path: str, digest: str = None) -> bool:
+        r"""Streams a media file into the package. Notes referring to a
+            duplicate must be added after it to be pointed at the first copy.
+
+        Args:
+            media_path (str): The path to the media file.
+            digest (str, optional): The SHA-256 of the file if known, used
+                with `dedupe`. Defaults to hashing the file.
+
+        Returns:
+            bool: Whether the file was stored, i.e. is not a duplicate.
+        """
+        name = os.path.basename(media_path)
+        if self.dedupe:
+            if digest is None:
+                digest = hashlib.sha256()
+                with open(media_path, 'rb') as file:
+                    for chunk in iter(lambda: file.read(1 << 16), b''):
+                        digest.update(chunk)
+                digest = digest.hexdigest()
+            first = self.digests.setdefault(digest, name)
+            if first != name:
+                self.aliases[name] = first
+                self.saved_bytes += os.path.getsize(media_path)
+                return False
+
+        idx = len(self.media)
+        stored = name.lower().endswith(_STORED_SUFFIXES)
+        self.zip.write(media_path, str(idx),
+                       compress_type=zipfile.ZIP_STORED if stored else None)
+        self.media[idx] = name
+        return True
+
+    def flush(self) -> None:
+        r"""Commits the pending notes, so that the progress is on disk."""
+        self.conn.executemany('INSERT INTO notes VALUES(?,?,?,?,?,?,?,?,?,?,?)',
+                              self.notes)
+        self.conn.executemany('INSERT INTO cards VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                              self.cards)
+        self.conn.commit()
+        self.notes.clear()
+        self.cards.clear()
+
+    def close(self) -> None:
+        r"""Completes the package and moves it into place."""
+        self.flush()
+        self.conn.close()
+        self.zip.write(self.db_path, 'collection.anki2')
+        self.zip.writestr('media', json.dumps(self.media))
+        self.zip.close()
+        os.chmod(self.zip_path, 0o644)
+        os.replace(self.zip_path, self.apkg_path)
+        os.remove(self.db_path)
+
+    def abort(self) -> None:
+        r"""Discards the package."""
+        if self.conn is not None:
+            self.conn.close()
+        if self.zip is not None:
+            self.zip.close()
+        for path in (self.db_path, self.zip_path):
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    def __enter__(self):
+        try:
+            self.open()
+        except BaseException:
+            self.abort()
+            raise
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+if __name__ == '__main__':
+    pass
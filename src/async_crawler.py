@@ -0,0 +1,136 @@
+import asyncio
+import logging
+
+import aiohttp
+
+from .crawler import CAPTCHA_REGEX, CaptchaError, Crawler
+from .response_cache import ResponseCache
+from .scheduler import Scheduler
+
+__all__ = ['AsyncCrawler']
+
+
+class AsyncCrawler(Crawler):
+    r"""An asyncio Crawler that reuses a bounded pool of keep-alive
+        connections. It must be opened with `async with` before being called.
+
+    Args:
+        logger (logging.Logger): A logger to record the crawler's activity.
+        max_retries (int, optional): The maximum number of retries for
+            fetching a page. Defaults: 5.
+        wait_time (int, optional): The waiting time in seconds when a captcha
+            is detected. Defaults: 60.
+        base_url (str, optional): The URL prefix of the pages to be fetched.
+            Defaults: 'https://en.openrussian.org/ru'.
+        cache (ResponseCache, optional): A response cache serving previously
+            fetched pages without touching the network. Defaults: None.
+        parser (str, optional): The HTML extraction backend, one of `PARSERS`.
+            Defaults: 'bs4'.
+        scheduler (Scheduler, optional): The scheduler pacing the requests and
+            the retries of all coroutines. Defaults: an unlimited `Scheduler`.
+        max_connections (int, optional): The maximum number of pooled
+            connections kept open at once. Defaults: 64.
+        timeout (float, optional): The total timeout in seconds of a single
+            request. Defaults: 30.
+    """
+
+    def __init__(self, logger: logging.Logger,
+                 max_retries: int = 5, wait_time: int = 60,
+                 base_url: str = 'https://en.openrussian.org/ru',
+                 cache: ResponseCache = None, parser: str = 'bs4',
+                 scheduler: Scheduler = None,
+                 max_connections: int = 64, timeout: float = 30) -> None:
+        super().__init__(logger=logger, max_retries=max_retries,
+                         wait_time=wait_time, base_url=base_url, cache=cache,
+                         parser=parser, scheduler=scheduler)
+
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.session = None
+
+    async def __aenter__(self) -> 'AsyncCrawler':
+        connector = aiohttp.TCPConnector(limit=self.max_connections,
+                                         limit_per_host=self.max_connections)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.session.close()
+        self.session = None
+
+    async def _fetch_html(self, index: str) -> str:
+        r"""Fetches the HTML content of a given index over the pooled session.
+
+        Args:
+            index (str): The index of the page.
+
+        Returns:
+            str: The decoded HTML content, or None if the page cannot be
+                fetched.
+        """
+        url = self._get_url(index)
+
+        if self.cache is not None:
+            body = self.cache.get(url)
+            if body is not None:
+                return body.decode('utf-8')
+
+        for i in range(self.max_retries):
+            try:
+                async with self.scheduler.async_slot():
+                    async with self.session.get(url, allow_redirects=True) as html:
+                        html.raise_for_status()
+                        body = await html.read()
+                    html = body.decode('utf-8')
+                    if CAPTCHA_REGEX.search(html):
+                        raise CaptchaError(self.wait_time)
+                if self.cache is not None:
+                    self.cache.put(url, body)
+                return html
+
+            except (aiohttp.ClientError, asyncio.TimeoutError,
+                    UnicodeDecodeError, CaptchaError) as e:
+                self.logger.error(f"Error fetching HTML for `{index}`"
+                                  f"({i + 1}/{self.max_retries}): {e!r}")
+                status = Scheduler.get_status(e)
+                # a missing or forbidden page will not appear on retrying
+                if status is not None and 400 <= status < 500 and \
+                        status not in Scheduler.THROTTLE_STATUSES:
+                    break
+                if i + 1 < self.max_retries:
+                    await self.scheduler.async_backoff(i, e)
+
+        return None  # noqa
+
+    async def __call__(self, index: str) -> tuple:
+        r"""Fetches the data of a given index.
+
+        Args:
+            index (str): The index of the page.
+
+        Returns:
+            tuple: A tuple containing the index, the accent, the overview, the
+                tags, the translations and the example sentences, or None if
+                the page cannot be retrieved.
+        """
+        html = await self._fetch_html(index)
+
+        if html is not None:
+            return self._parse_html(index, html)
+        else:
+            return None  # noqa
+
+
+if __name__ == '__main__':
+    from src.logger import create_logger
+
+
+    async def main():
+        async with AsyncCrawler(create_logger('1.log')) as c:
+            a = await c(r'абзац')
+            print(a[0], '\n', a[1])
+
+
+    asyncio.run(main())
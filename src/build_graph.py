@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .build_manifest import BuildManifest
+
+__all__ = ['BuildGraph']
+
+
+class BuildGraph:
+    r"""A make-like graph of build steps, recorded in a `BuildManifest`.
+        Every node has an action returning the content hash of what it
+        produced, from the hashes of its dependencies. A node is redone only
+        if the hashes of its dependencies changed since it last succeeded, or
+        if one of its output files is missing, and independent nodes run in
+        parallel.
+
+        Scanning nodes, like the ones hashing the source files, always run
+        and are expected to be cheap; a node without dependencies is one.
+        They also run on a dry run, so they must not write anything but the
+        records of the manifest.
+        Since a node is recorded only once it succeeded, an interrupted build
+        resumes from the nodes left stale.
+
+    Args:
+        manifest (BuildManifest): The manifest recording the nodes.
+        logger (logging.Logger): A logger to record the build progress.
+        workers (int, optional): The number of nodes run at once. Defaults: 4.
+    """
+
+    def __init__(self, manifest: BuildManifest, logger: logging.Logger,
+                 workers: int = 4) -> None:
+        self.manifest = manifest
+        self.logger = logger
+        self.workers = workers
+        self.nodes = dict()
+
+    def add(self, name: str, action, deps: tuple = (), outputs: tuple = (),
+            always: bool = None) -> None:
+        r"""Adds a node.
+
+        Args:
+            name (str): The name of the node.
+            action (callable): Called with the hashes of the dependencies in
+                order, returning the hash of the node.
+            deps (tuple, optional): The names of the dependencies, added
+                before. Defaults: no dependencies.
+            outputs (tuple, optional): The files the node writes. Defaults: no
+                files.
+            always (bool, optional): Whether the node always runs. Defaults:
+                whether it has no dependencies.
+        """
+        for dep in deps:
+            if dep not in self.nodes:
+                raise KeyError(f'Dependency `{dep}` of `{name}` is not in the graph!')
+        self.nodes[name] = (action, tuple(deps), tuple(outputs),
+                            not deps if always is None else always)
+
+    def _signature(self, name: str, digests: list) -> str:
+        return hashlib.sha256('\n'.join([name, *digests]).encode('utf-8')).hexdigest()
+
+    def _is_fresh(self, name: str, signature: str) -> bool:
+        _, _, outputs, always = self.nodes[name]
+        return not always and \
+            self.manifest.get_input(f'node:{name}') == signature and \
+            all(os.path.exists(output) for output in outputs)
+
+    def _needed(self, targets: list) -> list:
+        r"""Returns the targets and their dependencies, dependencies first."""
+        order, seen = list(), set()
+
+        def visit(name: str) -> None:
+            if name not in seen:
+                seen.add(name)
+                for dep in self.nodes[name][1]:
+                    visit(dep)
+                order.append(name)
+
+        for target in targets:
+            visit(target)
+        return order
+
+    def __call__(self, targets: list = None, dry_run: bool = False) -> dict:
+        r"""Brings targets up to date.
+
+        Args:
+            targets (list, optional): The names of the nodes to build.
+                Defaults to every node.
+            dry_run (bool, optional): Whether to only run the scanning nodes
+                and tell which of the others are stale. Defaults: False.
+
+        Returns:
+            dict: The status of every needed node, one of 'done', 'fresh',
+                'stale' (on a dry run), 'failed' or 'blocked' by a failed
+                dependency.
+        """
+        pending = self._needed(targets if targets is not None else list(self.nodes))
+        digests, status = dict(), dict()
+
+        def ready(name: str) -> bool:
+            return all(dep in status for dep in self.nodes[name][1])
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = dict()
+            while pending or futures:
+                for name in [name for name in pending if ready(name)]:
+                    pending.remove(name)
+                    action, deps, _, always = self.nodes[name]
+                    if any(status[dep] not in ('done', 'fresh') for dep in deps):
+                        blocked = 'stale' if dry_run and all(
+                            status[dep] in ('done', 'fresh', 'stale') for dep in deps) \
+                            else 'blocked'
+                        status[name] = blocked
+                        continue
+                    signature = self._signature(name, [digests[dep] for dep in deps])
+                    if self._is_fresh(name, signature):
+                        digests[name] = self.manifest.get_input(f'digest:{name}')
+                        status[name] = 'fresh'
+                    elif dry_run and not always:
+                        status[name] = 'stale'
+                    else:
+                        future = executor.submit(action, *[digests[dep] for dep in deps])
+                        futures[future] = (name, signature)
+
+                if not futures:
+                    continue
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, signature = futures.pop(future)
+                    try:
+                        digests[name] = future.result()
+                    except Exception as e:
+                        self.logger.error(f'Error building `{name}`: {e!r}')
+                        status[name] = 'failed'
+                        continue
+                    status[name] = 'done'
+                    if not self.nodes[name][3]:
+                        self.logger.info(f'Built `{name}`.')
+                    self.manifest.set_input(f'node:{name}', signature)
+                    self.manifest.set_input(f'digest:{name}', digests[name])
+                    self.manifest.commit()
+
+        return status
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+__all__ = ['BuildManifest']
+
+
+class BuildManifest:
+    r"""A record of the inputs of the previous deck build, so that the next
+        one only redoes what changed. It keeps the content hash of every
+        metadata and media file along with its size and mtime, which spare
+        hashing untouched files, the fields rendered from every metadata file,
+        and the hashes of the template and the renderer, whose change
+        invalidates every rendered field. It may be shared by threads, e.g.
+        the nodes of a `BuildGraph`.
+
+    Args:
+        manifest_file (str): The path to the SQLite database.
+    """
+
+    def __init__(self, manifest_file: str) -> None:
+        self.manifest_file = manifest_file
+        self.conn = sqlite3.connect(manifest_file, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS inputs ('
+                          'key TEXT PRIMARY KEY, digest TEXT NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                          'kind TEXT NOT NULL, name TEXT NOT NULL, '
+                          'size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, '
+                          'digest TEXT NOT NULL, fields TEXT, '
+                          'PRIMARY KEY (kind, name))')
+        self.conn.commit()
+
+        self.files = {(kind, name): [size, mtime_ns, digest, fields]
+                      for kind, name, size, mtime_ns, digest, fields
+                      in self.conn.execute('SELECT * FROM files')}
+        self.dirty = set()
+
+    @staticmethod
+    def hash_bytes(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def hash_file(file_path: str, chunk_size: int = 1 << 16) -> str:
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get_input(self, key: str) -> str:
+        r"""Returns the recorded hash of a build input, e.g. the template, or
+            None."""
+        with self.lock:
+            row = self.conn.execute('SELECT digest FROM inputs WHERE key = ?',
+                                    (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_input(self, key: str, digest: str) -> None:
+        with self.lock:
+            self.conn.execute('INSERT OR REPLACE INTO inputs VALUES (?, ?)',
+                              (key, digest))
+
+    def invalidate_fields(self) -> None:
+        r"""Drops every rendered field, keeping the file hashes."""
+        with self.lock:
+            for entry in self.files.values():
+                entry[3] = None
+            self.conn.execute('UPDATE files SET fields = NULL')
+
+    def stat_digest(self, kind: str, name: str, file_path: str) -> tuple:
+        r"""Returns the hash of a file, reading it only if its size or mtime
+            changed since it was recorded.
+
+        Args:
+            kind (str): Either 'metadata', 'media' or 'rank'.
+            name (str): The name of the file.
+            file_path (str): The path to the file.
+
+        Returns:
+            tuple: The hash and whether the file changed, or None if it does
+                not exist.
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+
+        entry = self.files.get((kind, name))
+        if entry is not None and entry[0] == stat.st_size and \
+                entry[1] == stat.st_mtime_ns:
+            return entry[2], False
+
+        digest = self.hash_file(file_path)
+        changed = entry is None or entry[2] != digest
+        with self.lock:
+            self.files[(kind, name)] = [stat.st_size, stat.st_mtime_ns, digest,
+                                        entry[3] if not changed else None]
+            self.dirty.add((kind, name))
+        return digest, changed
+
+    def get_fields(self, kind: str, name: str, digest: str) -> list:
+        r"""Returns the fields rendered from a file with this hash, or None."""
+        entry = self.files.get((kind, name))
+        if entry is None or entry[2] != digest or entry[3] is None:
+            return None
+        return json.loads(entry[3])
+
+    def get_unchanged_fields(self, kind: str, name: str,
+                             stat: os.stat_result) -> list:
+        r"""Returns the fields recorded for a file if its size and mtime did
+            not change since, or None, without reading it."""
+        entry = self.files.get((kind, name))
+        if entry is None or entry[3] is None or \
+                entry[0] != stat.st_size or entry[1] != stat.st_mtime_ns:
+            return None
+        return json.loads(entry[3])
+
+    def put_fields(self, kind: str, name: str, digest: str, fields: list,
+                   size: int = -1, mtime_ns: int = -1) -> None:
+        r"""Records the fields rendered from a file with this hash, and its
+            size and mtime if given."""
+        entry = self.files.get((kind, name))
+        if size == -1 and entry is not None and entry[2] == digest:
+            size, mtime_ns = entry[:2]
+        with self.lock:
+            self.files[(kind, name)] = [size, mtime_ns, digest,
+                                        json.dumps(fields, ensure_ascii=False)]
+            self.dirty.add((kind, name))
+
+    def digest(self, kind: str, names: list) -> str:
+        r"""Returns a hash of the recorded hashes of some files."""
+        digest = hashlib.sha256()
+        for name in names:
+            entry = self.files.get((kind, name))
+            digest.update(f'{name}\t{entry[2] if entry else ""}\n'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def commit(self) -> None:
+        with self.lock:
+            self.conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                                  [(kind, name, *self.files[(kind, name)])
+                                   for kind, name in self.dirty])
+            self.conn.commit()
+            self.dirty.clear()
+
+    def close(self) -> None:
+        self.commit()
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == '__main__':
+    pass
@@ -1,10 +1,24 @@
 import logging
 import os
+import re
+import threading
+import unicodedata
+from collections import deque
 
 import openai
 
+from .completion_cache import CompletionCache
+from .scheduler import Scheduler
+
 __all__ = ['ChatGPT']
 
+BATCH_INSTRUCTION = ('接下来我会一次询问你多个单词. 请按照编号顺序逐个回答, 不要遗漏任何单词. '
+                     '在每个单词的回答之前, 单独用一行写出 `=== 编号. 单词 ===`, '
+                     '比如说 `=== 1. гарантия ===`, 然后再按照上述格式回答这个单词.')
+
+SECTION_REGEX = re.compile(r'^\s*=+\s*(\d+)\s*[.)]\s*(.*?)\s*=+\s*$', re.M)
+SENSE_REGEX = re.compile(r'^\s*\d+\.\s', re.M)
+
 
 class ChatGPT:
     r"""A class for generating responses using the OpenAI API.
@@ -18,20 +32,45 @@ class ChatGPT:
         logger (logging.Logger): A logger object for logging errors.
         max_retries (int, optional): The maximum number of retries to attempt
             when calling the OpenAI API.
+        scheduler (Scheduler, optional): The scheduler pacing the requests and
+            the retries of all workers. Defaults: an unlimited `Scheduler`.
+        max_tokens (int, optional): The maximum number of tokens of a
+            completion. Defaults: 2048.
+        batch_size (int, optional): The maximum number of words packed into
+            one request by `generate_batch`. It is further lowered to keep the
+            expected completion under `max_tokens`. Defaults: 8.
+        cache (CompletionCache, optional): A completion cache answering the
+            words already asked with the same engine, prompt and max_tokens
+            without calling the API. Defaults: None.
 
     """
 
     def __init__(self, api_key: str, engine: str, prompt: str, articulation: str,
-                 logger: logging.Logger, max_retries: int = 5) -> None:
+                 logger: logging.Logger, max_retries: int = 5,
+                 scheduler: Scheduler = None, max_tokens: int = 2048,
+                 batch_size: int = 8, cache: CompletionCache = None) -> None:
 
         # load the OpenAI api key
         openai.api_key = self._load_content(api_key)
 
         self.engine = engine
         self.prompt = f'{self._load_content(prompt)}\n{self._load_content(articulation)}'
+        self.batch_prompt = f'{self._load_content(prompt)}\n{BATCH_INSTRUCTION}'
 
         self.logger = logger
         self.max_retries = max_retries
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+        self.max_tokens = max_tokens
+        self.batch_size = batch_size
+
+        self.cache = cache
+        if cache is not None:
+            self.prompt_hash = cache.register_prompt(self.prompt)
+            self.batch_prompt_hash = cache.register_prompt(self.batch_prompt)
+
+        # running estimate of the completion tokens spent per word
+        self.lock = threading.Lock()
+        self.tokens_per_word = 256.
 
     @staticmethod
     def _load_content(string: str) -> str:
@@ -59,20 +98,191 @@ class ChatGPT:
         Returns:
             str: The generated response.
         """
+        if self.cache is not None:
+            completion = self.cache.get(self.engine, self.prompt_hash,
+                                        index, self.max_tokens)
+            if completion is not None:
+                return completion
+
         for i in range(self.max_retries):
             try:
-                response = openai.Completion.create(
-                    prompt=f'{self.prompt}: {index}.\n',
-                    engine=self.engine, max_tokens=2048)
-                return "\n".join([s for
-                                  s in response["choices"][0]["text"].split("\n")
-                                  if s.strip()])
+                with self.scheduler.slot():
+                    response = openai.Completion.create(
+                        prompt=f'{self.prompt}: {index}.\n',
+                        engine=self.engine, max_tokens=self.max_tokens)
+                choice = response["choices"][0]
+                completion = self._strip_lines(choice["text"])
+                # a completion cut off at the length limit is used but not
+                # cached, like the sections of `generate_batch`
+                if self.cache is not None and choice.get("finish_reason") != "length":
+                    self.cache.put(self.engine, self.prompt_hash,
+                                   index, self.max_tokens, completion)
+                return completion
             except Exception as e:
                 self.logger.error(f"Error getting response for `{index}`"
                                   f"({i + 1}/{self.max_retries}): {e}")
+                if i + 1 < self.max_retries:
+                    self.scheduler.backoff(i, e)
 
         return None  # noqa
 
+    @staticmethod
+    def _strip_lines(text: str) -> str:
+        return "\n".join([s for s in text.split("\n") if s.strip()])
+
+    @staticmethod
+    def _normalize_word(word: str) -> str:
+        r"""Drops the stress marks, backticks and case of a word, so that an
+            echoed word can be matched against the asked one."""
+        word = unicodedata.normalize('NFD', word.strip(' \'"«».').replace('`', ''))
+        return ''.join(c for c in word
+                       if not unicodedata.combining(c)).lower().replace('ё', 'е')
+
+    def get_batch_size(self) -> int:
+        r"""Returns the number of words of the next batch, the configured
+            `batch_size` lowered so that the expected completion stays within
+            80% of `max_tokens`."""
+        with self.lock:
+            fit = int(0.8 * self.max_tokens / self.tokens_per_word)
+        return max(1, min(self.batch_size, fit))
+
+    def _split_batch(self, indexes: list, text: str, truncated: bool = False) -> dict:
+        r"""Maps the sections of a batched completion back to their words.
+
+        Args:
+            indexes (list): The words of the batch, in prompt order.
+            text (str): The completion text.
+            truncated (bool, optional): Whether the completion was cut off,
+                in which case the last section, having no header after it,
+                may be incomplete and is dropped. Defaults: False.
+
+        Returns:
+            dict: A mapping from word to its answer, holding only the words
+                whose section is present, matches the word and is well formed.
+        """
+        answers, seen = dict(), set()
+        headers = list(SECTION_REGEX.finditer(text))
+        if truncated:
+            headers, last = headers[:-1], headers[-1:]
+        for k, header in enumerate(headers):
+            number = int(header.group(1)) - 1
+            if not 0 <= number < len(indexes):
+                continue
+            index = indexes[number]
+            echoed = header.group(2)
+            if echoed and self._normalize_word(echoed) != self._normalize_word(index):
+                continue
+
+            if k + 1 < len(headers):
+                end = headers[k + 1].start()
+            else:
+                end = last[0].start() if truncated and last else len(text)
+            body = self._strip_lines(text[header.end():end])
+            if index in seen or not SENSE_REGEX.search(body):
+                # duplicated or malformed sections are asked again
+                answers.pop(index, None)
+            else:
+                answers[index] = body
+            seen.add(index)
+
+        return answers
+
+    def _request_batch(self, indexes: list) -> tuple:
+        r"""Sends one batched request.
+
+        Args:
+            indexes (list): The words of the batch.
+
+        Returns:
+            tuple: The well-formed answers of the batch, see `_split_batch`,
+                and the words whose answer is known to be complete, i.e. all
+                of them if the completion stopped by itself, otherwise those
+                with a header after their section.
+        """
+        questions = '\n'.join(f'{n + 1}. {index}' for n, index in enumerate(indexes))
+        with self.scheduler.slot():
+            response = openai.Completion.create(
+                prompt=f'{self.batch_prompt}\n{questions}\n',
+                engine=self.engine, max_tokens=self.max_tokens)
+
+        choice = response["choices"][0]
+        truncated = choice.get("finish_reason") == "length"
+        # the words of a cut off section are asked again
+        answers = self._split_batch(indexes, choice["text"], truncated=truncated)
+        if choice.get("finish_reason") == "stop" or truncated:
+            complete = set(answers)
+        else:
+            complete = set(self._split_batch(indexes, choice["text"], truncated=True))
+
+        usage = response.get("usage") or {}
+        with self.lock:
+            if truncated:
+                # the completion was cut off, the batch was too large
+                self.tokens_per_word = max(self.tokens_per_word,
+                                           self.max_tokens / max(1, len(answers)))
+            elif answers and usage.get("completion_tokens"):
+                observed = usage["completion_tokens"] / len(answers)
+                self.tokens_per_word = 0.8 * self.tokens_per_word + 0.2 * observed
+
+        return answers, complete
+
+    def generate_batch(self, indexes: list) -> dict:
+        r"""Generates the responses of many words, packing several words into
+            each request. Only the words whose sections are missing or
+            malformed are asked again, up to `max_retries` times each.
+
+        Args:
+            indexes (list): The words to generate responses for.
+
+        Returns:
+            dict: A mapping from word to its generated response, or None for
+                the words that could not be answered.
+        """
+        results = dict()
+        if self.cache is not None:
+            for index in dict.fromkeys(indexes):
+                completion = self.cache.get(self.engine, self.batch_prompt_hash,
+                                            index, self.max_tokens)
+                if completion is not None:
+                    results[index] = completion
+
+        attempts = dict.fromkeys(indexes, 0)
+        pending = deque(index for index in dict.fromkeys(indexes)
+                        if index not in results)
+
+        while pending:
+            batch = [pending.popleft()
+                     for _ in range(min(self.get_batch_size(), len(pending)))]
+            try:
+                answers, complete = self._request_batch(batch)
+                error = None
+            except Exception as e:
+                answers, complete, error = dict(), set(), e
+
+            for index in batch:
+                if index in answers:
+                    results[index] = answers[index]
+                    # a section that may be incomplete is used but not cached,
+                    # so that the next runs ask for it again
+                    if self.cache is not None and index in complete:
+                        self.cache.put(self.engine, self.batch_prompt_hash,
+                                       index, self.max_tokens, answers[index])
+                    continue
+
+                attempts[index] += 1
+                self.logger.error(f"Error getting response for `{index}`"
+                                  f"({attempts[index]}/{self.max_retries}): "
+                                  f"{error if error is not None else 'missing or malformed section'}")
+                if attempts[index] < self.max_retries:
+                    pending.append(index)
+                else:
+                    results[index] = None
+
+            if error is not None and pending:
+                self.scheduler.backoff(min(attempts[i] for i in batch) - 1, error)
+
+        return results
+
 
 if __name__ == '__main__':
     from src.logger import create_logger
@@ -84,3 +294,4 @@ if __name__ == '__main__':
                 logger=create_logger('1.log'))
     a = c(r'абзац')
     print(a)
+    print(c.generate_batch([r'абзац', r'гарантия']))
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+__all__ = ['CompletionCache']
+
+
+class CompletionCache:
+    r"""A persistent cache of LLM completions keyed by engine, prompt hash,
+        word and max_tokens. It is stored in WAL-mode SQLite with one
+        connection per thread, so it is safe under the thread pool of
+        `Generator`.
+
+    Args:
+        cache_file (str): The path to the SQLite database.
+    """
+
+    def __init__(self, cache_file: str) -> None:
+        self.cache_file = cache_file
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        conn = self._get_conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS prompts ('
+                     'prompt_hash TEXT PRIMARY KEY, prompt TEXT NOT NULL, '
+                     'created_at REAL NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS completions ('
+                     'engine TEXT NOT NULL, prompt_hash TEXT NOT NULL, '
+                     'word TEXT NOT NULL, max_tokens INTEGER NOT NULL, '
+                     'completion TEXT NOT NULL, created_at REAL NOT NULL, '
+                     'PRIMARY KEY (engine, prompt_hash, word, max_tokens))')
+        conn.commit()
+
+    @staticmethod
+    def hash_prompt(prompt: str) -> str:
+        return hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+
+    def _get_conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.cache_file, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def register_prompt(self, prompt: str) -> str:
+        r"""Records a prompt version so that it can be listed later.
+
+        Args:
+            prompt (str): The prompt text.
+
+        Returns:
+            str: The hash of the prompt.
+        """
+        prompt_hash = self.hash_prompt(prompt)
+        conn = self._get_conn()
+        conn.execute('INSERT OR IGNORE INTO prompts VALUES (?, ?, ?)',
+                     (prompt_hash, prompt, time.time()))
+        conn.commit()
+        return prompt_hash
+
+    def get(self, engine: str, prompt_hash: str, word: str,
+            max_tokens: int) -> str:
+        r"""Looks up a completion.
+
+        Returns:
+            str: The cached completion, or None.
+        """
+        row = self._get_conn().execute(
+            'SELECT completion FROM completions WHERE engine = ? AND '
+            'prompt_hash = ? AND word = ? AND max_tokens = ?',
+            (engine, prompt_hash, word, max_tokens)).fetchone()
+        with self.lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return row[0] if row is not None else None
+
+    def put(self, engine: str, prompt_hash: str, word: str,
+            max_tokens: int, completion: str) -> None:
+        r"""Stores a completion."""
+        conn = self._get_conn()
+        conn.execute('INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?)',
+                     (engine, prompt_hash, word, max_tokens, completion,
+                      time.time()))
+        conn.commit()
+
+    def list_versions(self) -> list:
+        r"""Lists the cached prompt versions.
+
+        Returns:
+            list: Tuples of engine, prompt hash, number of entries, time of the
+                newest entry and the first line of the prompt.
+        """
+        return self._get_conn().execute(
+            'SELECT c.engine, c.prompt_hash, COUNT(*), MAX(c.created_at), '
+            'COALESCE(p.prompt, \'\') FROM completions c LEFT JOIN prompts p '
+            'ON c.prompt_hash = p.prompt_hash GROUP BY c.engine, c.prompt_hash '
+            'ORDER BY MAX(c.created_at) DESC').fetchall()
+
+    def prune(self, prompt_hash: str = None, engine: str = None,
+              older_than: float = None, keep_hashes: list = None) -> int:
+        r"""Deletes cached completions.
+
+        Args:
+            prompt_hash (str, optional): Only delete this prompt version.
+            engine (str, optional): Only delete the entries of this engine.
+            older_than (float, optional): Only delete the entries created more
+                than this many seconds ago.
+            keep_hashes (list, optional): Keep these prompt versions, e.g. the
+                current ones.
+
+        Returns:
+            int: The number of deleted entries.
+        """
+        clauses, params = list(), list()
+        if prompt_hash is not None:
+            clauses.append('prompt_hash = ?')
+            params.append(prompt_hash)
+        if keep_hashes:
+            clauses.append(f'prompt_hash NOT IN ({", ".join("?" * len(keep_hashes))})')
+            params.extend(keep_hashes)
+        if engine is not None:
+            clauses.append('engine = ?')
+            params.append(engine)
+        if older_than is not None:
+            clauses.append('created_at < ?')
+            params.append(time.time() - older_than)
+        where = f' WHERE {" AND ".join(clauses)}' if clauses else ''
+
+        conn = self._get_conn()
+        deleted = conn.execute(f'DELETE FROM completions{where}', params).rowcount
+        conn.execute('DELETE FROM prompts WHERE prompt_hash NOT IN '
+                     '(SELECT DISTINCT prompt_hash FROM completions)')
+        conn.commit()
+        conn.execute('VACUUM')
+        return deleted
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='List or prune the cached LLM completions.')
+    parser.add_argument('command', type=str, choices=['list', 'prune'],
+                        help='')
+    parser.add_argument('-c', '--cache_file', type=str,
+                        default='outputs/completions.sqlite3',
+                        help='Path to the completion cache')
+    parser.add_argument('-p', '--prompt_hash', type=str, default=None,
+                        help='Prompt version to prune')
+    parser.add_argument('-k', '--keep_prompt', type=str, nargs=2, default=None,
+                        metavar=('PROMPT', 'ARTICULATION'),
+                        help='Prune every version but the one of this prompt '
+                             'file and articulation')
+    parser.add_argument('-e', '--engine', type=str, default=None,
+                        help='Engine to prune')
+    parser.add_argument('-d', '--older_than_days', type=float, default=None,
+                        help='Only prune entries older than this many days')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.cache_file):
+        raise FileNotFoundError(f'`{args.cache_file}` is not a file!')
+    cache = CompletionCache(args.cache_file)
+
+    if args.command == 'list':
+        for engine, prompt_hash, count, newest, prompt in cache.list_versions():
+            print(f'{engine}\t{prompt_hash}\t{count}\t'
+                  f'{time.strftime("%Y-%m-%d %H:%M", time.localtime(newest))}\t'
+                  f'{prompt.splitlines()[0][:40] if prompt else ""}')
+    else:
+        keep_hashes = None
+        if args.keep_prompt is not None:
+            from src.chatgpt import BATCH_INSTRUCTION, ChatGPT
+
+            prompt, articulation = [ChatGPT._load_content(string)
+                                    for string in args.keep_prompt]
+            keep_hashes = [cache.hash_prompt(f'{prompt}\n{articulation}'),
+                           cache.hash_prompt(f'{prompt}\n{BATCH_INSTRUCTION}')]
+        if args.prompt_hash is None and keep_hashes is None and \
+                args.older_than_days is None:
+            parser.error('prune needs --prompt_hash, --keep_prompt or '
+                         '--older_than_days')
+        deleted = cache.prune(prompt_hash=args.prompt_hash, engine=args.engine,
+                              keep_hashes=keep_hashes,
+                              older_than=args.older_than_days * 86400
+                              if args.older_than_days is not None else None)
+        print(f'Pruned {deleted} completions.')
@@ -4,9 +4,25 @@ import re
 from urllib.parse import quote
 from urllib.request import urlopen
 
-from bs4 import BeautifulSoup
+from .parsers import PARSERS
+from .response_cache import ResponseCache
+from .scheduler import Scheduler
 
-__all__ = ['Crawler']
+__all__ = ['Crawler', 'CaptchaError']
+
+CAPTCHA_REGEX = re.compile(r'<form[^>]*\bid=["\']search-form-index["\']')
+
+
+class CaptchaError(Exception):
+    r"""Raised when the site answers with a captcha instead of the page.
+
+    Args:
+        retry_after (float): The time in seconds to wait before retrying.
+    """
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f'Detected captcha, waiting for {retry_after} seconds...')
+        self.retry_after = retry_after
 
 
 class Crawler:
@@ -18,45 +34,80 @@ class Crawler:
             fetching a page. Defaults: 5.
         wait_time (int, optional): The waiting time in seconds when a captcha
             is detected. Defaults: 60.
+        base_url (str, optional): The URL prefix of the pages to be fetched.
+            Defaults: 'https://en.openrussian.org/ru'.
+        cache (ResponseCache, optional): A response cache serving previously
+            fetched pages without touching the network. Defaults: None.
+        parser (str, optional): The HTML extraction backend, one of `PARSERS`.
+            Defaults: 'bs4'.
+        scheduler (Scheduler, optional): The scheduler pacing the requests and
+            the retries of all workers. Defaults: an unlimited `Scheduler`.
     """
 
     def __init__(self, logger: logging.Logger,
-                 max_retries: int = 5, wait_time: int = 60) -> None:
+                 max_retries: int = 5, wait_time: int = 60,
+                 base_url: str = 'https://en.openrussian.org/ru',
+                 cache: ResponseCache = None, parser: str = 'bs4',
+                 scheduler: Scheduler = None) -> None:
 
         self.logger = logger
         self.max_retries = max_retries
         self.wait_time = wait_time
+        self.base_url = base_url.rstrip('/')
+        self.cache = cache
+        self.parser = parser
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+
+    def _get_url(self, index: str) -> str:
+        r"""Builds the protected URL of a given index.
+
+        Args:
+            index (str): The index of the page.
 
-    def _fetch_html(self, index: str) -> BeautifulSoup:
+        Returns:
+            str: The quoted URL of the page.
+        """
+        return quote(f'{self.base_url}/{index}', safe=':/?&=')
+
+    def _fetch_html(self, index: str) -> str:
         r"""Fetches the HTML content of a given index.
 
         Args:
             index (str): The index of the page.
 
         Returns:
-            BeautifulSoup: A BeautifulSoup object containing the parsed HTML
-                content, or None if the page cannot be fetched.
+            str: The decoded HTML content, or None if the page cannot be
+                fetched.
         """
-        # protect URL
-        url = f'https://en.openrussian.org/ru/{index}'
-        url = quote(url, safe=':/?&=')
+        url = self._get_url(index)
+
+        if self.cache is not None:
+            body = self.cache.get(url)
+            if body is not None:
+                return codecs.decode(body, 'utf-8')
 
-        # beautiful soup
         for i in range(self.max_retries):
             try:
-                html = urlopen(url)
-                soup = BeautifulSoup(codecs.decode(html.read(), 'utf-8'),
-                                     'html.parser')
-                # if soup.find('form', {'id': 'search-form-index'}):
-                #     self.logger.info(f"Detected captcha, waiting for "
-                #                      f"{self.wait_time} seconds...")
-                #     time.sleep(self.wait_time)
-                #     continue
-                return soup
+                with self.scheduler.slot():
+                    with urlopen(url) as html:
+                        body = html.read()
+                    html = codecs.decode(body, 'utf-8')
+                    if CAPTCHA_REGEX.search(html):
+                        raise CaptchaError(self.wait_time)
+                if self.cache is not None:
+                    self.cache.put(url, body)
+                return html
 
             except Exception as e:
                 self.logger.error(f"Error fetching HTML for `{index}`"
                                   f"({i + 1}/{self.max_retries}): {e}")
+                status = Scheduler.get_status(e)
+                # a missing or forbidden page will not appear on retrying
+                if status is not None and 400 <= status < 500 and \
+                        status not in Scheduler.THROTTLE_STATUSES:
+                    break
+                if i + 1 < self.max_retries:
+                    self.scheduler.backoff(i, e)
 
         return None  # noqa
 
@@ -71,57 +122,27 @@ class Crawler:
                 the pronunciation (bytes), or None if the page cannot be
                 retrieved.
         """
-        soup = self._fetch_html(index)
-
-        if soup is not None:
-            html = soup.find('div', {'id': "content"})
-
-            accent = html.find('span').text
-            accent = accent if accent != '' else 'None'
-            # print(accent)
-
-            types = html.find('div', {"class": "overview"}). \
-                find_all('p')
-            types = [type.text for type in types]
-            types = '\n'.join(types)
-            types = types if types != '' else 'None'
-            # print(types)
-
-            tags = html.find('div', {"class": "tags"}). \
-                find_all('a')
-            tags = [tag.text for tag in tags]
-            tags = '\n'.join(tags)
-            tags = tags if tags != '' else 'None'
-            # print(tags)
-
-            trans = html.find('div', {"class": "section translations"}). \
-                find_all('div', {"class": "content"})
-            trans = [tran.text for tran in trans]
-            trans = '\n'.join(trans)
-            trans = trans if trans != '' else 'None'
-            # print(trans)
-
-            ru_sentences = html.find_all('span', {'class': 'ru'})
-            ru_sentences = [ru_sentence.text
-                            for ru_sentence in ru_sentences]
-            # print(ru_sentences)
-
-            tl_sentences = html.find_all('span', {'class': 'tl'})
-            tl_sentences = [tl_sentence.text
-                            for tl_sentence in tl_sentences]
-            # print(tl_sentences)
-
-            sentences = list()
-            for ru, tl in zip(ru_sentences, tl_sentences):
-                sentences.append(f'{ru} | {tl}')
-            sentences = '\n'.join(sentences)
-            sentences = sentences if sentences != '' else 'None'
-            # print(sentences)
-
-            return index, accent, types, tags, trans, sentences
+        html = self._fetch_html(index)
+
+        if html is not None:
+            return self._parse_html(index, html)
         else:
             return None  # noqa
 
+    def _parse_html(self, index: str, html: str) -> tuple:
+        r"""Extracts the data of a given index from its HTML content with the
+            configured parser backend.
+
+        Args:
+            index (str): The index of the page.
+            html (str): The HTML content of the page.
+
+        Returns:
+            tuple: A tuple containing the index, the accent, the overview, the
+                tags, the translations and the example sentences.
+        """
+        return PARSERS[self.parser](index, html)
+
 
 def regex_for_word(word: str) -> str:
     word = re.sub(r'<h2[^>]*>|</h2[^>]*>', '', word)
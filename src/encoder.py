@@ -1,16 +1,83 @@
+import hashlib
+import inspect
+import json
 import logging
 import os
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
 
 import genanki
 from tqdm import tqdm
 
+from .apkg_writer import ApkgWriter
+from .build_manifest import BuildManifest
+from .fileio import atomic_write
+from .media import mp3_error
+from .metadata_store import MetadataStore
+from .renderer import FieldRenderer
+from .transcoder import Transcoder
+from .word_index import WordIndex
+
 __all__ = ['Encoder']
 
+# the encoder of a worker process, see `Encoder._render_parallel`, and the
+# rendered fields shared by the band workers, see `Encoder.build_bands`
+_worker_encoder = None
+_worker_fields = None
+
+
+def _init_worker(encoder, fields: dict = None) -> None:
+    global _worker_encoder, _worker_fields
+    _worker_encoder = encoder
+    _worker_fields = fields
+
+
+def _render_chunk(jobs: list, encoder=None) -> list:
+    r"""Reads and renders a chunk of metadata, see `Encoder._render`."""
+    encoder = encoder if encoder is not None else _worker_encoder
+    results = list()
+    for index, index_path, content, _, _ in jobs:
+        if content is None:
+            with open(index_path, "r") as file:
+                content = file.read()
+        results.append(encoder._render(index, content))
+
+    return results
+
+
+def _validate_chunk(jobs: list, encoder=None) -> list:
+    r"""Validates a chunk of dataset files, see `Encoder._validate`."""
+    encoder = encoder if encoder is not None else _worker_encoder
+    return [encoder._validate(*job) for job in jobs]
+
+
+def _write_band(job: tuple, encoder=None, fields: dict = None) -> tuple:
+    r"""Writes the package of a frequency band, see `Encoder.build_bands`.
+
+    Returns:
+        tuple: The path to the package, its numbers of notes and media files.
+    """
+    encoder = encoder if encoder is not None else _worker_encoder
+    fields = fields if fields is not None else _worker_fields
+    apkg_path, deck_id, deck_name, indexes, media = job
+    with ApkgWriter(apkg_path, deck_id, deck_name, encoder.template,
+                    dedupe=encoder.dedupe_media) as writer:
+        for path in media:
+            writer.add_media(path)
+        for index in indexes:
+            if fields.get(index) is not None:
+                writer.add_note(genanki.Note(model=encoder.template,
+                                             fields=fields[index]))
+
+    return apkg_path, writer.num_notes, len(writer.media)
+
 
 class Encoder(ABC):
     r"""An abstract class that provides encoding functionality to create Anki
-        decks from given metadata and media files.
+        decks from given metadata and media files. Subclasses may declare the
+        `FieldRenderer` of each field of their note type in `renderers`, to
+        be used by their `_sort_slices`.
 
     Args:
         template (genanki.Model): An Anki note model containing fields to be
@@ -18,14 +85,32 @@ class Encoder(ABC):
         divider (str): A string used to separate different slices of metadata.
         logger (logging.Logger): A logger object to record encoding progress
             and errors.
+        manifest (BuildManifest, optional): The manifest of the previous
+            build, whose rendered fields are reused for the unchanged words.
+            Defaults to None.
+        workers (int, optional): The number of processes reading and
+            rendering the metadata. Defaults to 1.
+        dedupe_media (bool, optional): Whether to store byte-identical media
+            files once, pointing the notes at the shared file. Defaults to
+            False.
+        transcoder (Transcoder, optional): The transcoder of the media files,
+            whose smaller variants are packaged instead. Defaults to None.
     """
 
+    renderers = dict()
+
     def __init__(self, template: genanki.Model,
-                 divider: str, logger: logging.Logger) -> None:
+                 divider: str, logger: logging.Logger,
+                 manifest: BuildManifest = None, workers: int = 1,
+                 dedupe_media: bool = False, transcoder: Transcoder = None) -> None:
 
         self.template = template
         self.divider = divider
         self.logger = logger
+        self.manifest = manifest
+        self.workers = workers
+        self.dedupe_media = dedupe_media
+        self.transcoder = transcoder
 
     def _get_media_list(self, indexes: list, mediaset_path: str) -> list:
         r"""Reads a list of indexes from a file, and returns a list of
@@ -36,18 +121,43 @@ class Encoder(ABC):
             mediaset_path (str): A path to a directory containing media files.
 
         Returns:
-            A list of media file paths.
+            A list of media file paths, transcoded if there is a transcoder.
+        """
+        media_list, digests = self.find_media(indexes, mediaset_path)
+        if self.transcoder is not None:
+            media_list = self.transcoder(media_list, digests=digests)
+        return media_list
+
+    def find_media(self, indexes: list, mediaset_path: str) -> tuple:
+        r"""Finds the media files of a list of indexes without transcoding
+            them, recording their hash in the manifest if there is one.
+
+        Args:
+            indexes (list): A list of indexes.
+            mediaset_path (str): A path to a directory containing media files.
+
+        Returns:
+            A tuple of the list of the source media file paths, and of their
+                SHA-256 by path if there is a manifest.
         """
-        media_list = list()
+        media_list, digests = list(), dict()
         for index in indexes:
             index_path = os.path.join(mediaset_path, f'{index}.mp3')
-            if os.path.isfile(index_path):
+            if self.manifest is not None:
+                result = self.manifest.stat_digest('media', index, index_path)
+                if result is not None:
+                    media_list.append(index_path)
+                    digests[index_path] = result[0]
+                else:
+                    self.logger.error(f'Media `{index}` is not in dataset `{mediaset_path}`, '
+                                      f'skipping...')
+            elif os.path.isfile(index_path):
                 media_list.append(index_path)
             else:
                 self.logger.error(f'Media `{index}` is not in dataset `{mediaset_path}`, '
                                   f'skipping...')
 
-        return media_list
+        return media_list, digests
 
     def _get_metadata_list(self, indexes: list, metadataset_path: str) -> list:
         r"""Reads a list of indexes from a file, and returns a list of
@@ -56,33 +166,193 @@ class Encoder(ABC):
         Args:
             indexes (list): A list of indexes.
             metadataset_path (str): A path to a directory containing metadata
-                files.
+                files, or to a `MetadataStore`.
 
         Returns:
             A list of lists, where each inner list contains metadata slices
                 for a single index.
         """
-        metadata_list = list()
+        return list(self._iter_metadata(self.plan_metadata(indexes, metadataset_path)))
+
+    def plan_metadata(self, indexes: list, metadataset_path: str) -> list:
+        r"""Finds the metadata of a list of indexes, and which of them have
+            fields reusable from the previous build, without rendering any.
+
+        Args:
+            indexes (list): A list of indexes.
+            metadataset_path (str): A path to a directory containing metadata
+                files, or to a `MetadataStore`.
+
+        Returns:
+            A list of `(index, path, content, digest, cached)` tuples in the
+                order of the indexes, leaving out the missing ones.
+        """
+        contents = None
+        if MetadataStore.is_store(metadataset_path):
+            # one sequential scan instead of an open per index
+            contents = MetadataStore(metadataset_path).get_many(indexes)
+
+        plan, reused = list(), 0
         for index in indexes:
-            index_path = os.path.join(metadataset_path, f'{index}.txt')
-            if os.path.isfile(index_path):
-                with open(index_path, "r") as file:
-                    metadata_slices = file.read().strip().split(self.divider)
-                    metadata_slices = list(filter(None, metadata_slices))
-                    metadata_slices = self._sort_slices(metadata_slices)
-                    if len(metadata_slices) == len(self.template.fields):
-                        metadata_list.append(metadata_slices)
-                    else:
-                        self.logger.error(f'Incorrect metadata format for `{index}`. '
-                                          f'Expecting metadata to have '
-                                          f'{len(self.template.fields)} fields, '
-                                          f'but got {len(metadata_slices)} fields '
-                                          f'instead, skipping...')
+            index_path, content, digest = None, None, None
+            if contents is not None:
+                content = contents.get(index)
+                exists = content is not None
+                if exists and self.manifest is not None:
+                    digest = BuildManifest.hash_bytes(content.encode('utf-8'))
             else:
+                index_path = os.path.join(metadataset_path, f'{index}.txt')
+                if self.manifest is not None:
+                    # unchanged files are recognized by their size and mtime
+                    result = self.manifest.stat_digest('metadata', index, index_path)
+                    digest = result[0] if result is not None else None
+                    exists = result is not None
+                else:
+                    exists = os.path.isfile(index_path)
+            if not exists:
                 self.logger.error(f'Word `{index}` is not in dataset `{metadataset_path}`, '
                                   f'skipping...')
+                continue
+
+            cached = digest is not None and \
+                self.manifest.get_fields('metadata', index, digest) is not None
+            if digest is not None and not cached:
+                # the digest is recorded before rendering, so that the build
+                # can be keyed on it
+                self.manifest.put_fields('metadata', index, digest, None)
+            plan.append((index, index_path, content, digest, cached))
+            reused += cached
+
+        if self.manifest is not None:
+            self.logger.info(f'Reusing the rendered fields of {reused} unchanged '
+                             f'words, rendering {len(plan) - reused}.')
+
+        return plan
+
+    def _iter_metadata(self, plan: list):
+        r"""Yields the metadata slices of a plan in order, as they are read
+            and rendered, so that they are not all held in memory.
+
+        Args:
+            plan (list): The words to read, see `plan_metadata`.
+
+        Yields:
+            The list of metadata slices of each well-formed word.
+        """
+        return (fields for _, fields in self.iter_rendered(plan))
+
+    def iter_rendered(self, plan: list):
+        r"""Renders the words of a plan whose fields are not reusable, and
+            records them in the manifest if there is one.
+
+        Args:
+            plan (list): The words to render, see `plan_metadata`.
+
+        Yields:
+            The index and the metadata slices of each well-formed word, in
+                order.
+        """
+        jobs = [job for job in plan if not job[4]]
+        if self.workers > 1 and len(jobs) > self.workers:
+            rendered = self._render_parallel(jobs)
+        else:
+            rendered = (_render_chunk([job], self)[0] for job in jobs)
+
+        for index, _, _, digest, cached in plan:
+            if cached:
+                yield index, self.manifest.get_fields('metadata', index, digest)
+                continue
+
+            metadata_slices, error = next(rendered)
+            if error is not None:
+                self.logger.error(error)
+            if digest is not None:
+                self.manifest.put_fields('metadata', index, digest, metadata_slices)
+            if metadata_slices is not None:
+                yield index, metadata_slices
+
+    def _render_parallel(self, jobs: list):
+        r"""Reads and renders metadata on a process pool, in chunks and in
+            order.
+
+        Args:
+            jobs (list): The words to render, see `plan_metadata`.
+
+        Yields:
+            A `(fields, error)` tuple for each job, in order.
+        """
+        # a few chunks per worker balance the load without much pickling
+        chunk_size = -(-len(jobs) // (self.workers * 4))
+        chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 initializer=_init_worker,
+                                 initargs=(self,)) as pool:
+            for results in pool.map(_render_chunk, chunks):
+                yield from results
+
+    def _render(self, index: str, content: str) -> tuple:
+        r"""Renders the fields of a note from the content of a metadata file.
+
+        Args:
+            index (str): The index of the metadata.
+            content (str): The divider-joined metadata slices.
+
+        Returns:
+            A tuple of the list of fields and None, or of None and an error
+                message if the metadata is malformed.
+        """
+        metadata_slices = content.strip().split(self.divider)
+        metadata_slices = list(filter(None, metadata_slices))
+        metadata_slices = self._sort_slices(metadata_slices)
+        if len(metadata_slices) == len(self.template.fields):
+            return metadata_slices, None
+
+        return None, (f'Incorrect metadata format for `{index}`. '
+                      f'Expecting metadata to have '
+                      f'{len(self.template.fields)} fields, '
+                      f'but got {len(metadata_slices)} fields '
+                      f'instead, skipping...')
+
+    def __getstate__(self) -> dict:
+        # the manifest stays in the parent process
+        state = self.__dict__.copy()
+        state['manifest'] = None
+        return state
+
+    def template_digest(self) -> str:
+        r"""Returns the hash of the card templates and the CSS of the note
+            model, which change the package but not the rendered fields."""
+        return hashlib.sha256(json.dumps([self.template.templates, self.template.css],
+                                         ensure_ascii=False, sort_keys=True)
+                              .encode('utf-8')).hexdigest()
+
+    def renderer_digest(self) -> str:
+        r"""Returns the hash of the fields of the note model, the divider and
+            the code rendering the fields."""
+        renderer = json.dumps([self.template.model_id, self.template.name,
+                               self.template.fields, self.divider],
+                              ensure_ascii=False, sort_keys=True)
+        digest = hashlib.sha256(renderer.encode('utf-8'))
+        for source in (type(self), FieldRenderer):
+            digest.update(BuildManifest.hash_file(inspect.getfile(source)).encode())
+        return digest.hexdigest()
+
+    def check_renderer(self) -> str:
+        r"""Invalidates the cached fields if the fields of the template, the
+            divider or the code rendering the fields changed since the
+            previous build.
 
-        return metadata_list
+        Returns:
+            str: The hash of the renderer.
+        """
+        digest = self.renderer_digest()
+        if self.manifest.get_input('renderer') != digest:
+            self.logger.info('The template or the renderer changed, rendering '
+                             'every word again.')
+            self.manifest.invalidate_fields()
+            self.manifest.set_input('renderer', digest)
+        return digest
 
     @staticmethod
     def _get_indexes(indexes_file: str) -> list:
@@ -106,19 +376,22 @@ class Encoder(ABC):
         pass
 
     def _encode_deck(self, deck: genanki.Deck,
-                     metadata: list) -> None:
+                     metadata, total: int = None) -> None:
         r"""Encodes the given metadata into Anki notes and adds them to the
             given deck.
 
         Args:
-            deck: The Anki deck to which the notes are to be added.
-            metadata: A list of lists, where each inner list represents the
-                metadata of a note.
+            deck: The Anki deck or the `ApkgWriter` to which the notes are to
+                be added.
+            metadata: A list or an iterable of lists, where each inner list
+                represents the metadata of a note.
+            total: The number of notes, for the progress bar. Defaults to the
+                length of the metadata.
 
         Returns:
             None.
         """
-        pbar = tqdm(total=len(metadata), unit='word')
+        pbar = tqdm(total=len(metadata) if total is None else total, unit='word')
         for idx, slices in enumerate(metadata):
             deck.add_note(genanki.Note(
                 model=self.template,
@@ -127,43 +400,140 @@ class Encoder(ABC):
         pbar.close()
         self.logger.info(f'End of encoding deck `{deck.name}`.')
 
+    def _write_media(self, writer: ApkgWriter, media: list) -> None:
+        r"""Streams media files into a package, reporting the space saved by
+            the deduplication.
+
+        Args:
+            writer: The `ApkgWriter` of the package.
+            media: A list of media file paths.
+
+        Returns:
+            None.
+        """
+        start, size = time.perf_counter(), 0
+        for path in tqdm(media, unit='file'):
+            digest = None
+            # the manifest holds the hashes of the sources, not of their
+            # transcoded variants
+            if self.manifest is not None and self.dedupe_media and \
+                    self.transcoder is None:
+                digest = self.manifest.stat_digest('media', os.path.basename(path)[:-4],
+                                                   path)[0]
+            if writer.add_media(path, digest=digest):
+                size += os.path.getsize(path)
+        self.logger.info(f'Stored {len(writer.media)} media files '
+                         f'({size / 1e6:.1f} MB) in '
+                         f'{time.perf_counter() - start:.2f}s.')
+        if self.dedupe_media:
+            self.logger.info(f'Deduplicated {len(writer.aliases)} identical media '
+                             f'files, saving {writer.saved_bytes / 1e6:.1f} MB.')
+
+    def _validate(self, index: str, index_path: str, suffix: str,
+                  content: str = None) -> str:
+        r"""Validates the content of a dataset file.
+
+        Returns:
+            str: None if the file is fine, else the problem.
+        """
+        if suffix == 'mp3':
+            return mp3_error(index_path)
+        if suffix != 'txt':
+            return None
+
+        if content is None:
+            with open(index_path, 'rb') as file:
+                data = file.read()
+            try:
+                content = data.decode('utf-8')
+            except UnicodeDecodeError as e:
+                return f'invalid UTF-8 at byte {e.start}'
+        try:
+            fields, _ = self._render(index, content)
+        except Exception as e:
+            return f'malformed metadata: {e!r}'
+        return None if fields is not None else \
+            f'not {len(self.template.fields)} fields'
+
     def check(self, save_path: str, indexes_file: str,
-              dataset_list: list, suffix_list: list) -> None:
-        r"""Checks if the files corresponding to the given indexes exist in the
-            specified dataset directories.
+              dataset_list: list, suffix_list: list) -> dict:
+        r"""Checks that the files corresponding to the given indexes exist in
+            the specified datasets and are valid, i.e. that the metadata is
+            UTF-8 and has the fields of the template, and that the mp3s are
+            made of whole frames. Every dataset is listed once, and the files
+            are validated on the worker processes.
+
+            The indexes with a missing or invalid file are written to
+            `{dataset}_broken.txt`, and a report with the problems and the
+            orphan files, which are not in the indexes, to `check_report.json`.
 
         Args:
             save_path: A string that represents the directory to save the
-                .apkg file.
+                reports.
             indexes_file: The path to the file containing the list of indexes
                  to be checked.
             dataset_list: A list of paths to the directories containing the
-                 dataset files.
+                 dataset files, or to a metadata store.
             suffix_list: A list of suffixes to be appended to the indexes to
                  form the complete file names.
 
          Returns:
-             None.
+             dict: The report.
          """
         with open(indexes_file, 'r') as file:
             indexes = [line.strip().split('\t')[0] for line in file]
         self.logger.info(f'Reading {len(indexes)} words to be checked from '
                          f'`{indexes_file}`.')
 
+        report = {'indexes': len(indexes), 'datasets': dict()}
         for dataset, suffix in zip(dataset_list, suffix_list):
-            if not os.path.isdir(dataset):
+            start = time.perf_counter()
+            contents = None
+            if suffix == 'txt' and MetadataStore.is_store(dataset):
+                contents = MetadataStore(dataset).get_many()
+                names = set(contents)
+            elif not os.path.isdir(dataset):
                 self.logger.error(f'Dataset `{dataset}` is not a directory, '
                                   f'skipping...')
+                continue
+            else:
+                tail = f'.{suffix}'
+                names = {entry.name[:-len(tail)] for entry in os.scandir(dataset)
+                         if entry.name.endswith(tail)}
+            self.logger.info(f'Checking dataset `{dataset}`...')
+
+            wanted = dict.fromkeys(indexes)
+            missing = [index for index in wanted if index not in names]
+            orphans = sorted(names.difference(wanted))
+            jobs = [(index, None if contents is not None else
+                     os.path.join(dataset, f'{index}.{suffix}'), suffix,
+                     contents[index] if contents is not None else None)
+                    for index in wanted if index in names]
+            if self.workers > 1 and len(jobs) > self.workers:
+                chunk_size = -(-len(jobs) // (self.workers * 4))
+                chunks = [jobs[i:i + chunk_size]
+                          for i in range(0, len(jobs), chunk_size)]
+                with ProcessPoolExecutor(max_workers=self.workers,
+                                         initializer=_init_worker,
+                                         initargs=(self,)) as pool:
+                    problems = [problem for results in pool.map(_validate_chunk, chunks)
+                                for problem in results]
             else:
-                self.logger.info(f'Checking dataset `{dataset}`...')
+                problems = _validate_chunk(jobs, self)
+            invalid = {job[0]: problem for job, problem in zip(jobs, problems)
+                       if problem is not None}
 
-            broken_list = list()
-            for index in indexes:
-                flag = os.path.isfile(os.path.join(dataset, f'{index}.{suffix}'))
-                broken_list.append(index) if not flag else None
+            broken_list = [index for index in indexes
+                           if index not in names or index in invalid]
             self.logger.info(f'End of checking dataset `{dataset}`, '
                              f'[{len(broken_list)}/{len(indexes)}] broken '
-                             f'indexes detected.')
+                             f'indexes detected: {len(missing)} missing, '
+                             f'{len(invalid)} invalid, and {len(orphans)} '
+                             f'orphan files.')
+            report['datasets'][dataset] = {
+                'files': len(names), 'missing': missing, 'invalid': invalid,
+                'orphans': orphans,
+                'seconds': round(time.perf_counter() - start, 3)}
 
             with open(os.path.join(save_path,
                                    f'{os.path.basename(dataset)}_broken.txt'),
@@ -171,6 +541,161 @@ class Encoder(ABC):
                 for index in broken_list:
                     file.write(str(index) + '\n')
 
+        atomic_write(os.path.join(save_path, 'check_report.json'),
+                     json.dumps(report, ensure_ascii=False, indent=2))
+        return report
+
+    def _build_key(self, renderer: str, deck_id: int, deck_name: str,
+                   indexes: list, media: list) -> str:
+        r"""Returns the hash of everything a package is built from."""
+        media_names = [os.path.basename(path)[:-4] for path in media]
+        return hashlib.sha256('\n'.join([
+            renderer, self.template_digest(), str(deck_id), deck_name,
+            str(self.dedupe_media),
+            self.transcoder.variant if self.transcoder is not None else '',
+            self.manifest.digest('metadata', indexes),
+            self.manifest.digest('media', media_names)]).encode('utf-8')).hexdigest()
+
+    def write_band(self, apkg_path: str, deck_id: int, deck_name: str,
+                   indexes: list, media: list, fields: dict) -> tuple:
+        r"""Writes the package of a deck from the rendered fields of its
+            words, like the workers of `build_bands`.
+
+        Args:
+            apkg_path (str): The path to the package.
+            deck_id (int): The ID of the deck.
+            deck_name (str): The name of the deck.
+            indexes (list): The words of the deck, in order.
+            media (list): The paths to the media files of the deck.
+            fields (dict): The rendered fields by word, the words missing or
+                mapped to None being skipped.
+
+        Returns:
+            tuple: The path to the package, its numbers of notes and media
+                files.
+        """
+        return _write_band((apkg_path, deck_id, deck_name, indexes, media), self, fields)
+
+    def _is_up_to_date(self, apkg_path: str, build: str) -> bool:
+        if os.path.isfile(apkg_path) and \
+                self.manifest.get_input(f'output:{apkg_path}') == build:
+            self.logger.info(f'Deck `{apkg_path}` is up to date, skipping...')
+            return True
+        return False
+
+    @staticmethod
+    def get_frequencies(indexes_file: str) -> dict:
+        r"""Reads the frequency of every word of an index file, either a
+            `word\tfreq` text file or a `WordIndex`.
+
+        Args:
+            indexes_file (str): The path to the index file.
+
+        Returns:
+            dict: The frequency by word, in the order of a text file, or most
+                frequent first for a `WordIndex` like its `select`.
+        """
+        if WordIndex.is_index(indexes_file):
+            with WordIndex(indexes_file) as index:
+                return index.frequencies()
+        with open(indexes_file, 'r') as file:
+            lines = [line.strip().split('\t') for line in file]
+
+        return {fields[0]: int(fields[1]) for fields in lines
+                if len(fields) > 1 and fields[1].isdigit()}
+
+    def build_bands(self, deck_id: int, deck_name: str, save_path: str,
+                    indexes_file: str, metadataset_path: str,
+                    mediaset_path: str, bands: list) -> list:
+        r"""Encodes a deck per frequency band, each with the words up to its
+            boundary, like `__call__` with that maximum frequency. The dataset
+            is read and rendered once, and the packages are written on the
+            worker processes.
+
+            The deck of a band has the stable ID `deck_id * 1000000 + bound`
+            and the name `{deck_name}_{bound}`. With a transcoder, the audio
+            of every deck is transcoded to fit its budget.
+
+        Args:
+            deck_id: An integer that represents the ID of the whole deck.
+            deck_name: A string that represents the name of the whole deck.
+            save_path: A string that represents the directory to save the
+                .apkg files.
+            indexes_file: A string that represents the path to the file
+                containing the indexes and their frequencies.
+            metadataset_path: A string that represents the path to the metadata
+                file.
+            mediaset_path: A string that represents the path to the media
+                file(s).
+            bands: A list of maximum word frequencies, one per deck.
+
+        Returns:
+            A list of the paths to the packages.
+        """
+        bands = sorted(set(bands))
+        if bands[-1] >= 1000000:
+            raise ValueError(f'Band boundaries must be below 1000000, got {bands[-1]}!')
+        frequencies = self.get_frequencies(indexes_file)
+        indexes = [index for index, frequency in frequencies.items()
+                   if frequency <= bands[-1]]
+        self.logger.info(f'Reading {len(indexes)} words to be processed from '
+                         f'`{indexes_file}` for {len(bands)} bands.')
+        renderer = self.check_renderer() if self.manifest is not None else None
+
+        plan = self.plan_metadata(indexes, metadataset_path)
+        media, digests = self.find_media(indexes, mediaset_path)
+        media = {os.path.basename(path)[:-4]: path for path in media}
+
+        jobs, builds = list(), dict()
+        for bound in bands:
+            band_id, band_name = deck_id * 1000000 + bound, f'{deck_name}_{bound}'
+            band = [index for index in indexes if frequencies[index] <= bound]
+            band_media = [media[index] for index in band if index in media]
+            if self.transcoder is not None:
+                # the bitrate is picked for the audio of each deck, so that
+                # every deck fits the budget on its own
+                band_media = self.transcoder(band_media, digests=digests)
+            apkg_path = os.path.join(save_path, f'{band_id}_{band_name}.apkg')
+            if self.manifest is not None:
+                builds[apkg_path] = self._build_key(renderer, band_id, band_name,
+                                                    band, band_media)
+                if self._is_up_to_date(apkg_path, builds[apkg_path]):
+                    continue
+            jobs.append((apkg_path, band_id, band_name, band, band_media))
+
+        apkg_paths = [os.path.join(save_path, f'{deck_id * 1000000 + bound}_'
+                                              f'{deck_name}_{bound}.apkg')
+                      for bound in bands]
+        if not jobs:
+            return apkg_paths
+
+        # only the words of the bands to be written are rendered
+        wanted = {index for job in jobs for index in job[3]}
+        plan = [job for job in plan if job[0] in wanted]
+        fields = dict(tqdm(self.iter_rendered(plan), total=len(plan), unit='word'))
+        if self.manifest is not None:
+            self.manifest.commit()
+
+        if self.workers > 1 and len(jobs) > 1:
+            # the rendered fields are handed over once per worker, and shared
+            # without copying when the workers are forked
+            with ProcessPoolExecutor(max_workers=min(self.workers, len(jobs)),
+                                     initializer=_init_worker,
+                                     initargs=(self, fields)) as pool:
+                results = list(pool.map(_write_band, jobs))
+        else:
+            results = [_write_band(job, self, fields) for job in jobs]
+
+        for apkg_path, num_notes, num_media in results:
+            self.logger.info(f'Wrote {num_notes} notes and {num_media} media '
+                             f'files to `{apkg_path}`.')
+            if self.manifest is not None:
+                self.manifest.set_input(f'output:{apkg_path}', builds[apkg_path])
+        if self.manifest is not None:
+            self.manifest.commit()
+
+        return apkg_paths
+
     def __call__(self, deck_id: int, deck_name: str,
                  save_path: str, indexes_file: str,
                  metadataset_path: str, mediaset_path: str = None,
@@ -202,16 +727,31 @@ class Encoder(ABC):
             indexes = self._get_indexes(indexes_file, *args, **kwargs)
             self.logger.info(f'Reading {len(indexes)} words to be processed from '
                              f'`{indexes_file}`.')
+            renderer = self.check_renderer() if self.manifest is not None else None
 
-            metadata = self._get_metadata_list(indexes, metadataset_path)
+            plan = self.plan_metadata(indexes, metadataset_path)
             media = self._get_media_list(indexes, mediaset_path)
 
-            deck = genanki.Deck(deck_id=deck_id, name=deck_name)
-            self._encode_deck(deck, metadata)
-
-            package = genanki.Package(deck_or_decks=deck, media_files=media)
-            package.write_to_file(os.path.join(save_path,
-                                               f'{deck_id}_{deck_name}.apkg'))
+            apkg_path = os.path.join(save_path, f'{deck_id}_{deck_name}.apkg')
+            build = None
+            if self.manifest is not None:
+                build = self._build_key(renderer, deck_id, deck_name, indexes, media)
+                self.manifest.commit()
+                if self._is_up_to_date(apkg_path, build):
+                    return
+
+            # the media are streamed into the package one by one, before the
+            # notes pointing at them, which are rendered while being written
+            with ApkgWriter(apkg_path, deck_id, deck_name, self.template,
+                            dedupe=self.dedupe_media) as writer:
+                self._write_media(writer, media)
+                self._encode_deck(writer, self._iter_metadata(plan), total=len(plan))
+            self.logger.info(f'Wrote {writer.num_notes} notes and {len(writer.media)} '
+                             f'media files to `{apkg_path}`.')
+
+            if build is not None:
+                self.manifest.set_input(f'output:{apkg_path}', build)
+                self.manifest.commit()
 
 
 if __name__ == '__main__':
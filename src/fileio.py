@@ -0,0 +1,37 @@
+import os
+import tempfile
+
+__all__ = ['atomic_write']
+
+
+def atomic_write(file_path: str, data, mode: str = 'w',
+                 durable: bool = False) -> None:
+    r"""Writes a file through a temporary file and a rename, so that readers
+        and crashes only ever see the old or the new content, never a
+        truncated one.
+
+    Args:
+        file_path (str): The path to the file to be written.
+        data (str or bytes): The content of the file.
+        mode (str, optional): 'w' for text or 'wb' for bytes. Defaults: 'w'.
+        durable (bool, optional): Whether to fsync the content before the
+            rename, so that it also survives a power loss. Defaults: False.
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with open(fd, mode, **({} if 'b' in mode else {'encoding': 'utf-8'})) as file:
+            file.write(data)
+            if durable:
+                file.flush()
+                os.fsync(file.fileno())
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+if __name__ == '__main__':
+    pass
@@ -1,10 +1,20 @@
+import asyncio
+import itertools
 import logging
 import os
 from abc import ABC, abstractmethod
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from tqdm import tqdm
 
+from .chatgpt import ChatGPT
+from .fileio import atomic_write
+from .journal import Journal
+from .media import MediaDownloader
+from .metadata_store import MetadataStore
+from .parsers import PARSERS
+from .pipeline import Pipeline
+
 __all__ = ['Generator']
 
 
@@ -21,13 +31,29 @@ class Generator(ABC):
             data.
         logger (logging.Logger): A logger object used to print progress and
             other messages.
-        overwrite (bool, optional): Whether to overwrite previously generated
-            files. Defaults to False.
+        overwrite (bool or str, optional): Whether to overwrite previously
+            generated files, either all of them (True or 'all'), only the
+            failed ones ('failed'), or the failed and stale ones ('stale').
+            Defaults to False.
+        stale_after (float, optional): The age in seconds after which a
+            generated file is stale. Defaults to None.
+        media (MediaDownloader, optional): A downloader filling the media
+            directory with the pronunciations of the generated words once their
+            metadata is written. Defaults to None.
+        store (MetadataStore, optional): A store the metadata is written to
+            instead of one file per word in the metadata directory. Defaults
+            to None.
+        chatgpt (ChatGPT, optional): A client answering the generated words in
+            batched requests once their metadata is written, one file per word
+            in the completions directory. Defaults to None.
     """
 
     def __init__(self, save_path: str, divider: str,
                  functions, logger: logging.Logger,
-                 overwrite: bool = False) -> None:
+                 overwrite=False, stale_after: float = None,
+                 media: MediaDownloader = None,
+                 store: MetadataStore = None,
+                 chatgpt: ChatGPT = None) -> None:
         # Create the output directory if it does not exist
         if not os.path.exists(save_path):
             os.mkdir(save_path)
@@ -37,11 +63,26 @@ class Generator(ABC):
         self.media_path = os.path.join(save_path, 'media')
         if not os.path.exists(self.media_path):
             os.mkdir(self.media_path)
+        self.completions_path = os.path.join(save_path, 'completions')
+        if chatgpt is not None and not os.path.exists(self.completions_path):
+            os.mkdir(self.completions_path)
 
         self.divider = divider
         self.functions = functions
         self.logger = logger
         self.overwrite = overwrite
+        self.stale_after = stale_after
+        self.media = media
+        self.store = store
+        self.chatgpt = chatgpt
+
+        self.failures_file = os.path.join(save_path, 'failures.tsv')
+        self.failures = dict()
+        self.journal = Journal(os.path.join(save_path, 'journal.tsv'),
+                               logger=logger)
+        if not self.journal.exists:
+            self.journal.bootstrap(self.metadata_path,
+                                   stamps=store.stamps() if store is not None else None)
 
     def _get_indexes(self, indexes_file: str) -> list:
         r"""Reads the input indexes from a file.
@@ -55,14 +96,105 @@ class Generator(ABC):
         """
         with open(indexes_file, 'r') as file:
             indexes = [line.strip().split('\t')[0] for line in file
-                       if self.overwrite or
-                       not os.path.isfile(os.path.join(self.metadata_path,
-                                                       line.strip().split('\\t')[0] + '.txt'))]
+                       if line.strip()]
+        indexes = self.journal.select(indexes, overwrite=self.overwrite,
+                                      stale_after=self.stale_after)
         self.logger.info(f'Reading `{len(indexes)}` words to be processed from '
                          f'`{indexes_file}`.')
 
         return indexes
 
+    def _save_metadata(self, index: str, metadata_list: tuple) -> None:
+        r"""Writes the metadata slices of an index to the metadata directory.
+
+        Args:
+            index (str): The input index that has been processed.
+            metadata_list (tuple): The metadata slices returned by `functions`,
+                or None if the index could not be processed.
+        """
+        if metadata_list is None:
+            self._record_failure(index, 'generate')
+            return
+
+        self._write_metadata(metadata_list)
+        self.journal.record(index, Journal.DONE)
+
+    def _record_failure(self, index: str, stage: str,
+                        error: Exception = None, journal: bool = True) -> None:
+        r"""Logs a failed index and keeps it for the failure ledger.
+
+        Args:
+            index (str): The input index that failed.
+            stage (str): The stage that failed, e.g. 'fetch' or 'parse'.
+            error (Exception, optional): The raised exception, or None if the
+                stage returned no result.
+            journal (bool, optional): Whether to record the failure in the
+                journal right away. Defaults to True.
+        """
+        if error is None:
+            self.logger.error(f'No metadata generated for `{index}` at stage '
+                              f'`{stage}`, skipping...')
+        else:
+            self.logger.error(f'Error generating metadata for `{index}` at '
+                              f'stage `{stage}`: {error!r}')
+        self.failures[index] = (stage, type(error).__name__
+                                if error is not None else 'NoResult')
+        if journal:
+            self.journal.record(index, Journal.FAILED)
+
+    def _write_failures(self) -> None:
+        r"""Writes the ledger of the indexes still failed after this run as
+            `index\tstage\terror\tattempts` lines, so that it can be fed back
+            as the index file of the next run."""
+        lines = list()
+        for index, (stage, error) in self.failures.items():
+            status, attempts, _ = self.journal.entries[index]
+            if status == Journal.FAILED:
+                lines.append(f'{index}\t{stage}\t{error}\t{attempts}\n')
+        self.failures.clear()
+
+        if lines:
+            atomic_write(self.failures_file, ''.join(lines))
+            self.logger.info(f'Recorded `{len(lines)}` failed words in '
+                             f'`{self.failures_file}`, pass it as the index '
+                             f'file to retry them.')
+        elif os.path.isfile(self.failures_file):
+            os.remove(self.failures_file)
+
+    def _write_metadata(self, metadata_list: tuple) -> None:
+        metadata = self.divider.join(metadata_list)
+        if self.store is not None:
+            self.store.put(metadata_list[1], metadata_list[0], metadata)
+        else:
+            atomic_write(os.path.join(self.metadata_path, f'{metadata_list[1]}.txt'),
+                         metadata)
+
+    def _save_batch(self, results: list) -> None:
+        r"""Writes a batch of results of the pipeline executor and journals
+            them at once.
+
+        Args:
+            results (list): A list of `(index, metadata_list, stage, error)`
+                tuples, where metadata_list is None if the index failed.
+        """
+        outcomes, rows = list(), list()
+        for index, metadata_list, stage, error in results:
+            if metadata_list is None:
+                self._record_failure(index, stage or 'parse', error,
+                                     journal=False)
+                outcomes.append((index, Journal.FAILED))
+                continue
+
+            if self.store is not None:
+                rows.append((metadata_list[1], metadata_list[0],
+                             self.divider.join(metadata_list)))
+            else:
+                self._write_metadata(metadata_list)
+            outcomes.append((index, Journal.DONE))
+        if rows:
+            self.store.put_many(rows)
+        self.journal.record_many(outcomes)
+
     @abstractmethod
     def _get_metadata(self, index: str) -> None:
         r"""Abstract method to be implemented by subclasses.
@@ -72,7 +204,165 @@ class Generator(ABC):
         """
         pass
 
-    def __call__(self, indexes_file: str, num_threads: int = 4) -> None:
+    async def _get_metadata_async(self, index: str) -> None:
+        r"""Processes an index with a coroutine `functions`, e.g. an
+            `AsyncCrawler`.
+
+        Args:
+            index (str): The input index to be processed.
+        """
+        self._save_metadata(index, await self.functions(index))
+
+    async def _run_async(self, indexes: list, concurrency: int) -> None:
+        r"""Processes the input indexes on a single event loop, keeping at most
+            `concurrency` indexes in flight.
+
+        Args:
+            indexes (list): A list of input indexes to be processed.
+            concurrency (int): The number of in-flight indexes.
+        """
+        iterator = iter(indexes)
+
+        async def worker(pbar: tqdm) -> None:
+            for index in iterator:
+                try:
+                    await self._get_metadata_async(index)
+                except Exception as e:
+                    self._record_failure(index, 'generate', e)
+                pbar.update(1)
+
+        async with self.functions:
+            with tqdm(total=len(indexes), unit='word') as pbar:
+                await asyncio.gather(*[worker(pbar)
+                                       for _ in range(concurrency)])
+
+    def _run_pipeline(self, indexes: list, **kwargs) -> None:
+        r"""Processes the input indexes as a fetch -> parse -> write pipeline.
+            Requires `functions` to be a `Crawler`, whose pages are fetched on
+            threads and parsed on a process pool with its parser backend.
+
+        Args:
+            indexes (list): A list of input indexes to be processed.
+            **kwargs: The stage settings of `Pipeline`, i.e. fetch_workers,
+                parse_workers, queue_size and write_batch.
+        """
+        pipeline = Pipeline(fetch=self.functions._fetch_html,
+                            parse=PARSERS[self.functions.parser],
+                            write=self._save_batch,
+                            logger=self.logger, **kwargs)
+        pipeline(indexes)
+
+    def _get_names(self) -> list:
+        r"""Returns the names of the metadata of every generated word."""
+        if self.store is not None:
+            return self.store.names()
+        return [entry.name[:-4] for entry in os.scandir(self.metadata_path)
+                if entry.name.endswith('.txt')]
+
+    def _download_media(self) -> None:
+        r"""Downloads the media of every generated word, named after its
+            metadata file like `Encoder` expects."""
+        self.media(self._get_names(), self.media_path)
+
+    def _save_completions(self, names: list) -> int:
+        r"""Asks for the completions of some words in batched requests and
+            writes the answered ones.
+
+        Args:
+            names (list): The names of the words.
+
+        Returns:
+            int: The number of words left unanswered.
+        """
+        failures = 0
+        for name, completion in self.chatgpt.generate_batch(names).items():
+            if completion is None:
+                failures += 1
+            else:
+                atomic_write(os.path.join(self.completions_path, f'{name}.txt'),
+                             completion)
+        return failures
+
+    def _generate_completions(self, num_threads: int, window: int) -> None:
+        r"""Answers every generated word without a completion file with
+            `chatgpt`, sending the words of a chunk in batched requests and
+            keeping at most `window` chunks per thread in flight.
+
+        Args:
+            num_threads (int): The number of threads.
+            window (int): The number of in-flight chunks per thread.
+        """
+        names = [name for name in self._get_names() if not os.path.isfile(
+            os.path.join(self.completions_path, f'{name}.txt'))]
+        self.logger.info(f'Asking for the completions of `{len(names)}` words.')
+
+        def iter_chunks():
+            # a chunk is as large as the next batch, so that no request is
+            # left half full
+            start = 0
+            while start < len(names):
+                size = self.chatgpt.get_batch_size()
+                yield names[start:start + size]
+                start += size
+
+        chunks = iter_chunks()
+        failures = 0
+        with ThreadPoolExecutor(max_workers=num_threads) as pool, \
+                tqdm(total=len(names), unit='word') as pbar:
+            pending = {pool.submit(self._save_completions, chunk): chunk
+                       for chunk in itertools.islice(chunks, window * num_threads)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = pending.pop(future)
+                    if future.exception() is not None:
+                        self.logger.error(f'Error saving the completions of '
+                                          f'`{len(chunk)}` words: '
+                                          f'{future.exception()!r}')
+                        failures += len(chunk)
+                    else:
+                        failures += future.result()
+                    pbar.update(len(chunk))
+
+                for chunk in itertools.islice(chunks, len(done)):
+                    pending[pool.submit(self._save_completions, chunk)] = chunk
+
+        if failures:
+            self.logger.error(f'No completion for `{failures}` words, run again '
+                              f'to retry them.')
+
+    def _run_threads(self, indexes: list, num_threads: int,
+                     window: int) -> None:
+        r"""Processes the input indexes on a thread pool, keeping at most
+            `window` tasks per thread in flight so that memory stays flat
+            however long the index file is.
+
+        Args:
+            indexes (list): A list of input indexes to be processed.
+            num_threads (int): The number of threads.
+            window (int): The number of in-flight tasks per thread.
+        """
+        iterator = iter(indexes)
+        with ThreadPoolExecutor(max_workers=num_threads) as pool, \
+                tqdm(total=len(indexes), unit='word') as pbar:
+            pending = {pool.submit(self._get_metadata, index): index
+                       for index in itertools.islice(iterator,
+                                                     window * num_threads)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    if future.exception() is not None:
+                        self._record_failure(index, 'generate',
+                                             future.exception())
+                    pbar.update(1)
+
+                for index in itertools.islice(iterator, len(done)):
+                    pending[pool.submit(self._get_metadata, index)] = index
+
+    def __call__(self, indexes_file: str, num_threads: int = 4,
+                 executor: str = 'thread', concurrency: int = 256,
+                 window: int = 4, **kwargs) -> None:
         r"""Calls the generator to process the input indexes.
 
         Args:
@@ -80,15 +370,36 @@ class Generator(ABC):
                 indexes.
             num_threads (int): The number of threads to use for processing.
                 Default is 4.
+            executor (str): The executor to use, either 'thread' for a thread
+                pool, 'async' for a single event loop or 'pipeline' for staged
+                fetching, parsing and writing. The 'async' executor requires
+                `functions` to be an async context manager with an
+                `async __call__`, e.g. an `AsyncCrawler`, and the 'pipeline'
+                executor requires a `Crawler`. Default is 'thread'.
+            concurrency (int): The number of in-flight indexes of the 'async'
+                executor. Default is 256.
+            window (int): The number of in-flight indexes per thread of the
+                'thread' executor. Default is 4.
+            **kwargs: The stage settings of the 'pipeline' executor, see
+                `Pipeline`. Its fetch_workers default to `num_threads`.
         """
         indexes = self._get_indexes(indexes_file)
 
-        with ThreadPoolExecutor(max_workers=num_threads) as executor:
-            futures = [executor.submit(self._get_metadata, index)
-                       for index in indexes]
-            with tqdm(total=len(indexes), unit='word') as pbar:
-                for _ in as_completed(futures):
-                    pbar.update(1)
+        if executor == 'async':
+            asyncio.run(self._run_async(indexes, concurrency))
+        elif executor == 'pipeline':
+            kwargs.setdefault('fetch_workers', num_threads)
+            self._run_pipeline(indexes, **kwargs)
+        else:
+            self._run_threads(indexes, num_threads, window)
+
+        self.journal.sync()
+        self._write_failures()
+
+        if self.media is not None:
+            self._download_media()
+        if self.chatgpt is not None:
+            self._generate_completions(num_threads, window)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+
+from .fileio import atomic_write
+
+__all__ = ['Journal']
+
+
+class Journal:
+    r"""An append-only journal of the processed indexes. Every line records
+        the latest outcome of an index as `index\tstatus\tattempts\ttimestamp`,
+        where status is either 'done' or 'failed', so resuming a run only costs
+        one sequential read of the journal.
+
+    Args:
+        journal_file (str): The path to the journal file.
+        logger (logging.Logger, optional): A logger object used to print
+            messages.
+    """
+
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, journal_file: str, logger=None) -> None:
+        self.journal_file = journal_file
+        self.logger = logger
+
+        self.lock = threading.Lock()
+        self.entries = dict()
+        self.file = None
+        self.exists = os.path.isfile(journal_file)
+        if self.exists:
+            self._load()
+        self.file = open(journal_file, 'a', encoding='utf-8')
+
+    def _load(self) -> None:
+        r"""Folds the journal into the latest entry of every index. A line
+            truncated by a crash is ignored."""
+        lines = 0
+        with open(self.journal_file, 'r', encoding='utf-8') as file:
+            for line in file:
+                fields = line.rstrip('\n').split('\t')
+                if not line.endswith('\n') or len(fields) != 4 or \
+                        fields[1] not in (self.DONE, self.FAILED):
+                    continue
+                index, status, attempts, timestamp = fields
+                self.entries[index] = (status, int(attempts), float(timestamp))
+                lines += 1
+
+        # drop the superseded lines once they outnumber the live ones
+        if lines > 2 * len(self.entries) + 1024:
+            self.compact()
+
+    def record(self, index: str, status: str, timestamp: float = None) -> None:
+        r"""Appends the outcome of an index to the journal.
+
+        Args:
+            index (str): The processed index.
+            status (str): Either `Journal.DONE` or `Journal.FAILED`.
+            timestamp (float, optional): The time of the outcome. Defaults to
+                now.
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            attempts = self.entries[index][1] + 1 if index in self.entries else 1
+            self.entries[index] = (status, attempts, timestamp)
+            self.file.write(f'{index}\t{status}\t{attempts}\t{timestamp:.3f}\n')
+            self.file.flush()
+
+    def record_many(self, outcomes: list) -> None:
+        r"""Appends the outcomes of many indexes with a single flush.
+
+        Args:
+            outcomes (list): A list of `(index, status)` tuples.
+        """
+        timestamp = time.time()
+        with self.lock:
+            lines = list()
+            for index, status in outcomes:
+                attempts = self.entries[index][1] + 1 if index in self.entries else 1
+                self.entries[index] = (status, attempts, timestamp)
+                lines.append(f'{index}\t{status}\t{attempts}\t{timestamp:.3f}\n')
+            self.file.write(''.join(lines))
+            self.file.flush()
+
+    def bootstrap(self, metadata_path: str, stamps: dict = None) -> None:
+        r"""Seeds a new journal from the files of a previous run, listing the
+            metadata directory once instead of probing each index.
+
+        Args:
+            metadata_path (str): The path to the metadata directory.
+            stamps (dict, optional): A mapping from generated word to its
+                update time, e.g. from a `MetadataStore`, used instead of the
+                metadata directory.
+        """
+        with self.lock:
+            if stamps is not None:
+                for name, timestamp in stamps.items():
+                    self.entries[name] = (self.DONE, 1, timestamp)
+            else:
+                for entry in os.scandir(metadata_path):
+                    if not entry.name.endswith('.txt'):
+                        continue
+                    stat = entry.stat()
+                    if stat.st_size > 0:
+                        self.entries[entry.name[:-4]] = (self.DONE, 1, stat.st_mtime)
+        self.compact()
+        if self.logger is not None:
+            self.logger.info(f'Bootstrapped journal `{self.journal_file}` with '
+                             f'{len(self.entries)} generated words.')
+
+    def select(self, indexes: list, overwrite=False,
+               stale_after: float = None) -> list:
+        r"""Selects the indexes to be processed.
+
+        Args:
+            indexes (list): All the input indexes.
+            overwrite (bool or str, optional): False to process the indexes not
+                done yet, True or 'all' to process every index, 'failed' to
+                only retry the failed ones, 'stale' to retry the failed ones and
+                redo the ones done more than `stale_after` seconds ago.
+                Defaults: False.
+            stale_after (float, optional): The age in seconds after which a
+                done index is stale.
+
+        Returns:
+            list: The indexes to be processed.
+        """
+        if overwrite is True or overwrite == 'all':
+            return list(indexes)
+
+        entries = self.entries
+        if not overwrite:
+            return [index for index in indexes
+                    if entries.get(index, ('',))[0] != self.DONE]
+        elif overwrite == 'failed':
+            return [index for index in indexes
+                    if entries.get(index, ('',))[0] == self.FAILED]
+        elif overwrite == 'stale':
+            if stale_after is None:
+                raise ValueError('`stale_after` is required to select stale indexes')
+            deadline = time.time() - stale_after
+            return [index for index in indexes if index in entries and
+                    (entries[index][0] == self.FAILED or entries[index][2] < deadline)]
+        else:
+            raise ValueError(f'Unknown overwrite mode `{overwrite}`')
+
+    def compact(self) -> None:
+        r"""Atomically rewrites the journal with one line per index."""
+        lines = ''.join(f'{index}\t{status}\t{attempts}\t{timestamp:.3f}\n'
+                        for index, (status, attempts, timestamp)
+                        in self.entries.items())
+        reopen = self.file is not None
+        if reopen:
+            self.file.close()
+        atomic_write(self.journal_file, lines, durable=True)
+        if reopen:
+            self.file = open(self.journal_file, 'a', encoding='utf-8')
+
+    def sync(self) -> None:
+        r"""Flushes the journal to disk."""
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        self.sync()
+        self.file.close()
+
+
+if __name__ == '__main__':
+    pass
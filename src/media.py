@@ -0,0 +1,361 @@
+import hashlib
+import itertools
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+from .fileio import atomic_write
+from .scheduler import Scheduler
+
+__all__ = ['MediaDownloader', 'is_mp3', 'mp3_duration', 'mp3_error']
+
+# MPEG audio versions, layers, bitrates and sample rates with a reserved or
+# invalid value in the frame header
+_BAD_VERSION, _BAD_LAYER, _BAD_BITRATE, _BAD_SAMPLE_RATE = 1, 0, 15, 3
+
+
+# the bitrates in kbps of MPEG-1 and MPEG-2/2.5 layer III by bitrate index
+_LAYER3_BITRATES = {
+    3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_LAYER3_BITRATES[0] = _LAYER3_BITRATES[2]
+# the sample rates of MPEG-1, MPEG-2 and MPEG-2.5 by sample rate index
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000),
+                 0: (11025, 12000, 8000)}
+
+
+def _read_frame_header(file_path: str) -> tuple:
+    r"""Returns the offset and the 4 bytes of the first frame header of a
+        file, after an optional ID3v2 tag."""
+    offset = 0
+    with open(file_path, 'rb') as file:
+        head = file.read(10)
+        if len(head) == 10 and head[:3] == b'ID3':
+            # the tag size is a 28 bits syncsafe integer, plus an optional footer
+            size = (head[6] & 0x7f) << 21 | (head[7] & 0x7f) << 14 | \
+                (head[8] & 0x7f) << 7 | head[9] & 0x7f
+            offset = 10 + size + (10 if head[5] & 0x10 else 0)
+            file.seek(offset)
+            head = file.read(4)
+
+    return offset, head[:4]
+
+
+def is_mp3(file_path: str) -> bool:
+    r"""Tells whether a file starts with a valid MPEG audio frame header,
+        after an optional ID3v2 tag.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        bool: Whether the file looks like an mp3.
+    """
+    _, head = _read_frame_header(file_path)
+    if len(head) < 4 or head[0] != 0xff or head[1] & 0xe0 != 0xe0:
+        return False
+    return (head[1] >> 3) & 0x3 != _BAD_VERSION and \
+        (head[1] >> 1) & 0x3 != _BAD_LAYER and \
+        head[2] >> 4 != _BAD_BITRATE and \
+        (head[2] >> 2) & 0x3 != _BAD_SAMPLE_RATE
+
+
+def mp3_duration(file_path: str) -> float:
+    r"""Estimates the duration of a layer III mp3 from the bitrate of its
+        first frame, as if it were constant.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        float: The duration in seconds, or None if the file is not a layer
+            III mp3.
+    """
+    if not is_mp3(file_path):
+        return None
+    offset, head = _read_frame_header(file_path)
+    version, layer = (head[1] >> 3) & 0x3, (head[1] >> 1) & 0x3
+    bitrate = _LAYER3_BITRATES[version][head[2] >> 4] if layer == 1 else 0
+    if not bitrate:
+        return None
+    return (os.path.getsize(file_path) - offset) * 8 / (bitrate * 1000)
+
+
+def mp3_error(file_path: str) -> str:
+    r"""Walks the frames of a layer III mp3 to find what is wrong with it.
+        Trailing data that is not a frame, like an ID3v1 tag, is allowed.
+
+    Args:
+        file_path (str): The path to the file.
+
+    Returns:
+        str: None if the file is fine, else the problem.
+    """
+    if not is_mp3(file_path):
+        return 'no frame sync'
+    offset, _ = _read_frame_header(file_path)
+    with open(file_path, 'rb') as file:
+        data = file.read()
+
+    frames = 0
+    while offset + 4 <= len(data):
+        head = data[offset:offset + 4]
+        if head[0] != 0xff or head[1] & 0xe0 != 0xe0:
+            break
+        version, layer = (head[1] >> 3) & 0x3, (head[1] >> 1) & 0x3
+        bitrate_index, sample_rate_index = head[2] >> 4, (head[2] >> 2) & 0x3
+        if layer != 1 or version == _BAD_VERSION or bitrate_index in (0, _BAD_BITRATE) \
+                or sample_rate_index == _BAD_SAMPLE_RATE:
+            break
+        bitrate = _LAYER3_BITRATES[version][bitrate_index] * 1000
+        sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+        # MPEG-1 frames hold 1152 samples, MPEG-2 and 2.5 ones 576
+        size = (144 if version == 3 else 72) * bitrate // sample_rate + \
+            ((head[2] >> 1) & 0x1)
+        if offset + size > len(data):
+            return 'truncated'
+        offset += size
+        frames += 1
+
+    return None if frames else 'no frames'
+
+
+def _file_digest(file_path: str, chunk_size: int = 1 << 16) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaDownloader:
+    r"""Downloads the pronunciations of words over a pooled keep-alive
+        session. Interrupted downloads are resumed from their `.part` file,
+        and files recorded in the manifest of the media directory with the
+        same size and checksum are skipped. A file whose size and mtime are
+        unchanged since it was recorded is not hashed again.
+
+    Args:
+        logger (logging.Logger): A logger to record the downloader's activity.
+        base_url (str, optional): The URL prefix of the audio files.
+            Defaults: 'https://api.openrussian.org/read/ru'.
+        num_workers (int, optional): The number of concurrent downloads, which
+            is also the size of the connection pool. Defaults: 16.
+        max_retries (int, optional): The maximum number of retries for
+            downloading a file. Defaults: 5.
+        timeout (float, optional): The connect and read timeout in seconds.
+            Defaults: 30.
+        verify (bool, optional): Whether to check the checksum of existing
+            files, not only their size. Defaults: True.
+        scheduler (Scheduler, optional): The scheduler pacing the requests and
+            the retries of all workers. Defaults: an unlimited `Scheduler`.
+        window (int, optional): The number of in-flight downloads per worker,
+            so that memory stays flat however many files are missing.
+            Defaults: 4.
+    """
+
+    MANIFEST = 'manifest.tsv'
+
+    def __init__(self, logger: logging.Logger,
+                 base_url: str = 'https://api.openrussian.org/read/ru',
+                 num_workers: int = 16, max_retries: int = 5,
+                 timeout: float = 30, verify: bool = True,
+                 scheduler: Scheduler = None, window: int = 4) -> None:
+
+        self.logger = logger
+        self.base_url = base_url.rstrip('/')
+        self.num_workers = num_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.verify = verify
+        self.scheduler = scheduler if scheduler is not None else Scheduler()
+        self.window = window
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=num_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _get_url(self, name: str) -> str:
+        return quote(f'{self.base_url}/{name}', safe=':/?&=')
+
+    @classmethod
+    def _load_manifest(cls, media_path: str) -> dict:
+        r"""Reads the `name\tsize\tmtime_ns\tsha256\tlatency` lines of the
+            manifest, the latest line of a name winning. The lines of older
+            runs, without the mtime, are read with an unknown one."""
+        manifest = dict()
+        manifest_file = os.path.join(media_path, cls.MANIFEST)
+        if not os.path.isfile(manifest_file):
+            return manifest
+
+        with open(manifest_file, 'r', encoding='utf-8') as file:
+            for line in file:
+                fields = line.rstrip('\n').split('\t')
+                if not line.endswith('\n') or len(fields) not in (4, 5):
+                    continue
+                if len(fields) == 4:
+                    fields.insert(2, None)
+                name, size, mtime_ns, digest, latency = fields
+                manifest[name] = (int(size), int(mtime_ns) if mtime_ns else None,
+                                  digest, float(latency))
+        return manifest
+
+    def _is_complete(self, name: str, media_path: str, manifest: dict) -> bool:
+        r"""Tells whether a file is already downloaded. An existing file
+            missing from the manifest, e.g. from an older run, is adopted if it
+            is a valid mp3. Like `BuildManifest.stat_digest`, a recorded file
+            is hashed only if its mtime changed, and recorded again with its
+            new mtime if its checksum still matches."""
+        file_path = os.path.join(media_path, f'{name}.mp3')
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+
+        if name in manifest:
+            size, mtime_ns, digest, latency = manifest[name]
+            if size != stat.st_size:
+                return False
+            if not self.verify or mtime_ns == stat.st_mtime_ns:
+                return True
+            if _file_digest(file_path) != digest:
+                return False
+            manifest[name] = (size, stat.st_mtime_ns, digest, latency)
+            return True
+
+        if stat.st_size > 0 and is_mp3(file_path):
+            manifest[name] = (stat.st_size, stat.st_mtime_ns, _file_digest(file_path), 0.)
+            return True
+        return False
+
+    def _download(self, name: str, media_path: str) -> tuple:
+        r"""Downloads the pronunciation of a word, resuming its partial file.
+
+        Args:
+            name (str): The accented word.
+            media_path (str): The media directory.
+
+        Returns:
+            tuple: The size, the mtime in nanoseconds, the sha256 and the
+                latency in seconds of the file, or None if it cannot be
+                downloaded.
+        """
+        url = self._get_url(name)
+        file_path = os.path.join(media_path, f'{name}.mp3')
+        part_path = f'{file_path}.part'
+
+        for i in range(self.max_retries):
+            try:
+                offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+                headers = {'Range': f'bytes={offset}-'} if offset else None
+                with self.scheduler.slot():
+                    started_at = time.perf_counter()
+                    with self.session.get(url, headers=headers, stream=True,
+                                          timeout=self.timeout) as response:
+                        if response.status_code == 416:
+                            # the partial file is stale, start over
+                            os.remove(part_path)
+                        response.raise_for_status()
+                        # a server ignoring the range sends the whole file
+                        mode = 'ab' if response.status_code == 206 else 'wb'
+                        with open(part_path, mode) as file:
+                            for chunk in response.iter_content(1 << 16):
+                                file.write(chunk)
+                    latency = time.perf_counter() - started_at
+
+                if not is_mp3(part_path):
+                    os.remove(part_path)
+                    raise ValueError('Downloaded file is not an mp3')
+                size, digest = os.path.getsize(part_path), _file_digest(part_path)
+                os.replace(part_path, file_path)
+                return size, os.stat(file_path).st_mtime_ns, digest, latency
+
+            except Exception as e:
+                self.logger.error(f"Error downloading media for `{name}`"
+                                  f"({i + 1}/{self.max_retries}): {e}")
+                if Scheduler.get_status(e) == 404:
+                    break
+                if i + 1 < self.max_retries:
+                    self.scheduler.backoff(i, e)
+
+        return None  # noqa
+
+    def __call__(self, names: list, media_path: str) -> dict:
+        r"""Downloads the pronunciations of words into a media directory.
+
+        Args:
+            names (list): The accented words, which are also the names of the
+                metadata files.
+            media_path (str): The media directory.
+
+        Returns:
+            dict: The numbers of downloaded, skipped and failed files, and the
+                latency percentiles of the downloads in seconds.
+        """
+        manifest = self._load_manifest(media_path)
+        todo = [name for name in names
+                if not self._is_complete(name, media_path, manifest)]
+        self.logger.info(f'Downloading `{len(todo)}` media files, skipping '
+                         f'`{len(names) - len(todo)}` downloaded ones.')
+
+        latencies, failures = list(), 0
+        manifest_file = os.path.join(media_path, self.MANIFEST)
+        with open(manifest_file, 'a', encoding='utf-8') as file, \
+                ThreadPoolExecutor(max_workers=self.num_workers) as pool:
+            iterator = iter(todo)
+            pending = {pool.submit(self._download, name, media_path): name
+                       for name in itertools.islice(iterator,
+                                                    self.window * self.num_workers)}
+            with tqdm(total=len(todo), unit='file') as pbar:
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name, result = pending.pop(future), None
+                        if future.exception() is not None:
+                            self.logger.error(f'Error downloading media for '
+                                              f'`{name}`: {future.exception()!r}')
+                        else:
+                            result = future.result()
+
+                        if result is None:
+                            failures += 1
+                        else:
+                            size, mtime_ns, digest, latency = result
+                            manifest[name] = result
+                            latencies.append(latency)
+                            file.write(f'{name}\t{size}\t{mtime_ns}\t{digest}\t'
+                                       f'{latency:.4f}\n')
+                            file.flush()
+                        pbar.update(1)
+
+                    for name in itertools.islice(iterator, len(done)):
+                        pending[pool.submit(self._download, name, media_path)] = name
+
+        # rewrite the manifest with one line per file
+        atomic_write(manifest_file, ''.join(
+            f'{name}\t{size}\t{mtime_ns if mtime_ns is not None else ""}\t'
+            f'{digest}\t{latency:.4f}\n'
+            for name, (size, mtime_ns, digest, latency) in manifest.items()))
+
+        latencies.sort()
+        stats = {'downloaded': len(latencies), 'failed': failures,
+                 'skipped': len(names) - len(todo)}
+        for q in (50, 95, 99):
+            stats[f'latency_p{q}'] = round(latencies[min(
+                len(latencies) - 1, len(latencies) * q // 100)], 4) \
+                if latencies else None
+        self.logger.info(f'Media: {stats}.')
+
+        return stats
+
+
+if __name__ == '__main__':
+    pass
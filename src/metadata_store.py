@@ -0,0 +1,199 @@
+import os
+import sqlite3
+import threading
+import time
+
+from tqdm import tqdm
+
+from .fileio import atomic_write
+
+__all__ = ['MetadataStore']
+
+
+class MetadataStore:
+    r"""A single-file metadata dataset replacing a directory of `.txt` files.
+        Every row holds the divider-joined slices of a word, keyed by its
+        accented name like the files were, so reading the whole dataset is one
+        sequential scan instead of an open per word. It is stored in WAL-mode
+        SQLite with one connection per thread, so it is safe under the thread
+        pool of `Generator`.
+
+    Args:
+        store_file (str): The path to the SQLite database.
+    """
+
+    def __init__(self, store_file: str) -> None:
+        self.store_file = store_file
+        self.local = threading.local()
+
+        conn = self._get_conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS metadata ('
+                     'name TEXT PRIMARY KEY, word TEXT NOT NULL, '
+                     'content TEXT NOT NULL, updated_at REAL NOT NULL)')
+        conn.commit()
+
+    @staticmethod
+    def is_store(path: str) -> bool:
+        r"""Tells whether a metadataset path is an existing store rather than
+            a directory. A missing path is not a store, so that a mistyped one
+            is not created empty and read as a dataset without words."""
+        if not os.path.isfile(path):
+            return False
+        with open(path, 'rb') as file:
+            return file.read(16) == b'SQLite format 3\0'
+
+    def _get_conn(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.store_file, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn = conn
+        return conn
+
+    def put(self, name: str, word: str, content: str) -> None:
+        r"""Stores the metadata of a word.
+
+        Args:
+            name (str): The accented word, i.e. the name of its metadata file.
+            word (str): The bare word, i.e. its index.
+            content (str): The divider-joined metadata slices.
+        """
+        self.put_many([(name, word, content)])
+
+    def put_many(self, items: list) -> None:
+        r"""Stores the metadata of many words in one transaction.
+
+        Args:
+            items (list): A list of `(name, word, content)` tuples.
+        """
+        now = time.time()
+        conn = self._get_conn()
+        conn.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)',
+                         [(name, word, content, now)
+                          for name, word, content in items])
+        conn.commit()
+
+    def get(self, name: str) -> str:
+        r"""Looks up the metadata of a word.
+
+        Returns:
+            str: The divider-joined metadata slices, or None.
+        """
+        row = self._get_conn().execute(
+            'SELECT content FROM metadata WHERE name = ?', (name,)).fetchone()
+        return row[0] if row is not None else None
+
+    def get_many(self, names: list = None) -> dict:
+        r"""Reads the metadata of many words with a single scan.
+
+        Args:
+            names (list, optional): The accented words to read. Defaults to all
+                of them.
+
+        Returns:
+            dict: A mapping from accented word to its metadata, leaving out the
+                missing words.
+        """
+        wanted = set(names) if names is not None else None
+        cursor = self._get_conn().execute('SELECT name, content FROM metadata')
+        return {name: content for name, content in cursor
+                if wanted is None or name in wanted}
+
+    def stamps(self) -> dict:
+        r"""Returns a mapping from accented word to its last update time."""
+        return dict(self._get_conn().execute(
+            'SELECT name, updated_at FROM metadata'))
+
+    def names(self) -> list:
+        return [name for name, in self._get_conn().execute(
+            'SELECT name FROM metadata')]
+
+    def __len__(self) -> int:
+        return self._get_conn().execute('SELECT COUNT(*) FROM metadata').fetchone()[0]
+
+    def __contains__(self, name: str) -> bool:
+        return self._get_conn().execute(
+            'SELECT 1 FROM metadata WHERE name = ?', (name,)).fetchone() is not None
+
+    def import_dir(self, metadataset_path: str, divider: str = '++++++++++',
+                   batch_size: int = 1024) -> int:
+        r"""Imports a directory of `.txt` metadata files.
+
+        Args:
+            metadataset_path (str): A path to a directory containing metadata
+                files.
+            divider (str): The string separating the slices, whose first one
+                is the bare word.
+            batch_size (int, optional): The number of files per transaction.
+                Defaults: 1024.
+
+        Returns:
+            int: The number of imported files.
+        """
+        entries = [entry for entry in os.scandir(metadataset_path)
+                   if entry.name.endswith('.txt')]
+        batch = list()
+        for entry in tqdm(entries, unit='file'):
+            with open(entry.path, 'r', encoding='utf-8') as file:
+                content = file.read()
+            batch.append((entry.name[:-4], content.split(divider, 1)[0].strip(),
+                          content))
+            if len(batch) >= batch_size:
+                self.put_many(batch)
+                batch = list()
+        if batch:
+            self.put_many(batch)
+
+        return len(entries)
+
+    def export_dir(self, metadataset_path: str) -> int:
+        r"""Exports the store to a directory of `.txt` metadata files.
+
+        Args:
+            metadataset_path (str): The directory to write the files to.
+
+        Returns:
+            int: The number of exported files.
+        """
+        os.makedirs(metadataset_path, exist_ok=True)
+        metadata = self.get_many()
+        for name, content in tqdm(metadata.items(), unit='file'):
+            atomic_write(os.path.join(metadataset_path, f'{name}.txt'), content)
+
+        return len(metadata)
+
+    def close(self) -> None:
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Convert between metadata directories and stores.')
+    parser.add_argument('command', type=str, choices=['import', 'export'],
+                        help='Import a directory into a store, or export a '
+                             'store to a directory')
+    parser.add_argument('-s', '--store_file', type=str, required=True,
+                        help='Path to the metadata store')
+    parser.add_argument('-d', '--metadataset_path', type=str, required=True,
+                        help='Path to the metadataset dir')
+    parser.add_argument('--divider', type=str, default='++++++++++',
+                        help='Divider of the metadata slices')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        if not os.path.isdir(args.metadataset_path):
+            raise NotADirectoryError(f'`{args.metadataset_path}` is not a directory!')
+        count = MetadataStore(args.store_file).import_dir(args.metadataset_path,
+                                                          divider=args.divider)
+        print(f'Imported {count} files into `{args.store_file}`.')
+    else:
+        if not os.path.isfile(args.store_file):
+            raise FileNotFoundError(f'`{args.store_file}` is not a file!')
+        count = MetadataStore(args.store_file).export_dir(args.metadataset_path)
+        print(f'Exported {count} files to `{args.metadataset_path}`.')
@@ -0,0 +1,269 @@
+import bisect
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+
+from .metadata_store import MetadataStore
+
+__all__ = ['PackedDataset']
+
+# magic, version, number of entries, length of the divider
+_HEADER = struct.Struct('<4sIII')
+_MAGIC = b'BTPK'
+_VERSION = 1
+# the frequency of the words missing from the index file
+UNRANKED = 0xffffffff
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+class PackedDataset:
+    r"""A read-only metadata dataset packed in a single file and mapped into
+        memory. The file holds a header, the divider, the sorted accented
+        words with their offsets, the offsets of the metadata, the frequency
+        of every word and the word order by frequency, all read in place, so
+        opening it costs nothing and every process shares the page cache.
+
+        Looking up a word bisects the key table and returns `memoryview`
+        slices of its fields, without copying or parsing the rest of the
+        dataset. Build a pack with `PackedDataset.build`.
+
+    Args:
+        pack_file (str): The path to the pack.
+    """
+
+    def __init__(self, pack_file: str) -> None:
+        self.pack_file = pack_file
+        with open(pack_file, 'rb') as file:
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+
+        magic, version, self.count, divider_size = _HEADER.unpack_from(self.mm)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f'`{pack_file}` is not a version {_VERSION} pack')
+        offset = _HEADER.size
+        self.divider = bytes(self.view[offset:offset + divider_size])
+        offset = _align(offset + divider_size)
+
+        def section(fmt: str, length: int) -> memoryview:
+            nonlocal offset
+            size = length * array(fmt).itemsize
+            view = self.view[offset:offset + size].cast(fmt)
+            offset = _align(offset + size)
+            return view
+
+        self.key_offsets = section('Q', self.count + 1)
+        self.data_offsets = section('Q', self.count + 1)
+        self.freqs = section('I', self.count)
+        self.order = section('I', self.count)
+        self.sorted_freqs = section('I', self.count)
+        self.keys_start = offset
+        self.data_start = offset + self.key_offsets[self.count]
+
+    def _key(self, i: int) -> bytes:
+        start = self.keys_start
+        return self.mm[start + self.key_offsets[i]:start + self.key_offsets[i + 1]]
+
+    def find(self, name: str) -> int:
+        r"""Returns the position of a word in the key table, or -1."""
+        key = name.encode('utf-8')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.count and self._key(lo) == key else -1
+
+    def name(self, i: int) -> str:
+        return self._key(i).decode('utf-8')
+
+    def raw(self, i: int) -> memoryview:
+        r"""Returns the divider-joined metadata at a position, in place."""
+        return self.view[self.data_start + self.data_offsets[i]:
+                         self.data_start + self.data_offsets[i + 1]]
+
+    def fields(self, i: int) -> list:
+        r"""Returns the metadata slices at a position as `memoryview`s of the
+            mapped file."""
+        start = self.data_start + self.data_offsets[i]
+        end = self.data_start + self.data_offsets[i + 1]
+        fields = list()
+        while True:
+            cut = self.mm.find(self.divider, start, end)
+            if cut < 0:
+                fields.append(self.view[start:end])
+                return fields
+            fields.append(self.view[start:cut])
+            start = cut + len(self.divider)
+
+    def get(self, name: str) -> list:
+        r"""Looks up the metadata slices of a word.
+
+        Args:
+            name (str): The accented word.
+
+        Returns:
+            list: The slices as `memoryview`s, or None if the word is missing.
+        """
+        i = self.find(name)
+        return self.fields(i) if i >= 0 else None
+
+    def freq_slice(self, min_freq: int = 0, max_freq: int = UNRANKED - 1) -> list:
+        r"""Returns the positions of the words within a frequency band, most
+            frequent first.
+
+        Args:
+            min_freq (int, optional): The lowest frequency rank, inclusive.
+                Defaults: 0.
+            max_freq (int, optional): The highest frequency rank, inclusive.
+                Defaults: every ranked word.
+
+        Returns:
+            list: Positions to be passed to `name`, `raw` or `fields`.
+        """
+        lo = bisect.bisect_left(self.sorted_freqs, min_freq)
+        hi = bisect.bisect_right(self.sorted_freqs, max_freq)
+        return self.order[lo:hi].tolist()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, name: str) -> bool:
+        return self.find(name) >= 0
+
+    def __iter__(self):
+        return (self.name(i) for i in range(self.count))
+
+    def close(self) -> None:
+        for view in (self.key_offsets, self.data_offsets, self.freqs,
+                     self.order, self.sorted_freqs, self.view):
+            view.release()
+        try:
+            self.mm.close()
+        except BufferError:
+            # slices handed out still use the mapping, it is unmapped once
+            # they are garbage collected
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def build(pack_file: str, metadataset_path: str, indexes_file: str = None,
+              divider: str = '\n++++++++++\n') -> int:
+        r"""Packs a metadata directory or store.
+
+        Args:
+            pack_file (str): The path to the pack to be written.
+            metadataset_path (str): A path to a directory containing metadata
+                files, or to a `MetadataStore`.
+            indexes_file (str, optional): An index file of `word\tfreq` lines
+                giving the frequency of the words. Defaults to None.
+            divider (str, optional): The string separating the slices.
+                Defaults: '\n++++++++++\n'.
+
+        Returns:
+            int: The number of packed words.
+        """
+        if MetadataStore.is_store(metadataset_path):
+            contents = MetadataStore(metadataset_path).get_many()
+        else:
+            contents = dict()
+            for entry in os.scandir(metadataset_path):
+                if entry.name.endswith('.txt'):
+                    with open(entry.path, 'r', encoding='utf-8') as file:
+                        contents[entry.name[:-4]] = file.read()
+
+        ranks = dict()
+        if indexes_file is not None:
+            with open(indexes_file, 'r', encoding='utf-8') as file:
+                for line in file:
+                    fields = line.strip().split('\t')
+                    if len(fields) > 1 and fields[1].isdigit():
+                        ranks.setdefault(fields[0], int(fields[1]))
+
+        entries = sorted((name.encode('utf-8'), content.encode('utf-8'),
+                          ranks.get(name, UNRANKED))
+                         for name, content in contents.items())
+        key_offsets, data_offsets = array('Q', [0]), array('Q', [0])
+        freqs = array('I', [freq for _, _, freq in entries])
+        for key, data, _ in entries:
+            key_offsets.append(key_offsets[-1] + len(key))
+            data_offsets.append(data_offsets[-1] + len(data))
+        order = array('I', sorted(range(len(entries)), key=lambda i: freqs[i]))
+        sorted_freqs = array('I', [freqs[i] for i in order])
+
+        divider = divider.encode('utf-8')
+        directory = os.path.dirname(os.path.abspath(pack_file))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with open(fd, 'wb') as file:
+                def write_aligned(data: bytes) -> None:
+                    file.write(data)
+                    file.write(b'\0' * (_align(file.tell()) - file.tell()))
+
+                file.write(_HEADER.pack(_MAGIC, _VERSION, len(entries), len(divider)))
+                write_aligned(divider)
+                for section in (key_offsets, data_offsets, freqs, order, sorted_freqs):
+                    write_aligned(section.tobytes())
+                for key, _, _ in entries:
+                    file.write(key)
+                for _, data, _ in entries:
+                    file.write(data)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, pack_file)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return len(entries)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Build or query a packed metadata dataset.')
+    parser.add_argument('command', type=str, choices=['build', 'get', 'band'],
+                        help='Build a pack, look up words, or list a frequency band')
+    parser.add_argument('-p', '--pack_file', type=str, required=True,
+                        help='Path to the pack')
+    parser.add_argument('-d', '--metadataset_path', type=str, default=None,
+                        help='Path to the metadataset dir or metadata store to pack')
+    parser.add_argument('-i', '--index_file', type=str, default=None,
+                        help='Path to the index file with word frequencies')
+    parser.add_argument('-w', '--words', type=str, nargs='+', default=[],
+                        help='Words to look up')
+    parser.add_argument('-f', '--freq_range', type=int, nargs=2, default=None,
+                        metavar=('MIN', 'MAX'),
+                        help='Frequency band to list')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if args.metadataset_path is None:
+            parser.error('build needs --metadataset_path')
+        count = PackedDataset.build(args.pack_file, args.metadataset_path,
+                                    indexes_file=args.index_file)
+        print(f'Packed {count} words into `{args.pack_file}`.')
+    elif args.command == 'get':
+        with PackedDataset(args.pack_file) as pack:
+            for word in args.words:
+                fields = pack.get(word)
+                print(f'{word}: not found' if fields is None else
+                      bytes(pack.divider).join(fields).decode('utf-8'))
+    else:
+        if args.freq_range is None:
+            parser.error('band needs --freq_range')
+        with PackedDataset(args.pack_file) as pack:
+            for i in pack.freq_slice(*args.freq_range):
+                print(f'{pack.name(i)}\t{pack.freqs[i]}')
@@ -0,0 +1,244 @@
+import re
+from html.entities import name2codepoint
+
+import lxml.etree
+import lxml.html
+from bs4 import BeautifulSoup
+
+__all__ = ['PARSERS', 'parse_bs4', 'parse_lxml']
+
+
+def _join(items: list) -> str:
+    items = '\n'.join(items)
+    return items if items != '' else 'None'
+
+
+def parse_bs4(index: str, html: str) -> tuple:
+    r"""Extracts the data of a given index from its HTML content with a full
+        BeautifulSoup tree. This is the reference extractor.
+
+    Args:
+        index (str): The index of the page.
+        html (str): The HTML content of the page.
+
+    Returns:
+        tuple: A tuple containing the index, the accent, the overview, the
+            tags, the translations and the example sentences.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+
+    html = soup.find('div', {'id': "content"})
+
+    accent = html.find('span').text
+    accent = accent if accent != '' else 'None'
+
+    types = html.find('div', {"class": "overview"}). \
+        find_all('p')
+    types = _join([type.text for type in types])
+
+    tags = html.find('div', {"class": "tags"}). \
+        find_all('a')
+    tags = _join([tag.text for tag in tags])
+
+    trans = html.find('div', {"class": "section translations"}). \
+        find_all('div', {"class": "content"})
+    trans = _join([tran.text for tran in trans])
+
+    ru_sentences = html.find_all('span', {'class': 'ru'})
+    ru_sentences = [ru_sentence.text
+                    for ru_sentence in ru_sentences]
+
+    tl_sentences = html.find_all('span', {'class': 'tl'})
+    tl_sentences = [tl_sentence.text
+                    for tl_sentence in tl_sentences]
+
+    sentences = _join([f'{ru} | {tl}'
+                       for ru, tl in zip(ru_sentences, tl_sentences)])
+
+    return index, accent, types, tags, trans, sentences
+
+
+# the strings BeautifulSoup leaves out of `.text`
+_HIDDEN_TAGS = frozenset(('script', 'style', 'template'))
+# the elements without an end tag, and the ones whose content is raw text
+_VOID_TAGS = frozenset(('area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+                        'link', 'meta', 'param', 'source', 'track', 'wbr'))
+_RAW_TAGS = frozenset(('script', 'style', 'textarea', 'title', 'xmp', 'iframe',
+                       'noembed', 'noframes', 'plaintext'))
+_TAG_REGEX = re.compile(r'<!--.*?-->|<!doctype[^>]*>|<\?[^>]*>|<(/?)([A-Za-z][^\s/>]*)'
+                        r'((?:"[^"]*"|\'[^\']*\'|[^\'">])*)>', re.I | re.S)
+_CONTENT_REGEX = re.compile(r'\bid\s*=\s*(["\']?)content\1(?=[\s/>]|$)')
+_REFERENCE_REGEX = re.compile(r'&(?:#[0-9]+;|#[xX][0-9A-Fa-f]+;|([A-Za-z][A-Za-z0-9]*);)?')
+# the named character references libxml2 knows, i.e. the ones of HTML 4
+_ENTITIES = frozenset(name2codepoint) | {'apos'}
+
+
+def _has_loose_references(html: str) -> bool:
+    r"""Tells whether the markup holds an ampersand that is not a complete
+        numeric or HTML 4 character reference, which html.parser and libxml2
+        decode differently."""
+    for match in _REFERENCE_REGEX.finditer(html):
+        if match.end() - match.start() == 1 or \
+                match.group(1) is not None and match.group(1) not in _ENTITIES:
+            return True
+    return False
+
+
+def _source_events(html: str) -> list:
+    r"""Lists the start and end tags of the `div#content` element as they are
+        written in the markup, or returns None if they are not well-formed,
+        i.e. a `<` opens no tag, or an end tag is missing, misplaced or does
+        not match, in which case `html.parser` and libxml2 may nest the
+        elements differently."""
+    events, stack = list(), None
+    pos = 0
+    while True:
+        pos = html.find('<', pos)
+        # a `<` opening no tag is read as text by libxml2 only
+        match = _TAG_REGEX.match(html, pos) if pos >= 0 else None
+        if match is None:
+            return None
+        pos = match.end()
+        if match.group(2) is None:
+            continue
+        closing, tag, attrs = match.group(1), match.group(2).lower(), match.group(3)
+
+        if stack is None:
+            if not closing and tag == 'div' and _CONTENT_REGEX.search(attrs):
+                stack = list()
+            else:
+                continue
+        if closing:
+            if not stack or stack[-1] != tag:
+                return None
+            stack.pop()
+            events.append(('end', tag))
+            if not stack:
+                return events
+        else:
+            events.append(('start', tag))
+            if attrs.rstrip().endswith('/') and tag not in _VOID_TAGS:
+                # html.parser closes it at once, libxml2 does not
+                return None
+            if tag in _RAW_TAGS:
+                end = re.compile(f'</{tag}', re.I).search(html, pos)
+                if end is None:
+                    return None
+                pos = end.start()
+            if tag not in _VOID_TAGS:
+                stack.append(tag)
+
+
+def _tree_events(element) -> list:
+    r"""Lists the start and end tags of an lxml element and its descendants."""
+    events = list()
+    for event, child in lxml.etree.iterwalk(element, events=('start', 'end')):
+        if not isinstance(child.tag, str):
+            continue
+        if event == 'start':
+            events.append(('start', child.tag))
+        elif child.tag not in _VOID_TAGS:
+            events.append(('end', child.tag))
+    return events
+
+
+def _text(element, parts: list) -> list:
+    r"""Collects the text of an lxml element the way BeautifulSoup's `.text`
+        does, i.e. without comments, scripts, styles and templates."""
+    if element.text:
+        parts.append(element.text)
+    for child in element:
+        if isinstance(child.tag, str) and child.tag not in _HIDDEN_TAGS:
+            _text(child, parts)
+        if child.tail:
+            parts.append(child.tail)
+    return parts
+
+
+def parse_lxml(index: str, html: str) -> tuple:
+    r"""Extracts the data of a given index from its HTML content with lxml,
+        walking the `div#content` subtree only once. libxml2 repairs malformed
+        markup differently from `html.parser`, e.g. it closes a `<p>` before a
+        `<div>`, so the page falls back to `parse_bs4` unless the tags of
+        `div#content` are well-formed and lxml built them as written. It also
+        falls back for the other inputs libxml2 reads differently: carriage
+        returns, CDATA sections and incomplete character references.
+
+    Args:
+        index (str): The index of the page.
+        html (str): The HTML content of the page.
+
+    Returns:
+        tuple: A tuple containing the index, the accent, the overview, the
+            tags, the translations and the example sentences.
+    """
+    if '\r' in html or '<![CDATA[' in html or _has_loose_references(html):
+        return parse_bs4(index, html)
+
+    events = _source_events(html)
+    if events is None:
+        return parse_bs4(index, html)
+    root = lxml.html.document_fromstring(html)
+    content = root.find('.//div[@id="content"]')
+    if content is None or _tree_events(content) != events:
+        return parse_bs4(index, html)
+
+    found = {'accent': None, 'types': None, 'tags': None, 'trans': None}
+    types, tags, trans, ru_sentences, tl_sentences = [], [], [], [], []
+
+    def walk(element, in_types: bool, in_tags: bool, in_trans: bool) -> None:
+        for child in element:
+            tag = child.tag
+            if not isinstance(tag, str):
+                continue
+
+            classes = child.get('class')
+            classes = classes.split() if classes else ()
+            enter_types, enter_tags, enter_trans = in_types, in_tags, in_trans
+
+            if tag == 'span':
+                if found['accent'] is None:
+                    found['accent'] = ''.join(_text(child, []))
+                if 'ru' in classes:
+                    ru_sentences.append(''.join(_text(child, [])))
+                if 'tl' in classes:
+                    tl_sentences.append(''.join(_text(child, [])))
+            elif tag == 'p':
+                if in_types:
+                    types.append(''.join(_text(child, [])))
+            elif tag == 'a':
+                if in_tags:
+                    tags.append(''.join(_text(child, [])))
+            elif tag == 'div':
+                if in_trans and 'content' in classes:
+                    trans.append(''.join(_text(child, [])))
+                if found['types'] is None and 'overview' in classes:
+                    found['types'] = enter_types = True
+                if found['tags'] is None and 'tags' in classes:
+                    found['tags'] = enter_tags = True
+                if found['trans'] is None and \
+                        ' '.join(classes) == 'section translations':
+                    found['trans'] = enter_trans = True
+
+            if len(child):
+                walk(child, enter_types, enter_tags, enter_trans)
+
+    walk(content, False, False, False)
+
+    for key, name in (('accent', 'span'), ('types', 'div.overview'),
+                      ('tags', 'div.tags'), ('trans', 'div.section.translations')):
+        if found[key] is None:
+            raise AttributeError(f'No `{name}` in the page of `{index}`')
+
+    accent = found['accent'] if found['accent'] != '' else 'None'
+    sentences = [f'{ru} | {tl}' for ru, tl in zip(ru_sentences, tl_sentences)]
+
+    return (index, accent, _join(types), _join(tags), _join(trans),
+            _join(sentences))
+
+
+PARSERS = {'bs4': parse_bs4, 'lxml': parse_lxml}
+
+
+if __name__ == '__main__':
+    pass
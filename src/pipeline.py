@@ -0,0 +1,175 @@
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from tqdm import tqdm
+
+__all__ = ['Pipeline']
+
+# marks the end of a stream
+_END = object()
+
+
+class Pipeline:
+    r"""A streaming pipeline of three stages connected by bounded queues:
+        I/O-bound fetching on threads, CPU-bound parsing on a process pool and
+        a single writer batching the output. A full queue blocks the stage
+        feeding it, so memory stays bounded on large index files.
+
+    Args:
+        fetch (callable): Maps an index to its raw content, or None if it
+            cannot be fetched. Called from `fetch_workers` threads.
+        parse (callable): Maps an index and its raw content to its metadata.
+            Runs in worker processes, so it must be picklable, e.g. a
+            module-level function.
+        write (callable): Receives a list of `(index, metadata, stage, error)`
+            tuples, where metadata is None if the index failed at the stage
+            'fetch', 'parse' or 'write', with an exception or None as error.
+            A batch failing to be written is passed again as failed at the
+            stage 'write'. Called from a single thread.
+        logger (logging.Logger): A logger object used to print messages.
+        fetch_workers (int, optional): The number of fetching threads.
+            Defaults: 16.
+        parse_workers (int, optional): The number of parsing processes.
+            Defaults: the number of cores.
+        queue_size (int, optional): The capacity of each queue between two
+            stages. Defaults: 256.
+        write_batch (int, optional): The maximum number of results written at
+            once. Defaults: 64.
+    """
+
+    def __init__(self, fetch, parse, write, logger: logging.Logger,
+                 fetch_workers: int = 16, parse_workers: int = None,
+                 queue_size: int = 256, write_batch: int = 64) -> None:
+
+        self.fetch = fetch
+        self.parse = parse
+        self.write = write
+        self.logger = logger
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.write_batch = write_batch
+
+    def _fetch_stage(self, indexes, lock: threading.Lock,
+                     parse_queue: queue.Queue, write_queue: queue.Queue) -> None:
+        while True:
+            with lock:
+                index = next(indexes, _END)
+            if index is _END:
+                return
+
+            try:
+                content = self.fetch(index)
+            except Exception as e:
+                write_queue.put((index, None, 'fetch', e))
+                continue
+            if content is None:
+                write_queue.put((index, None, 'fetch', None))
+            else:
+                parse_queue.put((index, content))
+
+    def _parse_stage(self, parse_queue: queue.Queue,
+                     write_queue: queue.Queue) -> None:
+        # keep every process busy with one task in hand and one queued
+        max_pending = 2 * self.parse_workers
+        pending = dict()
+
+        def drain(return_when) -> None:
+            done, _ = wait(pending, return_when=return_when)
+            for future in done:
+                index = pending.pop(future)
+                if future.exception() is not None:
+                    write_queue.put((index, None, 'parse', future.exception()))
+                else:
+                    write_queue.put((index, future.result(), None, None))
+
+        item, submitted = None, True
+        try:
+            with ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+                while True:
+                    item, submitted = parse_queue.get(), False
+                    if item is _END:
+                        break
+                    index, content = item
+                    pending[pool.submit(self.parse, index, content)] = index
+                    submitted = True
+                    if len(pending) >= max_pending:
+                        drain(FIRST_COMPLETED)
+                if pending:
+                    drain(ALL_COMPLETED)
+        except Exception as e:
+            # e.g. a broken pool, every index left fails at this stage, and
+            # the queue is still read to the end so that no fetcher blocks
+            self.logger.error(f'Error in the parse stage: {e!r}')
+            failed = list(pending.values())
+            if not submitted and item is not _END:
+                failed.append(item[0])
+            for index in failed:
+                write_queue.put((index, None, 'parse', e))
+            while item is not _END:
+                item = parse_queue.get()
+                if item is not _END:
+                    write_queue.put((item[0], None, 'parse', e))
+
+    def _write_stage(self, write_queue: queue.Queue, pbar: tqdm) -> None:
+        ended = False
+        while not ended:
+            batch = [write_queue.get()]
+            while len(batch) < self.write_batch:
+                try:
+                    batch.append(write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _END:
+                batch.pop()
+                ended = True
+
+            if batch:
+                try:
+                    self.write(batch)
+                except Exception as e:
+                    self.logger.error(f'Error writing {len(batch)} results: {e!r}')
+                    # the batch is recorded as failed like the fetch and parse
+                    # errors, so that it is retried
+                    try:
+                        self.write([(index, None, 'write', e) for index, *_ in batch])
+                    except Exception as e:
+                        self.logger.error(f'Error recording {len(batch)} failed '
+                                          f'results: {e!r}')
+                pbar.update(len(batch))
+
+    def __call__(self, indexes: list) -> None:
+        r"""Streams the indexes through the stages until all are written.
+
+        Args:
+            indexes (list): The indexes to be processed.
+        """
+        parse_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        iterator, lock = iter(indexes), threading.Lock()
+
+        with tqdm(total=len(indexes), unit='word') as pbar:
+            writer = threading.Thread(target=self._write_stage,
+                                      args=(write_queue, pbar))
+            parser = threading.Thread(target=self._parse_stage,
+                                      args=(parse_queue, write_queue))
+            fetchers = [threading.Thread(target=self._fetch_stage,
+                                         args=(iterator, lock, parse_queue,
+                                               write_queue))
+                        for _ in range(self.fetch_workers)]
+            for thread in [writer, parser] + fetchers:
+                thread.start()
+
+            for thread in fetchers:
+                thread.join()
+            parse_queue.put(_END)
+            parser.join()
+            write_queue.put(_END)
+            writer.join()
+
+
+if __name__ == '__main__':
+    pass
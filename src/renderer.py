@@ -0,0 +1,111 @@
+import functools
+import re
+
+__all__ = ['FieldRenderer']
+
+
+class FieldRenderer:
+    r"""Renders a metadata slice into the HTML of a note field, line by line.
+        The substitution rules are compiled once into a single alternation,
+        so every line is scanned once whatever the number of rules, and the
+        output is assembled from a preallocated list of parts.
+
+        A line is rendered as `item[0] + line + item[1]` with every rule
+        applied to the line. If `tail` is given, everything after the first
+        `tail[0]` of the rendered line, up to the end of the item or up to its
+        closing tag, is wrapped in `tail[1]` and `tail[2]`. The lines are
+        joined with `joiner` inside `container`.
+
+    Args:
+        container (tuple, optional): The opening and closing tags around the
+            whole field. Defaults: no tags.
+        item (tuple, optional): The opening and closing tags around every
+            line. Defaults: no tags.
+        rules (list, optional): `(pattern, template)` pairs substituted in
+            every line, like `re.sub`. Their matches must not overlap.
+            Defaults: no rules.
+        tail (tuple, optional): The marker, opening and closing strings of
+            the wrapped tail of a line. Defaults: None.
+        tail_closed (bool, optional): Whether the wrapped tail stops before
+            the closing tag of the item. Defaults: False.
+        joiner (str, optional): The string between two lines. Defaults: '\n'.
+        lower (bool, optional): Whether to lowercase the field. Defaults:
+            False.
+    """
+
+    def __init__(self, container: tuple = ('', ''), item: tuple = ('', ''),
+                 rules: list = None, tail: tuple = None,
+                 tail_closed: bool = False, joiner: str = '\n',
+                 lower: bool = False) -> None:
+
+        self.container = container
+        self.item = item
+        self.rules = [(re.compile(pattern), template)
+                      for pattern, template in rules or []]
+        self.tail = tail
+        self.tail_closed = tail_closed
+        self.joiner = joiner
+        self.lower = lower
+
+        # a single rule substitutes its template natively, several rules are
+        # merged into one alternation with a named group each, the outermost
+        # group closing last
+        if len(self.rules) == 1:
+            self.substitute = functools.partial(self.rules[0][0].sub,
+                                                self.rules[0][1])
+        elif self.rules:
+            regex = re.compile('|'.join(f'(?P<_{i}>{rule.pattern})'
+                                        for i, (rule, _) in enumerate(self.rules)))
+            self.substitute = functools.partial(regex.sub, self._substitute)
+        else:
+            self.substitute = None
+
+    def _substitute(self, match: re.Match) -> str:
+        rule, template = self.rules[int(match.lastgroup[1:])]
+        if '\\' not in template:
+            return template
+        return rule.fullmatch(match.group()).expand(template)
+
+    def __call__(self, string: str) -> str:
+        r"""Renders a metadata slice.
+
+        Args:
+            string (str): The slice, one entry per line.
+
+        Returns:
+            str: The HTML of the field.
+        """
+        lines = string.strip('\n').split('\n')
+        if self.substitute is not None:
+            lines = [self.substitute(line) for line in lines]
+
+        opening, closing = self.item
+        if self.tail is not None:
+            marker, tail_opening, tail_closing = self.tail
+            parts = [None] * len(lines)
+            for i, line in enumerate(lines):
+                # the marker is searched in the line, not across the item tags
+                start = line.find(marker)
+                if start < 0:
+                    parts[i] = f'{opening}{line}{closing}'
+                    continue
+                start += len(marker)
+                if self.tail_closed:
+                    parts[i] = ''.join((opening, line[:start], tail_opening,
+                                        line[start:], tail_closing, closing))
+                else:
+                    parts[i] = ''.join((opening, line[:start], tail_opening,
+                                        line[start:], closing, tail_closing))
+        elif opening or closing:
+            parts = [f'{opening}{line}{closing}' for line in lines]
+        else:
+            parts = lines
+
+        body = self.joiner.join(parts)
+        if self.container[0] or self.container[1]:
+            body = self.joiner.join((self.container[0], body, self.container[1]))
+        return body.lower() if self.lower else body
+
+
+if __name__ == '__main__':
+    pass
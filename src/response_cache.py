@@ -0,0 +1,214 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import quote, unquote, urlsplit, urlunsplit, parse_qsl, urlencode
+
+__all__ = ['ResponseCache']
+
+
+class ResponseCache:
+    r"""A persistent, content-addressed cache of HTTP response bodies. Bodies
+        are stored compressed under their SHA-256 digest, and an SQLite index
+        maps each normalized URL to its body, fetch and access timestamps.
+
+    Args:
+        cache_path (str): The path to the directory holding the cache.
+        ttl (float, optional): The time in seconds after which a response is
+            considered stale, None to never expire. Defaults: None.
+        max_size (int, optional): The maximum total size in bytes of the
+            compressed bodies, the least recently used responses are evicted
+            beyond it. None for no limit. Defaults: None.
+        touch_interval (int, optional): The number of hits after which the
+            access timestamps are flushed to the index. Defaults: 256.
+    """
+
+    def __init__(self, cache_path: str, ttl: float = None,
+                 max_size: int = None, touch_interval: int = 256) -> None:
+        self.objects_path = os.path.join(cache_path, 'objects')
+        if not os.path.exists(self.objects_path):
+            os.makedirs(self.objects_path)
+
+        self.ttl = ttl
+        self.max_size = max_size
+        self.touch_interval = touch_interval
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(cache_path, 'index.sqlite3'),
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                          'url TEXT PRIMARY KEY, digest TEXT NOT NULL, '
+                          'size INTEGER NOT NULL, fetched_at REAL NOT NULL, '
+                          'accessed_at REAL NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at '
+                          'ON responses (accessed_at)')
+        self.conn.commit()
+
+        self.total_size = self._get_total_size()
+        self.touches = dict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize_url(url: str) -> str:
+        r"""Normalizes a URL so that equivalent spellings share a cache entry:
+            lower-cased scheme and host, canonically quoted path, sorted query
+            and no fragment.
+
+        Args:
+            url (str): The URL to be normalized.
+
+        Returns:
+            str: The normalized URL.
+        """
+        parts = urlsplit(url)
+        path = quote(unquote(parts.path), safe='/') or '/'
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(),
+                           path, query, ''))
+
+    def _get_total_size(self) -> int:
+        size, = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM '
+                                  '(SELECT DISTINCT digest, size FROM responses)').fetchone()
+        return size
+
+    def _get_object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_path, digest[:2], f'{digest}.z')
+
+    def get(self, url: str) -> bytes:
+        r"""Looks up the body of a URL without touching the network.
+
+        Args:
+            url (str): The URL of the response.
+
+        Returns:
+            bytes: The decompressed body, or None if the URL is not cached or
+                its response has expired.
+        """
+        url = self.normalize_url(url)
+        with self.lock:
+            row = self.conn.execute('SELECT digest, fetched_at FROM responses '
+                                    'WHERE url = ?', (url,)).fetchone()
+            if row is None or (self.ttl is not None and
+                               time.time() - row[1] > self.ttl):
+                self.misses += 1
+                return None
+
+            digest = row[0]
+            self.hits += 1
+            self.touches[url] = time.time()
+            if len(self.touches) >= self.touch_interval:
+                self._flush_touches()
+
+        try:
+            with open(self._get_object_path(digest), 'rb') as file:
+                return zlib.decompress(file.read())
+        except (OSError, zlib.error):
+            return None
+
+    def put(self, url: str, body: bytes) -> None:
+        r"""Stores the body of a URL, evicting the least recently used
+            responses if the cache grows beyond `max_size`.
+
+        Args:
+            url (str): The URL of the response.
+            body (bytes): The raw body of the response.
+        """
+        url = self.normalize_url(url)
+        digest = hashlib.sha256(body).hexdigest()
+        object_path = self._get_object_path(digest)
+
+        # compressing is the slow part, so it is done outside the lock
+        data = None if os.path.isfile(object_path) else zlib.compress(body)
+
+        with self.lock:
+            # the body is written under the lock, so that a concurrent `put`
+            # releasing the same digest cannot remove it in between
+            if not os.path.isfile(object_path):
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                temp_path = f'{object_path}.{threading.get_ident()}.tmp'
+                with open(temp_path, 'wb') as file:
+                    file.write(data if data is not None else zlib.compress(body))
+                os.replace(temp_path, object_path)
+            size = os.path.getsize(object_path)
+
+            shared = self.conn.execute('SELECT 1 FROM responses WHERE digest = ? '
+                                       'LIMIT 1', (digest,)).fetchone()
+            previous = self.conn.execute('SELECT digest FROM responses '
+                                         'WHERE url = ?', (url,)).fetchone()
+            now = time.time()
+            self.conn.execute('INSERT OR REPLACE INTO responses '
+                              'VALUES (?, ?, ?, ?, ?)',
+                              (url, digest, size, now, now))
+            if shared is None:
+                self.total_size += size
+            if previous is not None and previous[0] != digest:
+                self._release(previous[0])
+            self.touches.pop(url, None)
+
+            if self.max_size is not None and self.total_size > self.max_size:
+                self._evict()
+            self.conn.commit()
+
+    def _release(self, digest: str) -> None:
+        r"""Deletes a body once no URL refers to it anymore."""
+        if self.conn.execute('SELECT 1 FROM responses WHERE digest = ? LIMIT 1',
+                             (digest,)).fetchone() is None:
+            object_path = self._get_object_path(digest)
+            if os.path.isfile(object_path):
+                self.total_size -= os.path.getsize(object_path)
+                os.remove(object_path)
+
+    def _flush_touches(self) -> None:
+        self.conn.executemany('UPDATE responses SET accessed_at = ? WHERE url = ?',
+                              [(t, url) for url, t in self.touches.items()])
+        self.conn.commit()
+        self.touches.clear()
+
+    def _evict(self) -> None:
+        r"""Evicts the least recently used responses until the cache fits in
+            `max_size`."""
+        self._flush_touches()
+        rows = self.conn.execute('SELECT url, digest FROM responses '
+                                 'ORDER BY accessed_at').fetchall()
+        for url, digest in rows:
+            if self.total_size <= self.max_size:
+                break
+            self.conn.execute('DELETE FROM responses WHERE url = ?', (url,))
+            self._release(digest)
+
+    def items(self):
+        r"""Iterates over the cached responses, regardless of their age.
+
+        Yields:
+            tuple: The normalized URL and the decompressed body of a response.
+        """
+        with self.lock:
+            rows = self.conn.execute('SELECT url, digest FROM responses '
+                                     'ORDER BY url').fetchall()
+        for url, digest in rows:
+            try:
+                with open(self._get_object_path(digest), 'rb') as file:
+                    yield url, zlib.decompress(file.read())
+            except (OSError, zlib.error):
+                continue
+
+    def close(self) -> None:
+        r"""Flushes the pending access timestamps and closes the index."""
+        with self.lock:
+            self._flush_touches()
+            self.conn.close()
+
+    def __enter__(self) -> 'ResponseCache':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,260 @@
+import asyncio
+import math
+import random
+import socket
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+
+__all__ = ['Scheduler']
+
+
+class Scheduler:
+    r"""A request scheduler shared by the workers of a client. It combines a
+        token-bucket rate limit, a concurrency limit adjusted by additive
+        increase / multiplicative decrease (AIMD) from the observed errors and
+        latencies, and exponential backoff with full jitter that honours
+        `Retry-After`.
+
+    Args:
+        rate (float, optional): The sustained number of requests per second,
+            None for no rate limit. Defaults: None.
+        burst (int, optional): The capacity of the token bucket. Defaults: 1.
+        max_concurrency (int, optional): The upper bound of in-flight requests.
+            Defaults: 64.
+        min_concurrency (int, optional): The lower bound of in-flight requests.
+            Defaults: 1.
+        latency_target (float, optional): The latency in seconds above which a
+            successful request is treated as a congestion signal, None to only
+            react to errors. Defaults: None.
+        base_delay (float, optional): The base backoff delay in seconds.
+            Defaults: 1.
+        max_delay (float, optional): The maximum backoff delay in seconds.
+            Defaults: 60.
+    """
+
+    THROTTLE_STATUSES = frozenset((429, 502, 503, 504))
+
+    def __init__(self, rate: float = None, burst: int = 1,
+                 max_concurrency: int = 64, min_concurrency: int = 1,
+                 latency_target: float = None,
+                 base_delay: float = 1, max_delay: float = 60) -> None:
+
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.latency_target = latency_target
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.cond = threading.Condition()
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.blocked_until = 0.
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.successes = 0
+        self.decreased_at = 0.
+
+        self.requests = 0
+        self.errors = 0
+        self.throttles = 0
+
+    @staticmethod
+    def get_status(error: Exception) -> int:
+        r"""Returns the HTTP status carried by an error of urllib, aiohttp,
+            requests or openai, or None."""
+        for name in ('code', 'status', 'http_status'):
+            status = getattr(error, name, None)
+            if isinstance(status, int):
+                return status
+        response = getattr(error, 'response', None)
+        return getattr(response, 'status_code', None)
+
+    @staticmethod
+    def get_retry_after(error: Exception) -> float:
+        r"""Returns the delay in seconds requested by an error, either through
+            its `retry_after` attribute or its `Retry-After` header, or None.
+        """
+        retry_after = getattr(error, 'retry_after', None)
+        if retry_after is None:
+            headers = getattr(error, 'headers', None) or \
+                getattr(getattr(error, 'response', None), 'headers', None)
+            retry_after = headers.get('Retry-After') if headers else None
+        if retry_after is None:
+            return None
+
+        try:
+            return max(0., float(retry_after))
+        except (TypeError, ValueError):
+            pass
+        try:
+            return max(0., parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def is_throttle(self, error: Exception) -> bool:
+        r"""Tells whether an error means the upstream is overloaded, as
+            opposed to e.g. a missing page."""
+        status = self.get_status(error)
+        if status is not None:
+            return status in self.THROTTLE_STATUSES
+        return self.get_retry_after(error) is not None or \
+            isinstance(error, (TimeoutError, ConnectionError, socket.timeout,
+                               asyncio.TimeoutError))
+
+    def _try_acquire(self, now: float) -> float:
+        r"""Takes a concurrency slot and a token if both are available.
+            Must be called with `cond` held.
+
+        Returns:
+            float: 0 on success, otherwise the time to wait before retrying,
+                `math.inf` if a slot has to be released first.
+        """
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.in_flight >= max(self.min_concurrency, int(self.limit)):
+            return math.inf
+
+        if self.rate is not None:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.refilled_at) * self.rate)
+            self.refilled_at = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+
+        self.in_flight += 1
+        self.requests += 1
+        return 0.
+
+    def acquire(self) -> float:
+        r"""Blocks until a request may be sent.
+
+        Returns:
+            float: The monotonic time at which the request was admitted.
+        """
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                wait = self._try_acquire(now)
+                if wait == 0:
+                    return now
+                self.cond.wait(timeout=None if wait == math.inf else wait)
+
+    async def async_acquire(self) -> float:
+        r"""Waits without blocking the event loop until a request may be sent.
+
+        Returns:
+            float: The monotonic time at which the request was admitted.
+        """
+        while True:
+            with self.cond:
+                now = time.monotonic()
+                wait = self._try_acquire(now)
+            if wait == 0:
+                return now
+            await asyncio.sleep(0.01 if wait == math.inf else wait)
+
+    def release(self, started_at: float, error: Exception = None) -> None:
+        r"""Frees the slot of a finished request and adapts the concurrency
+            limit to its outcome.
+
+        Args:
+            started_at (float): The value returned by `acquire`.
+            error (Exception, optional): The error the request failed with.
+        """
+        now = time.monotonic()
+        with self.cond:
+            self.in_flight -= 1
+
+            congested = False
+            if error is not None:
+                self.errors += 1
+                congested = self.is_throttle(error)
+                self.throttles += congested
+            elif self.latency_target is not None:
+                congested = now - started_at > self.latency_target
+
+            if congested:
+                # at most one decrease per round trip, requests sent before the
+                # last decrease do not count
+                if started_at >= self.decreased_at:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self.decreased_at = now
+                    self.successes = 0
+            elif error is None:
+                self.successes += 1
+                if self.successes >= int(self.limit):
+                    self.limit = min(self.max_concurrency, self.limit + 1)
+                    self.successes = 0
+
+            self.cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        r"""Holds a request slot for the duration of the block and records its
+            outcome."""
+        started_at = self.acquire()
+        try:
+            yield
+        except Exception as e:
+            self.release(started_at, e)
+            raise
+        self.release(started_at)
+
+    @asynccontextmanager
+    async def async_slot(self):
+        r"""The asyncio counterpart of `slot`."""
+        started_at = await self.async_acquire()
+        try:
+            yield
+        except Exception as e:
+            self.release(started_at, e)
+            raise
+        self.release(started_at)
+
+    def _get_delay(self, attempt: int, error: Exception = None) -> float:
+        delay = random.uniform(0, min(self.max_delay,
+                                      self.base_delay * 2 ** attempt))
+        retry_after = self.get_retry_after(error) if error is not None else None
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+            # the upstream asked every worker to hold off, not only this one
+            with self.cond:
+                self.blocked_until = max(self.blocked_until,
+                                         time.monotonic() + retry_after)
+        return delay
+
+    def backoff(self, attempt: int, error: Exception = None) -> float:
+        r"""Sleeps before the next attempt of a failed request.
+
+        Args:
+            attempt (int): The zero-based number of the failed attempt.
+            error (Exception, optional): The error the attempt failed with.
+
+        Returns:
+            float: The slept delay in seconds.
+        """
+        delay = self._get_delay(attempt, error)
+        time.sleep(delay)
+        return delay
+
+    async def async_backoff(self, attempt: int, error: Exception = None) -> float:
+        r"""The asyncio counterpart of `backoff`."""
+        delay = self._get_delay(attempt, error)
+        await asyncio.sleep(delay)
+        return delay
+
+    def stats(self) -> dict:
+        r"""Returns the counters and the current limits of the scheduler."""
+        with self.cond:
+            return {'requests': self.requests, 'errors': self.errors,
+                    'throttles': self.throttles, 'in_flight': self.in_flight,
+                    'concurrency_limit': int(self.limit), 'rate': self.rate}
+
+
+if __name__ == '__main__':
+    pass
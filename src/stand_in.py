@@ -0,0 +1,334 @@
+import html
+import json
+import os
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+from .chatgpt import BATCH_INSTRUCTION
+
+__all__ = ['StandInServer', 'StandInCompletionServer', 'StandInMediaServer',
+           'render_page', 'load_pages', 'load_media']
+
+
+def render_page(metadata_slices: list) -> str:
+    r"""Renders an openrussian-like page from the metadata slices of a word,
+        such that `Crawler._parse_html` extracts the very same slices back.
+
+    Args:
+        metadata_slices (list): The slices of a metadata file, i.e. the index,
+            the accent, the overview, the tags, the translations and the
+            example sentences.
+
+    Returns:
+        str: The HTML content of the page.
+    """
+    slices = [s.strip('\n') for s in metadata_slices]
+    slices = [s if s != 'None' else '' for s in slices] + [''] * (6 - len(slices))
+    index, accent, types, tags, trans, sentences = slices[:6]
+
+    def lines(string: str) -> list:
+        return [html.escape(line) for line in string.split('\n') if line]
+
+    sentence_items = list()
+    for sentence in lines(sentences):
+        ru, _, tl = sentence.partition(' | ')
+        sentence_items.append(f'<li><span class="ru">{ru}</span>'
+                              f'<span class="tl">{tl}</span></li>')
+
+    return ''.join([
+        '<!DOCTYPE html>\n<html><head><meta charset="utf-8">',
+        f'<title>{html.escape(index)} - Russian</title></head><body>\n',
+        '<div id="content">\n',
+        f'<h1><span class="accent">{html.escape(accent)}</span></h1>\n',
+        '<div class="overview">',
+        ''.join(f'<p>{line}</p>' for line in lines(types)),
+        '</div>\n<div class="tags">',
+        ''.join(f'<a href="/tags/{line}">{line}</a>' for line in lines(tags)),
+        '</div>\n<div class="section translations">',
+        ''.join(f'<div class="content">{line}</div>' for line in lines(trans)),
+        '</div>\n<div class="section sentences"><ul>',
+        ''.join(sentence_items),
+        '</ul></div>\n</div>\n</body></html>\n'])
+
+
+def load_pages(metadataset_path: str, divider: str = '++++++++++',
+               limit: int = None) -> dict:
+    r"""Renders the canned pages of a metadata dataset, keyed by index.
+
+    Args:
+        metadataset_path (str): A path to a directory containing metadata
+            files.
+        divider (str): The string used to separate different slices of
+            metadata.
+        limit (int, optional): The maximum number of pages to load.
+
+    Returns:
+        dict: A mapping from index to the encoded HTML content of its page.
+    """
+    pages = dict()
+    for entry in sorted(os.scandir(metadataset_path), key=lambda e: e.name):
+        if limit is not None and len(pages) >= limit:
+            break
+        if not entry.name.endswith('.txt'):
+            continue
+        with open(entry.path, 'r', encoding='utf-8') as file:
+            metadata_slices = file.read().strip().split(divider)
+        pages[entry.name[:-4]] = render_page(metadata_slices).encode('utf-8')
+
+    return pages
+
+
+class _StandIn(ABC):
+    r"""A local HTTP/1.1 server with keep-alive connections, an artificial
+        latency and injected throttling, running on a background thread.
+        Subclasses implement `_respond`.
+
+    Args:
+        host (str, optional): The host to bind. Defaults: '127.0.0.1'.
+        port (int, optional): The port to bind, 0 picks a free one.
+            Defaults: 0.
+        latency (float, optional): An artificial delay in seconds added to
+            every response. Defaults: 0.
+        error_rate (float, optional): The fraction of requests answered with
+            `error_status` and a `Retry-After` header. Defaults: 0.
+        retry_after (float, optional): The `Retry-After` of the throttled
+            responses in seconds. Defaults: 1.
+    """
+
+    error_status = 503
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0, error_rate: float = 0,
+                 retry_after: float = 1) -> None:
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.requests = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _handle(self) -> None:
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+
+                length = int(self.headers.get('Content-Length') or 0)
+                request = self.rfile.read(length) if length else b''
+                if server.error_rate and random.random() < server.error_rate:
+                    status, content_type = server.error_status, 'text/plain'
+                    body = b'Service Unavailable'
+                else:
+                    status, content_type, body = server._respond(
+                        self.path, request, self.headers)
+
+                self.send_response(status)
+                if status == 206:
+                    self.send_header('Content-Range', body[0])
+                    body = body[1]
+                if status == server.error_status:
+                    self.send_header('Retry-After', str(server.retry_after))
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @abstractmethod
+    def _respond(self, path: str, request: bytes, headers) -> tuple:
+        r"""Answers a request.
+
+        Args:
+            path (str): The requested path.
+            request (bytes): The body of the request.
+            headers: The headers of the request.
+
+        Returns:
+            tuple: The status, the content type and the body of the response.
+                The body of a `206` is a tuple of the `Content-Range` and the
+                partial content.
+        """
+        pass
+
+    @property
+    def address(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+
+class StandInServer(_StandIn):
+    r"""A local stand-in for en.openrussian.org serving canned pages over
+        keep-alive HTTP/1.1, so that crawlers can be measured offline.
+
+    Args:
+        pages (dict): A mapping from index to the encoded HTML content of its
+            page, see `load_pages`.
+        **kwargs: The server options of `_StandIn`, i.e. host, port, latency,
+            error_rate and retry_after.
+    """
+
+    def __init__(self, pages: dict, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.pages = pages
+
+    @property
+    def base_url(self) -> str:
+        return f'{self.address}/ru'
+
+    def _respond(self, path: str, request: bytes, headers) -> tuple:
+        index = unquote(path.rstrip('/').rsplit('/', 1)[-1])
+        body = self.pages.get(index)
+        if body is None:
+            return 404, 'text/html; charset=utf-8', b'Not Found'
+        return 200, 'text/html; charset=utf-8', body
+
+
+class StandInCompletionServer(_StandIn):
+    r"""A local stand-in for the OpenAI completion endpoint answering every
+        word of a (batched) prompt with a canned, well-formed entry. Point
+        `openai.api_base` at its `base_url`. Throttled requests get a `429`.
+
+    Args:
+        tokens_per_word (int, optional): The completion tokens reported per
+            answered word. Defaults: 200.
+        **kwargs: The server options of `_StandIn`, i.e. host, port, latency,
+            error_rate and retry_after.
+    """
+
+    error_status = 429
+
+    def __init__(self, tokens_per_word: int = 200, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.tokens_per_word = tokens_per_word
+
+    @property
+    def base_url(self) -> str:
+        return f'{self.address}/v1'
+
+    @staticmethod
+    def _answer(word: str) -> str:
+        return (f'1. [`noun`] {word}\n'
+                f'· Это `{word}`. (This is `{word}`.)')
+
+    def _respond(self, path: str, request: bytes, headers) -> tuple:
+        if not path.rstrip('/').endswith('/completions'):
+            return 404, 'application/json', b'{"error": {"message": "Not Found"}}'
+
+        prompt = json.loads(request or b'{}').get('prompt', '')
+        if BATCH_INSTRUCTION in prompt:
+            questions = prompt.split(BATCH_INSTRUCTION, 1)[1].strip('\n')
+            words = [line.partition('. ')[2] for line in questions.split('\n')]
+            text = '\n'.join(f'=== {n + 1}. {word} ===\n{self._answer(word)}'
+                             for n, word in enumerate(words))
+        else:
+            words = [prompt.rstrip('\n').rsplit(': ', 1)[-1].rstrip('.')]
+            text = self._answer(words[0])
+
+        body = json.dumps({
+            'object': 'text_completion',
+            'choices': [{'text': f'\n{text}', 'index': 0,
+                         'finish_reason': 'stop'}],
+            'usage': {'completion_tokens': self.tokens_per_word * len(words)}})
+        return 200, 'application/json', body.encode('utf-8')
+
+
+class StandInMediaServer(_StandIn):
+    r"""A local stand-in for the openrussian audio endpoint serving the mp3s
+        of a media dataset, with support for `Range` requests.
+
+    Args:
+        media (dict): A mapping from accented word to the content of its mp3,
+            see `load_media`.
+        **kwargs: The server options of `_StandIn`, i.e. host, port, latency,
+            error_rate and retry_after.
+    """
+
+    def __init__(self, media: dict, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.media = media
+
+    @property
+    def base_url(self) -> str:
+        return f'{self.address}/read/ru'
+
+    def _respond(self, path: str, request: bytes, headers) -> tuple:
+        name = unquote(path.rstrip('/').rsplit('/', 1)[-1])
+        body = self.media.get(name)
+        if body is None:
+            return 404, 'text/plain', b'Not Found'
+
+        match = re.fullmatch(r'bytes=(\d+)-', headers.get('Range') or '')
+        if match is None:
+            return 200, 'audio/mpeg', body
+        start = int(match.group(1))
+        if start >= len(body):
+            return 416, 'text/plain', b'Range Not Satisfiable'
+        return 206, 'audio/mpeg', (f'bytes {start}-{len(body) - 1}/{len(body)}',
+                                   body[start:])
+
+
+def load_media(mediaset_path: str, limit: int = None) -> dict:
+    r"""Reads the mp3s of a media dataset, keyed by accented word.
+
+    Args:
+        mediaset_path (str): A path to a directory containing mp3 files.
+        limit (int, optional): The maximum number of files to load.
+
+    Returns:
+        dict: A mapping from accented word to the content of its mp3.
+    """
+    media = dict()
+    for entry in sorted(os.scandir(mediaset_path), key=lambda e: e.name):
+        if limit is not None and len(media) >= limit:
+            break
+        if entry.name.endswith('.mp3'):
+            with open(entry.path, 'rb') as file:
+                media[entry.name[:-4]] = file.read()
+
+    return media
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Serve canned openrussian pages locally.')
+    parser.add_argument('-d', '--metadataset_path', type=str, required=True,
+                        help='Path to the metadataset dir')
+    parser.add_argument('-p', '--port', type=int, default=8000,
+                        help='Port to bind')
+    parser.add_argument('-l', '--latency', type=float, default=0,
+                        help='Artificial delay in seconds of every response')
+    args = parser.parse_args()
+
+    with StandInServer(load_pages(args.metadataset_path),
+                       port=args.port, latency=args.latency) as s:
+        print(f'Serving {len(s.pages)} pages at {s.base_url}')
+        s.thread.join()
@@ -0,0 +1,225 @@
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from .build_manifest import BuildManifest
+from .media import mp3_duration
+
+__all__ = ['Transcoder']
+
+# the silence trimmed at both ends of a recording, and the loudness target
+_TRIM = 'silenceremove=start_periods=1:start_threshold=-50dB:start_silence=0.05'
+_LOUDNORM = 'loudnorm=I=-16:TP=-1.5:LRA=11'
+
+
+def _transcode(command: list, temp_path: str, object_path: str) -> str:
+    r"""Runs ffmpeg and moves its output into place.
+
+    Returns:
+        str: None, or the error of ffmpeg.
+    """
+    try:
+        subprocess.run(command + [temp_path], check=True, capture_output=True,
+                       stdin=subprocess.DEVNULL)
+        os.replace(temp_path, object_path)
+    except (OSError, subprocess.CalledProcessError) as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        stderr = getattr(e, 'stderr', None)
+        return stderr.decode('utf-8', 'replace').strip() if stderr else str(e)
+    return None
+
+
+class Transcoder:
+    r"""Transcodes the audio of a deck to smaller MP3s with ffmpeg, one
+        process per worker, optionally trimming the silence at both ends and
+        normalizing the loudness. A transcoded file is cached under the hash
+        of its source and the settings, so every source is transcoded once,
+        and linked under the name of its source in the directory of the
+        settings, so that notes keep referring to the same file names.
+
+        With a budget, the highest bitrate whose estimated total size fits it
+        is picked for the whole deck.
+
+    Args:
+        cache_path (str): The directory of the transcoded files.
+        logger (logging.Logger): A logger to record the transcoding progress
+            and errors.
+        bitrates (tuple, optional): The bitrates in kbps to pick from, the
+            first one being used without a budget. Defaults: (64, 48, 40, 32,
+            24).
+        budget (int, optional): The size in bytes the audio of a deck should
+            fit in. Defaults to None.
+        workers (int, optional): The number of concurrent ffmpeg processes.
+            Defaults: the number of CPUs.
+        sample_rate (int, optional): The sample rate of the output. Defaults:
+            22050.
+        trim_silence (bool, optional): Whether to trim the leading and
+            trailing silence. Defaults: True.
+        normalize (bool, optional): Whether to normalize the loudness.
+            Defaults: True.
+        ffmpeg (str, optional): The ffmpeg executable. Defaults: 'ffmpeg'.
+    """
+
+    def __init__(self, cache_path: str, logger: logging.Logger,
+                 bitrates: tuple = (64, 48, 40, 32, 24), budget: int = None,
+                 workers: int = None, sample_rate: int = 22050,
+                 trim_silence: bool = True, normalize: bool = True,
+                 ffmpeg: str = 'ffmpeg') -> None:
+
+        self.cache_path = cache_path
+        self.logger = logger
+        self.bitrates = bitrates
+        self.budget = budget
+        self.workers = workers or os.cpu_count()
+        self.sample_rate = sample_rate
+        self.trim_silence = trim_silence
+        self.normalize = normalize
+        self.ffmpeg = shutil.which(ffmpeg)
+        if self.ffmpeg is None:
+            raise FileNotFoundError(f'`{ffmpeg}` is not installed!')
+
+        # the settings of the last transcoding, naming its directory
+        self.variant = None
+
+    def _filters(self) -> str:
+        filters = list()
+        if self.trim_silence:
+            # the trailing silence is trimmed as the leading one of the
+            # reversed audio
+            filters += [_TRIM, 'areverse', _TRIM, 'areverse']
+        if self.normalize:
+            filters.append(_LOUDNORM)
+        return ','.join(filters)
+
+    def _command(self, source_path: str, bitrate: int) -> list:
+        command = [self.ffmpeg, '-nostdin', '-hide_banner', '-loglevel', 'error',
+                   '-y', '-i', source_path, '-map_metadata', '-1', '-vn']
+        filters = self._filters()
+        if filters:
+            command += ['-af', filters]
+        return command + ['-ac', '1', '-ar', str(self.sample_rate),
+                          '-codec:a', 'libmp3lame', '-b:a', f'{bitrate}k',
+                          '-f', 'mp3']
+
+    def pick_bitrate(self, media: list) -> int:
+        r"""Picks the highest bitrate whose estimated total size fits the
+            budget.
+
+        Args:
+            media (list): A list of media file paths.
+
+        Returns:
+            int: The bitrate in kbps.
+        """
+        if self.budget is None:
+            return self.bitrates[0]
+
+        seconds = 0
+        for path in media:
+            duration = mp3_duration(path)
+            # the silence trimming only shrinks this estimate
+            seconds += duration if duration is not None else 0
+        for bitrate in sorted(self.bitrates, reverse=True):
+            if seconds * bitrate * 1000 / 8 <= self.budget:
+                return bitrate
+
+        bitrate = min(self.bitrates)
+        self.logger.warning(f'The {seconds:.0f}s of audio do not fit in '
+                            f'{self.budget / 1e6:.1f} MB even at {bitrate} kbps.')
+        return bitrate
+
+    def get_variant(self, bitrate: int) -> str:
+        r"""Returns the name of the transcoded files of a bitrate, which tells
+            their settings apart.
+
+        Args:
+            bitrate (int): The bitrate in kbps.
+
+        Returns:
+            str: The name of the variant, e.g. 'mp3-64k-22050-trim-norm'.
+        """
+        return f'mp3-{bitrate}k-{self.sample_rate}' + \
+            ('-trim' if self.trim_silence else '') + \
+            ('-norm' if self.normalize else '')
+
+    def __call__(self, media: list, digests: dict = None) -> list:
+        r"""Transcodes media files, reusing the cached ones.
+
+        Args:
+            media (list): A list of media file paths.
+            digests (dict, optional): The SHA-256 of the files by path, if
+                known. Defaults to hashing them.
+
+        Returns:
+            list: The paths of the transcoded files, with the names of their
+                sources, in the same order. A file failing to transcode is
+                kept as it is.
+        """
+        bitrate = self.pick_bitrate(media)
+        self.variant = self.get_variant(bitrate)
+        variant_path = os.path.join(self.cache_path, self.variant)
+        objects_path = os.path.join(self.cache_path, 'objects', self.variant)
+        os.makedirs(variant_path, exist_ok=True)
+        os.makedirs(objects_path, exist_ok=True)
+        self.logger.info(f'Transcoding {len(media)} media files at {bitrate} kbps '
+                         f'to `{variant_path}`.')
+
+        # identical sources are transcoded once
+        objects, jobs, cached = list(), dict(), set()
+        for path in media:
+            digest = (digests or dict()).get(path) or BuildManifest.hash_file(path)
+            object_path = os.path.join(objects_path, f'{digest}.mp3')
+            objects.append(object_path)
+            if object_path in jobs or object_path in cached:
+                continue
+            if os.path.isfile(object_path):
+                cached.add(object_path)
+            else:
+                temp_path = os.path.join(objects_path, f'.tmp-{digest}.mp3')
+                jobs[object_path] = (self._command(path, bitrate), temp_path,
+                                     object_path)
+
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(_transcode, *job): object_path
+                       for object_path, job in jobs.items()}
+            for future in tqdm(futures, total=len(futures), unit='file'):
+                error = future.result()
+                if error is not None:
+                    failed += 1
+                    self.logger.error(f'Error transcoding `{futures[future]}`: {error}')
+
+        transcoded = list()
+        for path, object_path in zip(media, objects):
+            if not os.path.isfile(object_path):
+                transcoded.append(path)
+                continue
+            target = os.path.join(variant_path, os.path.basename(path))
+            if not os.path.exists(target) or not os.path.samefile(target, object_path):
+                self._link(object_path, target)
+            transcoded.append(target)
+
+        self.logger.info(f'Transcoded {len(jobs) - failed} media files, reused '
+                         f'{len(cached)} cached ones, {failed} failed.')
+        return transcoded
+
+    @staticmethod
+    def _link(object_path: str, target: str) -> None:
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.tmp-')
+        os.close(fd)
+        os.remove(temp_path)
+        try:
+            os.link(object_path, temp_path)
+        except OSError:
+            shutil.copyfile(object_path, temp_path)
+        os.replace(temp_path, target)
+
+
+if __name__ == '__main__':
+    pass
@@ -1,46 +1,168 @@
+import hashlib
+import logging
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 
+from ..build_manifest import BuildManifest
+from ..fileio import atomic_write
 
-def update_metadata_in_index_file(folder_path, index_file_path):
-    with open(index_file_path, 'r') as index_file:
-        lines = index_file.readlines()
+__all__ = ['extract_rank', 'update_metadata_in_index_file']
 
-    updated_lines = []
+# the rank of the words whose overview has no frequency label
+UNRANKED = 99999
+_TOP = re.compile(r'top (\d[\d,]*)')
+
+
+def extract_rank(content: str, divider: str = '++++++++++') -> int:
+    r"""Reads the frequency rank of a word from the label of its overview
+        section, e.g. 'Somewhat often used word (top 3,000)'."""
+    slices = [s for s in content.strip().split(divider) if s]
+    match = _TOP.search(slices[2]) if len(slices) > 2 else None
+    return int(match.group(1).replace(',', '')) if match else UNRANKED
+
+
+def _rank_chunk(jobs: list, divider: str = '++++++++++') -> list:
+    r"""Reads, hashes and ranks metadata files on a worker process.
+
+    Returns:
+        list: The size, mtime, hash and rank of every file, or None for the
+            ones that disappeared.
+    """
+    results = list()
+    for file_path in jobs:
+        try:
+            stat = os.stat(file_path)
+            with open(file_path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            results.append(None)
+            continue
+        results.append((stat.st_size, stat.st_mtime_ns, hashlib.sha256(data).hexdigest(),
+                        extract_rank(data.decode('utf-8'), divider)))
+    return results
 
-    for line in lines:
-        line = line.strip()
-        file_name = line.split('.')[0] + '.txt'  # 文件名为索引行中的第一列加上 '.txt'
 
-        file_path = os.path.join(folder_path, file_name)
+def update_metadata_in_index_file(metadataset_path: str, index_file: str,
+                                  manifest: BuildManifest = None,
+                                  workers: int = None, chunk_size: int = 256,
+                                  logger: logging.Logger = None) -> dict:
+    r"""Sets the frequency rank of every word of an index file from its
+        metadata file, rewriting `word\tfreq` lines and leaving the words
+        without metadata as they are. The files are ranked on a process pool,
+        and with a manifest, only the ones whose size or mtime changed since
+        they were recorded are read again. The index file is replaced
+        atomically.
 
-        if os.path.isfile(file_path):
-            with open(file_path, 'r') as file:
-                metadata_slices = file.read().strip().split('++++++++++')
-                metadata_slices = list(filter(None, metadata_slices))
-                rank = metadata_slices[2]
-                rank = rank.split('\n')
-                rank = list(filter(None, rank))
+    Args:
+        metadataset_path (str): The directory of the metadata files.
+        index_file (str): The index file to be updated.
+        manifest (BuildManifest, optional): The manifest recording the rank
+            of every file. Defaults to ranking every file.
+        workers (int, optional): The number of processes. Defaults: the
+            number of CPUs.
+        chunk_size (int, optional): The number of files per task. Defaults:
+            256.
+        logger (logging.Logger, optional): A logger to record the progress.
+            Defaults to None.
 
-                _ = list()
-                for item in rank:
-                    if re.findall(r'(top [\d,]+)', item):
-                        _.append(int(re.findall(r'([\d,]+)', item)[0].replace(',', '')))
-                if len(_) == 0:
-                    _.append(99999)
+    Returns:
+        dict: The numbers of words, of ranked, reused and missing files, and
+            of changed ranks.
+    """
+    with open(index_file, 'r', encoding='utf-8') as file:
+        content = file.read()
+    lines = content.split('\n')
+    if lines[-1] == '':
+        lines.pop()
 
-            line = file_name[:-4] + '\t' + str(_[0])
+    ranks, jobs = dict(), dict()
+    missing = 0
+    for line in lines:
+        name = line.strip().split('\t')[0]
+        if not name or name in ranks or name in jobs:
+            continue
+        file_path = os.path.join(metadataset_path, f'{name}.txt')
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            missing += 1
+            continue
+        fields = manifest.get_unchanged_fields('rank', name, stat) \
+            if manifest is not None else None
+        if fields is not None:
+            ranks[name] = fields[0]
+        else:
+            jobs[name] = file_path
+
+    reused = len(ranks)
+    names = list(jobs)
+    chunks = [[jobs[name] for name in names[i:i + chunk_size]]
+              for i in range(0, len(names), chunk_size)]
+    workers = workers or os.cpu_count()
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = [result for chunk in executor.map(_rank_chunk, chunks)
+                       for result in chunk]
+    else:
+        results = [result for chunk in chunks for result in _rank_chunk(chunk)]
+
+    for name, result in zip(names, results):
+        if result is None:
+            missing += 1
+            continue
+        size, mtime_ns, digest, rank = result
+        ranks[name] = rank
+        if manifest is not None:
+            manifest.put_fields('rank', name, digest, [rank], size, mtime_ns)
+
+    updated, changed = list(), 0
+    for line in lines:
+        name = line.strip().split('\t')[0]
+        if name in ranks:
+            new_line = f'{name}\t{ranks[name]}'
+            changed += new_line != line.strip()
+            line = new_line
+        updated.append(line)
+    updated = '\n'.join(updated) + ('\n' if content.endswith('\n') else '')
+    if updated != content:
+        atomic_write(index_file, updated)
+    if manifest is not None:
+        manifest.commit()
 
-        updated_lines.append(line)
+    stats = {'words': len(lines), 'ranked': len(ranks) - reused,
+             'reused': reused, 'missing': missing, 'changed': changed}
+    if logger is not None:
+        logger.info(f'Ranked {stats["ranked"]} changed files, reused {reused}, '
+                    f'{missing} words have no metadata; {changed} of '
+                    f'{stats["words"]} ranks changed in `{index_file}`.')
+    return stats
 
-    updated_content = '\n'.join(updated_lines)
 
-    with open(index_file_path, 'w') as index_file:
-        index_file.write(updated_content)
+if __name__ == '__main__':
+    import argparse
+    import time
 
+    from ..logger import create_logger
 
-# 示例调用
-folder_path = r'/Users/sjp/Babel-Tower-of-Anki/resources/datasets/russian/english/metadata'
-index_file_path = r'/Users/sjp/Babel-Tower-of-Anki/resources/indexes/russian.txt'
+    parser = argparse.ArgumentParser(
+        description='Update the frequency ranks of an index file from the metadata.')
+    parser.add_argument('-d', '--metadataset_path', type=str, required=True,
+                        help='Path to the metadataset dir')
+    parser.add_argument('-i', '--index_file', type=str, required=True,
+                        help='Path to the index file to update')
+    parser.add_argument('-m', '--manifest_file', type=str, default=None,
+                        help='Path to the manifest remembering the ranked files, '
+                             'so that only the changed ones are read again')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='Number of processes ranking the files')
+    args = parser.parse_args()
 
-update_metadata_in_index_file(folder_path, index_file_path)
+    start = time.perf_counter()
+    manifest = BuildManifest(args.manifest_file) if args.manifest_file else None
+    update_metadata_in_index_file(args.metadataset_path, args.index_file,
+                                  manifest=manifest, workers=args.workers,
+                                  logger=create_logger(logger_name='ranker'))
+    if manifest is not None:
+        manifest.close()
+    print(f'Done in {time.perf_counter() - start:.2f}s.')
@@ -0,0 +1,404 @@
+import bisect
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+from array import array
+
+from .metadata_store import MetadataStore
+
+__all__ = ['WordIndex']
+
+# magic, version, number of words, number of bitmaps, length of the vocabulary
+_HEADER = struct.Struct('<4sIIII')
+_MAGIC = b'BTWI'
+_VERSION = 1
+# the frequency of the words missing from the index files
+UNRANKED = 0xffffffff
+LEVELS = ('A1', 'A2', 'B1', 'B2', 'C1', 'C2')
+_LEVEL = re.compile(r'^[ABC][12]$')
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _set_bits(bits: bytes):
+    for byte_index, byte in enumerate(bits):
+        while byte:
+            low = byte & -byte
+            yield (byte_index << 3) + low.bit_length() - 1
+            byte ^= low
+
+
+def _parse_sections(content: str, divider: str) -> tuple:
+    r"""Reads the part of speech, CEFR level and tags of a word from its
+        overview and level sections, e.g. 'verb, perfective & imperfective'
+        and 'B1\nPeople - Family\nП'.
+
+    Returns:
+        tuple: The part of speech or None, the level or None, and the tags.
+    """
+    slices = [s.strip() for s in content.split(divider)]
+    pos, level, tags = None, None, list()
+    if len(slices) > 2 and slices[2]:
+        line = slices[2].split('\n')[0].strip()
+        # words without a part of speech start with their frequency label
+        if 'used word' not in line:
+            head, *qualifiers = [part.strip() for part in line.split(',')]
+            pos = head.split(' ')[0].lower()
+            for qualifier in qualifiers:
+                tags += [tag.strip() for tag in qualifier.split('&') if tag.strip()]
+    if len(slices) > 3:
+        for line in slices[3].split('\n'):
+            line = line.strip()
+            if _LEVEL.match(line):
+                level = line
+            elif ' - ' in line:
+                # topics, the last line being the initial of the word
+                tags.append(line)
+    return pos, level, tags
+
+
+class WordIndex:
+    r"""A read-only index of the words of a language, with their frequency
+        rank, part of speech, CEFR level and tags, built once from the index
+        files and the metadata and mapped into memory like a
+        `PackedDataset`.
+
+        Words are kept sorted, with their frequencies sorted alongside for
+        bisecting a frequency band, and every part of speech, level and tag
+        has a bitmap of its words, so selecting e.g. the nouns of levels B1
+        to B2 ranked up to 5000 is a bisection and a few bitwise operations,
+        without opening any metadata file. Build an index with
+        `WordIndex.build`.
+
+    Args:
+        index_file (str): The path to the word index.
+    """
+
+    def __init__(self, index_file: str) -> None:
+        self.index_file = index_file
+        with open(index_file, 'rb') as file:
+            self.mm = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+
+        magic, version, self.count, num_bitmaps, vocab_size = \
+            _HEADER.unpack_from(self.mm)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f'`{index_file}` is not a version {_VERSION} word index')
+        offset = _HEADER.size
+        vocab = json.loads(bytes(self.view[offset:offset + vocab_size]))
+        offset = _align(offset + vocab_size)
+        self.pos_names, self.tag_names = vocab['pos'], vocab['tags']
+
+        def section(fmt: str, length: int) -> memoryview:
+            nonlocal offset
+            size = length * array(fmt).itemsize
+            view = self.view[offset:offset + size].cast(fmt)
+            offset = _align(offset + size)
+            return view
+
+        self.key_offsets = section('Q', self.count + 1)
+        self.freqs = section('I', self.count)
+        self.order = section('I', self.count)
+        self.sorted_freqs = section('I', self.count)
+        # one bitmap per part of speech, level and tag, in that order
+        self.bitmap_size = (self.count + 7) // 8
+        self.bitmaps = list()
+        for _ in range(num_bitmaps):
+            self.bitmaps.append(self.view[offset:offset + self.bitmap_size])
+            offset += self.bitmap_size
+        self.keys_start = _align(offset)
+
+    @staticmethod
+    def is_index(path: str) -> bool:
+        r"""Tells whether a path is a word index rather than an index file."""
+        if not os.path.isfile(path):
+            return False
+        with open(path, 'rb') as file:
+            return file.read(len(_MAGIC)) == _MAGIC
+
+    def _key(self, i: int) -> bytes:
+        start = self.keys_start
+        return self.mm[start + self.key_offsets[i]:start + self.key_offsets[i + 1]]
+
+    def find(self, name: str) -> int:
+        r"""Returns the position of a word, or -1."""
+        key = name.encode('utf-8')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < self.count and self._key(lo) == key else -1
+
+    def name(self, i: int) -> str:
+        return self._key(i).decode('utf-8')
+
+    def _bitmap(self, kind: str, value: str) -> int:
+        if kind == 'pos':
+            names, start = self.pos_names, 0
+        elif kind == 'level':
+            names, start = LEVELS, len(self.pos_names)
+        else:
+            names, start = self.tag_names, len(self.pos_names) + len(LEVELS)
+        if value not in names:
+            return 0
+        return int.from_bytes(self.bitmaps[start + names.index(value)], 'little')
+
+    def info(self, name: str) -> dict:
+        r"""Looks up a word.
+
+        Args:
+            name (str): The accented word.
+
+        Returns:
+            dict: Its 'freq', 'pos', 'level' and 'tags', or None if the word
+                is missing.
+        """
+        i = self.find(name)
+        if i < 0:
+            return None
+        byte, bit = i >> 3, 1 << (i & 7)
+        hits = [bool(bitmap[byte] & bit) for bitmap in self.bitmaps]
+        pos_hits = hits[:len(self.pos_names)]
+        level_hits = hits[len(self.pos_names):len(self.pos_names) + len(LEVELS)]
+        tag_hits = hits[len(self.pos_names) + len(LEVELS):]
+        return {'freq': self.freqs[i],
+                'pos': next((value for value, hit in zip(self.pos_names, pos_hits)
+                             if hit), None),
+                'level': next((value for value, hit in zip(LEVELS, level_hits)
+                               if hit), None),
+                'tags': [value for value, hit in zip(self.tag_names, tag_hits) if hit]}
+
+    def select(self, min_freq: int = 0, max_freq: int = None,
+               pos: list = None, levels: tuple = None, tags: list = None) -> list:
+        r"""Selects words by frequency, part of speech, level and tags.
+
+        Args:
+            min_freq (int, optional): The lowest frequency rank, inclusive.
+                Defaults: 0.
+            max_freq (int, optional): The highest frequency rank, inclusive.
+                Defaults: every ranked word.
+            pos (list, optional): The parts of speech, any of which a word
+                has, e.g. ['noun']. Defaults to any.
+            levels (tuple, optional): The lowest and highest CEFR levels,
+                inclusive, e.g. ('B1', 'B2'). Defaults to any.
+            tags (list, optional): The tags a word has all of. Defaults to
+                any.
+
+        Returns:
+            list: The words, most frequent first.
+        """
+        mask = None
+        if pos:
+            mask = 0
+            for value in pos:
+                mask |= self._bitmap('pos', value)
+        for value in levels or ():
+            if value not in LEVELS:
+                raise ValueError(f'Unknown CEFR level `{value}`, expected one of '
+                                 f'{", ".join(LEVELS)}!')
+        if levels:
+            low, high = LEVELS.index(levels[0]), LEVELS.index(levels[-1])
+            level_mask = 0
+            for value in LEVELS[low:high + 1]:
+                level_mask |= self._bitmap('level', value)
+            mask = level_mask if mask is None else mask & level_mask
+        for value in tags or ():
+            tag_mask = self._bitmap('tag', value)
+            mask = tag_mask if mask is None else mask & tag_mask
+
+        if max_freq is None:
+            max_freq = UNRANKED - 1
+        lo = bisect.bisect_left(self.sorted_freqs, min_freq)
+        hi = bisect.bisect_right(self.sorted_freqs, max_freq)
+        positions = self.order[lo:hi]
+        if mask is not None and bin(mask).count('1') < len(positions):
+            # fewer words have the attributes than are in the band
+            positions = [i for i in _set_bits(mask.to_bytes(self.bitmap_size, 'little'))
+                         if min_freq <= self.freqs[i] <= max_freq]
+            # in the order of `order`, by frequency then by word
+            positions.sort(key=lambda i: (self.freqs[i], i))
+        elif mask is not None:
+            bits = mask.to_bytes(self.bitmap_size, 'little')
+            positions = [i for i in positions if bits[i >> 3] >> (i & 7) & 1]
+        return [self.name(i) for i in positions]
+
+    def frequencies(self) -> dict:
+        r"""Returns the frequency rank of every ranked word, most frequent
+            first like `select`."""
+        hi = bisect.bisect_left(self.sorted_freqs, UNRANKED)
+        return {self.name(i): self.freqs[i] for i in self.order[:hi]}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, name: str) -> bool:
+        return self.find(name) >= 0
+
+    def __iter__(self):
+        return (self.name(i) for i in range(self.count))
+
+    def close(self) -> None:
+        for view in (self.key_offsets, self.freqs, self.order,
+                     self.sorted_freqs, *self.bitmaps, self.view):
+            view.release()
+        self.mm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def build(index_file: str, indexes_files: list, metadataset_path: str = None,
+              divider: str = '++++++++++') -> int:
+        r"""Builds a word index.
+
+        Args:
+            index_file (str): The path to the word index to be written.
+            indexes_files (list): Index files of `word\tfreq` lines, the
+                frequency of a word in the first ones winning.
+            metadataset_path (str, optional): A path to a directory
+                containing metadata files, or to a `MetadataStore`, giving
+                the part of speech, level and tags of the words. Defaults to
+                None.
+            divider (str, optional): The string separating the slices.
+                Defaults: '++++++++++'.
+
+        Returns:
+            int: The number of indexed words.
+        """
+        ranks = dict()
+        for indexes_file in indexes_files:
+            with open(indexes_file, 'r', encoding='utf-8') as file:
+                for line in file:
+                    fields = line.strip().split('\t')
+                    if not fields[0]:
+                        continue
+                    rank = int(fields[1]) if len(fields) > 1 and fields[1].isdigit() \
+                        else UNRANKED
+                    if ranks.get(fields[0], UNRANKED) == UNRANKED:
+                        ranks[fields[0]] = rank
+
+        sections = dict()
+        if metadataset_path is not None:
+            if MetadataStore.is_store(metadataset_path):
+                contents = MetadataStore(metadataset_path).get_many().items()
+            else:
+                contents = list()
+                for entry in os.scandir(metadataset_path):
+                    if entry.name.endswith('.txt'):
+                        with open(entry.path, 'r', encoding='utf-8') as file:
+                            contents.append((entry.name[:-4], file.read()))
+            for name, content in contents:
+                sections[name] = _parse_sections(content, divider)
+                ranks.setdefault(name, UNRANKED)
+
+        names = sorted(ranks, key=lambda name: name.encode('utf-8'))
+        freqs = array('I', [ranks[name] for name in names])
+        key_offsets = array('Q', [0])
+        for name in names:
+            key_offsets.append(key_offsets[-1] + len(name.encode('utf-8')))
+        order = array('I', sorted(range(len(names)), key=lambda i: freqs[i]))
+        sorted_freqs = array('I', [freqs[i] for i in order])
+
+        pos_names = sorted({pos for pos, _, _ in sections.values() if pos})
+        tag_names = sorted({tag for _, _, tags in sections.values() for tag in tags})
+        values = [*pos_names, *LEVELS, *tag_names]
+        slots = {value: slot for slot, value in enumerate(values)}
+        tag_start = len(pos_names) + len(LEVELS)
+        masks = [0] * len(values)
+        for i, name in enumerate(names):
+            if name not in sections:
+                continue
+            pos, level, tags = sections[name]
+            hits = [slots[pos]] if pos else []
+            hits += [len(pos_names) + LEVELS.index(level)] if level else []
+            hits += [tag_start + tag_names.index(tag) for tag in tags]
+            for slot in hits:
+                masks[slot] |= 1 << i
+        bitmap_size = (len(names) + 7) // 8
+
+        vocab = json.dumps({'pos': pos_names, 'tags': tag_names},
+                           ensure_ascii=False).encode('utf-8')
+        directory = os.path.dirname(os.path.abspath(index_file))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with open(fd, 'wb') as file:
+                def write_aligned(data: bytes) -> None:
+                    file.write(data)
+                    file.write(b'\0' * (_align(file.tell()) - file.tell()))
+
+                file.write(_HEADER.pack(_MAGIC, _VERSION, len(names), len(values),
+                                        len(vocab)))
+                write_aligned(vocab)
+                for section in (key_offsets, freqs, order, sorted_freqs):
+                    write_aligned(section.tobytes())
+                write_aligned(b''.join(mask.to_bytes(bitmap_size, 'little')
+                                       for mask in masks))
+                for name in names:
+                    file.write(name.encode('utf-8'))
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, index_file)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return len(names)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description='Build or query a word index.')
+    parser.add_argument('command', type=str, choices=['build', 'info', 'select'],
+                        help='Build an index, look up words, or select words')
+    parser.add_argument('-x', '--word_index', type=str, required=True,
+                        help='Path to the word index')
+    parser.add_argument('-i', '--index_files', type=str, nargs='+', default=[],
+                        help='Paths to the index files with word frequencies')
+    parser.add_argument('-d', '--metadataset_path', type=str, default=None,
+                        help='Path to the metadataset dir or metadata store')
+    parser.add_argument('-w', '--words', type=str, nargs='+', default=[],
+                        help='Words to look up')
+    parser.add_argument('-f', '--freq_range', type=int, nargs=2, default=None,
+                        metavar=('MIN', 'MAX'),
+                        help='Frequency band to select from')
+    parser.add_argument('-p', '--pos', type=str, nargs='+', default=None,
+                        help='Parts of speech to select, e.g. noun verb')
+    parser.add_argument('-l', '--levels', type=str, nargs='+', default=None,
+                        choices=LEVELS, help='Lowest and highest CEFR level to select')
+    parser.add_argument('-g', '--tags', type=str, nargs='+', default=None,
+                        help='Tags the selected words all have')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if not args.index_files:
+            parser.error('build needs --index_files')
+        count = WordIndex.build(args.word_index, args.index_files,
+                                metadataset_path=args.metadataset_path)
+        print(f'Indexed {count} words into `{args.word_index}`.')
+    elif args.command == 'info':
+        with WordIndex(args.word_index) as index:
+            for word in args.words:
+                print(f'{word}\t{json.dumps(index.info(word), ensure_ascii=False)}')
+    else:
+        with WordIndex(args.word_index) as index:
+            start = time.perf_counter()
+            words = index.select(*(args.freq_range or ()), pos=args.pos,
+                                 levels=args.levels, tags=args.tags)
+            seconds = time.perf_counter() - start
+            for word in words:
+                print(f'{word}\t{index.freqs[index.find(word)]}')
+            print(f'Selected {len(words)} words in {seconds * 1000:.1f}ms.')
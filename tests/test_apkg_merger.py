@@ -0,0 +1,67 @@
+import json
+import logging
+import os
+import sqlite3
+import zipfile
+
+import genanki
+
+from src import ApkgMerger, ApkgWriter
+
+MODEL = genanki.Model(1002, 'test_Note',
+                      fields=[{'name': 'Word'}, {'name': 'Audio'}],
+                      templates=[{'name': 'Card', 'qfmt': '{{Word}}',
+                                  'afmt': '{{FrontSide}}<hr>{{Audio}}'}])
+
+
+def make_package(directory, name: str, notes: list) -> str:
+    r"""Writes a package of `(guid, word, audio content)` notes."""
+    media_path = os.path.join(directory, name)
+    os.makedirs(media_path)
+    apkg_path = os.path.join(directory, f'{name}.apkg')
+    with ApkgWriter(apkg_path, 1, name, MODEL) as writer:
+        for guid, word, content in notes:
+            path = os.path.join(media_path, f'{word}.mp3')
+            with open(path, 'wb') as file:
+                file.write(content)
+            writer.add_media(path)
+            writer.add_note(genanki.Note(model=MODEL, guid=guid,
+                                         fields=[word, f'[sound:{word}.mp3]']))
+    return apkg_path
+
+
+def read_package(apkg_path: str, directory) -> tuple:
+    with zipfile.ZipFile(apkg_path) as package:
+        assert package.testzip() is None
+        media = json.loads(package.read('media'))
+        files = {name: package.read(idx) for idx, name in media.items()}
+        package.extract('collection.anki2', directory)
+    conn = sqlite3.connect(os.path.join(directory, 'collection.anki2'))
+    notes = dict(conn.execute('SELECT guid, flds FROM notes'))
+    conn.close()
+    return notes, files
+
+
+def test_colliding_media_are_renamed(tmp_path):
+    first = make_package(tmp_path, 'a', [('a1', 'x', b'first')])
+    second = make_package(tmp_path, 'b', [('b1', 'x', b'second')])
+    output = str(tmp_path / 'merged.apkg')
+    stats = ApkgMerger(logging.getLogger('test'))([first, second], output)
+
+    notes, files = read_package(output, tmp_path)
+    renamed = [name for name in files if name != 'x.mp3']
+    assert stats['renamed_media'] == 1 and len(renamed) == 1
+    assert files == {'x.mp3': b'first', renamed[0]: b'second'}
+    assert notes == {'a1': 'x\x1f[sound:x.mp3]', 'b1': f'x\x1f[sound:{renamed[0]}]'}
+
+
+def test_media_of_duplicate_notes_are_left_out(tmp_path):
+    first = make_package(tmp_path, 'a', [('g1', 'x', b'first')])
+    second = make_package(tmp_path, 'b', [('g1', 'y', b'second'), ('g2', 'z', b'third')])
+    output = str(tmp_path / 'merged.apkg')
+    stats = ApkgMerger(logging.getLogger('test'))([first, second], output)
+
+    notes, files = read_package(output, tmp_path)
+    assert stats['duplicate_notes'] == 1
+    assert files == {'x.mp3': b'first', 'z.mp3': b'third'}
+    assert set(notes) == {'g1', 'g2'}
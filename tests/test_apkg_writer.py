@@ -0,0 +1,96 @@
+import json
+import os
+import sqlite3
+import zipfile
+
+import genanki
+
+from src import ApkgWriter
+
+MODEL = genanki.Model(1002, 'test_Note',
+                      fields=[{'name': 'Word'}, {'name': 'Audio'}],
+                      templates=[{'name': 'Card', 'qfmt': '{{Word}}',
+                                  'afmt': '{{FrontSide}}<hr>{{Audio}}'}])
+TIMESTAMP = 1700000000.5
+
+
+def make_notes(words: list) -> list:
+    return [genanki.Note(model=MODEL, fields=[word, f'[sound:{word}.mp3]'])
+            for word in words]
+
+
+def make_media(directory, contents: dict) -> list:
+    paths = list()
+    for name, data in contents.items():
+        path = os.path.join(directory, name)
+        with open(path, 'wb') as file:
+            file.write(data)
+        paths.append(path)
+    return paths
+
+
+def read_package(apkg_path: str, directory) -> tuple:
+    db_path = os.path.join(directory, os.path.basename(apkg_path) + '.anki2')
+    with zipfile.ZipFile(apkg_path) as package:
+        with open(db_path, 'wb') as file:
+            file.write(package.read('collection.anki2'))
+        media = json.loads(package.read('media'))
+        files = {media[idx]: package.read(idx) for idx in media}
+    conn = sqlite3.connect(db_path)
+    tables = {table: sorted(conn.execute(f'SELECT * FROM {table}'))
+              for table in ('col', 'notes', 'cards', 'revlog', 'graves')}
+    conn.close()
+    return tables, files
+
+
+def test_rows_match_genanki(tmp_path):
+    words = [f'word{k}' for k in range(25)]
+    media = make_media(tmp_path, {f'{word}.mp3': word.encode() for word in words[:5]})
+
+    deck = genanki.Deck(1002000100, 'deck')
+    for note in make_notes(words):
+        deck.add_note(note)
+    genanki_path = str(tmp_path / 'genanki.apkg')
+    genanki.Package(deck, media_files=media).write_to_file(genanki_path,
+                                                           timestamp=TIMESTAMP)
+
+    writer_path = str(tmp_path / 'writer.apkg')
+    with ApkgWriter(writer_path, 1002000100, 'deck', MODEL, batch_size=10,
+                    timestamp=TIMESTAMP) as writer:
+        for path in media:
+            writer.add_media(path)
+        for note in make_notes(words):
+            writer.add_note(note)
+
+    assert read_package(writer_path, tmp_path) == read_package(genanki_path, tmp_path)
+
+
+def test_duplicate_media_point_at_the_first_copy(tmp_path):
+    media = make_media(tmp_path, {'a.mp3': b'same', 'b.mp3': b'same', 'c.mp3': b'other'})
+    apkg_path = str(tmp_path / 'deduped.apkg')
+    with ApkgWriter(apkg_path, 1, 'deck', MODEL, timestamp=TIMESTAMP,
+                    dedupe=True) as writer:
+        stored = [writer.add_media(path) for path in media]
+        notes = make_notes(['a', 'b', 'c'])
+        guids = [note.guid for note in notes]
+        for note in notes:
+            writer.add_note(note)
+
+    assert stored == [True, False, True]
+    assert writer.saved_bytes == len(b'same')
+    tables, files = read_package(apkg_path, tmp_path)
+    assert files == {'a.mp3': b'same', 'c.mp3': b'other'}
+    assert [row[1] for row in tables['notes']] == guids
+    assert [row[6].split('\x1f')[1] for row in tables['notes']] == \
+        ['[sound:a.mp3]', '[sound:a.mp3]', '[sound:c.mp3]']
+
+
+def test_failed_package_is_removed(tmp_path):
+    apkg_path = str(tmp_path / 'failed.apkg')
+    try:
+        with ApkgWriter(apkg_path, 1, 'deck', MODEL, timestamp=TIMESTAMP) as writer:
+            writer.add_note(make_notes(['a'])[0])
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,62 @@
+import logging
+
+import pytest
+
+from src import ChatGPT
+
+INDEXES = ['гарантия', 'дом', 'ко`т']
+
+
+@pytest.fixture
+def chatgpt():
+    return ChatGPT(api_key='key', engine='engine', prompt='prompt',
+                   articulation='articulation', logger=logging.getLogger('test'))
+
+
+def section(number: int, word: str, senses: int = 2) -> str:
+    lines = [f'=== {number}. {word} ===']
+    lines += [f'{k}. sense {k} of {word}' for k in range(1, senses + 1)]
+    return '\n'.join(lines) + '\n'
+
+
+def test_sections_are_mapped_to_their_words(chatgpt):
+    text = ''.join(section(k + 1, word) for k, word in enumerate(INDEXES))
+    answers = chatgpt._split_batch(INDEXES, text)
+    assert list(answers) == INDEXES
+    assert answers['дом'] == '1. sense 1 of дом\n2. sense 2 of дом'
+
+
+def test_echoed_words_are_normalized(chatgpt):
+    text = section(1, 'Гара́нтия') + section(3, 'кот')
+    assert list(chatgpt._split_batch(INDEXES, text)) == ['гарантия', 'ко`т']
+
+
+def test_mismatched_and_out_of_range_sections_are_dropped(chatgpt):
+    text = section(1, 'дом') + section(2, 'дом') + section(4, 'лишний')
+    assert list(chatgpt._split_batch(INDEXES, text)) == ['дом']
+
+
+def test_malformed_sections_are_dropped(chatgpt):
+    text = section(1, 'гарантия', senses=0) + 'no senses\n' + section(2, 'дом')
+    assert list(chatgpt._split_batch(INDEXES, text)) == ['дом']
+
+
+@pytest.mark.parametrize('copies', [2, 3])
+def test_duplicated_sections_are_dropped(chatgpt, copies):
+    text = section(1, 'гарантия') + section(2, 'дом') * copies
+    assert list(chatgpt._split_batch(INDEXES, text)) == ['гарантия']
+
+
+def test_truncated_last_section_is_dropped(chatgpt):
+    text = section(1, 'гарантия') + section(2, 'дом') + '=== 3. кот ===\n1. sen'
+    assert list(chatgpt._split_batch(INDEXES, text, truncated=True)) == \
+        ['гарантия', 'дом']
+    # the section before the cut is complete, and ends at the cut header
+    answers = chatgpt._split_batch(INDEXES[:2], section(1, 'гарантия') +
+                                   section(2, 'дом'), truncated=True)
+    assert list(answers) == ['гарантия']
+
+
+def test_complete_last_section_is_kept(chatgpt):
+    text = section(1, 'гарантия') + section(2, 'дом')
+    assert list(chatgpt._split_batch(INDEXES, text)) == ['гарантия', 'дом']
@@ -0,0 +1,51 @@
+import pytest
+
+from src.parsers import PARSERS
+from src.stand_in import render_page
+
+SLICES = ['кот', 'ко`т', 'noun, masculine\nRarely used word (top 7,000)',
+          'К\nЖивотные', 'cat\ntomcat Also: male cat', 'Кот спит. | The cat sleeps.']
+PAGE = render_page(SLICES)
+
+# pages html.parser and libxml2 read differently
+MALFORMED = {
+    'block in p': PAGE.replace('<p>noun, masculine</p>', '<p>noun<div>masc</div></p>'),
+    'unclosed p': PAGE.replace('noun, masculine</p>', 'noun, masculine'),
+    'p in p': PAGE.replace('<p>noun, masculine</p>', '<p>noun<p>masc</p></p>'),
+    'unclosed li': PAGE.replace('</span></li>', '</span>'),
+    'self-closed div': PAGE.replace('<div class="tags">', '<div/><div class="tags">'),
+    'stray end tag': PAGE.replace('</h1>', '</h1></span>'),
+    'stray lt': PAGE.replace('cat\n', 'cat < dog\n', 1),
+    'marked section': PAGE.replace('Rarely', '<![if x]>Rarely'),
+    'loose ampersand': PAGE.replace('tomcat', 'tom&amp cat'),
+    'unknown entity': PAGE.replace('tomcat', 'tom&notit;cat'),
+    'carriage return': PAGE.replace('\n', '\r\n'),
+    'no content': PAGE.replace('id="content"', 'id="main"'),
+}
+
+
+def extract(parser, index: str, html: str):
+    try:
+        return parser(index, html)
+    except Exception as e:
+        return type(e).__name__
+
+
+@pytest.mark.parametrize('name', list(PARSERS))
+def test_backends_extract_the_rendered_slices(name):
+    assert PARSERS[name]('кот', PAGE) == tuple(SLICES)
+
+
+@pytest.mark.parametrize('case', list(MALFORMED))
+@pytest.mark.parametrize('name', [name for name in PARSERS if name != 'bs4'])
+def test_backend_matches_bs4_on_malformed_markup(name, case):
+    html = MALFORMED[case]
+    assert extract(PARSERS[name], 'кот', html) == extract(PARSERS['bs4'], 'кот', html)
+
+
+@pytest.mark.parametrize('name', [name for name in PARSERS if name != 'bs4'])
+def test_backend_matches_bs4_on_well_formed_markup(name):
+    html = PAGE.replace('<p>noun, masculine</p>',
+                        '<p>noun, <b title="a > b">masc</b><br>uline<!-- <p> --></p>'
+                        '<script>if (a < b) {}</script>').replace('tomcat', 'tom&amp;cat')
+    assert extract(PARSERS[name], 'кот', html) == extract(PARSERS['bs4'], 'кот', html)
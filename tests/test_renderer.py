@@ -0,0 +1,91 @@
+import os
+import re
+
+import pytest
+
+from encode import English2RussianEncoder
+from src import FieldRenderer
+
+METADATASET_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'resources', 'datasets', 'russian', 'english', 'metadata')
+
+# the regex functions the English renderers replaced, as the reference
+NEWLINE_REGEX = re.compile('\n')
+NOTE_REGEX = re.compile('(Also|Example|Info)')
+GRAY_NOTE_REGEX = re.compile(' <br> (.*)$')
+PIPE_REGEX = re.compile(' \\| ')
+GRAY_EXAMPLE_REGEX = re.compile(' <br> (.*)</li>')
+
+
+def tags_regex(string: str) -> str:
+    return NEWLINE_REGEX.sub('<br>', string.strip('\n')).lower()
+
+
+def translation_regex(string: str) -> str:
+    _ = ['<ol>']
+    for translation in string.strip('\n').split('\n'):
+        translation = f'<li>{translation}</li>'
+        translation = NOTE_REGEX.sub(' <br> \\1', translation)
+        translation = GRAY_NOTE_REGEX.sub(' <br> <span style="color: gray">\\1</span>', translation)
+        _.append(translation)
+    _.append('</ol>')
+    return '\n'.join(_)
+
+
+def examples_regex(string: str) -> str:
+    _ = ['<ul class=\"partial_list\">']
+    for example in string.strip('\n').split('\n'):
+        example = f'<li>{example}</li>'
+        example = PIPE_REGEX.sub(' <br> ', example)
+        example = GRAY_EXAMPLE_REGEX.sub(' <br> <span style="color: gray">\\1</span></li>', example)
+        _.append(example)
+    _.append('</ul>')
+    return '\n'.join(_)
+
+
+FIELDS = [('Tags', 2, tags_regex),
+          ('Translation', 4, translation_regex),
+          ('Examples', 5, examples_regex)]
+
+SAMPLES = {
+    2: ['Noun\nFeminine\n', 'VERB\n', '\n'],
+    4: ['sensation Also: feeling\nfeeling\n',
+        'thing Example: a thing <br> with a note\n',
+        'Info without a break\n'],
+    5: ['Я здесь. | I am here.\nОн там. | He is there. <br> a note\n',
+        'a | b | c\n', 'no pipe\n'],
+}
+
+
+@pytest.mark.parametrize('field, position, reference', FIELDS)
+def test_renderers_match_regex_functions(field, position, reference):
+    renderer = English2RussianEncoder.renderers[field]
+    for string in SAMPLES[position]:
+        assert renderer(string) == reference(string)
+
+
+@pytest.mark.skipif(not os.path.isdir(METADATASET_PATH), reason='no English dataset')
+@pytest.mark.parametrize('field, position, reference', FIELDS)
+def test_renderers_match_regex_functions_on_dataset(field, position, reference):
+    renderer = English2RussianEncoder.renderers[field]
+    mismatches = list()
+    for entry in os.scandir(METADATASET_PATH):
+        if not entry.name.endswith('.txt'):
+            continue
+        with open(entry.path, 'r', encoding='utf-8') as file:
+            slices = list(filter(None, file.read().strip().split('++++++++++')))
+        if renderer(slices[position]) != reference(slices[position]):
+            mismatches.append(entry.name)
+    assert mismatches == []
+
+
+def test_rules_are_applied_in_one_pass():
+    renderer = FieldRenderer(rules=[('a', 'b'), ('b', 'a')])
+    # a sequential re.sub would turn every `a` into `b` and then back
+    assert renderer('ab\nba') == 'ba\nab'
+
+
+def test_tail_is_wrapped_before_the_closing_tag():
+    renderer = FieldRenderer(item=('<li>', '</li>'), tail=(' | ', '<i>', '</i>'),
+                             tail_closed=True)
+    assert renderer('x | y\nz') == '<li>x | <i>y</i></li>\n<li>z</li>'